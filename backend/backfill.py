@@ -0,0 +1,258 @@
+"""
+One-off migrations for the DynamoDB tables.
+
+Usage:
+    python backfill.py feed-index
+    python backfill.py feed-index-cleanup
+    python backfill.py likes-set
+    python backfill.py usernames
+"""
+
+import sys
+from typing import Dict, Any
+
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+
+from main import (
+    get_table,
+    get_dynamodb,
+    DYNAMODB_TABLE_NAME,
+    DYNAMODB_USERS_TABLE_NAME,
+    DYNAMODB_USERNAMES_TABLE_NAME,
+    DYNAMODB_FEED_INDEX_NAME,
+    FEED_INDEX_ATTRIBUTES,
+    feed_shard,
+)
+
+# The unsharded feed index (partition key feedPartition) replaced by the sharded one
+LEGACY_FEED_INDEX_NAME = 'feed-index'
+
+
+def scan_all(table, **scan_kwargs) -> list:
+    """
+    Scan a whole table, following LastEvaluatedKey.
+
+    Args:
+        table: The DynamoDB Table resource.
+        scan_kwargs: Extra arguments for the scan.
+
+    Returns:
+        A list of all scanned items.
+    """
+
+    items = []
+    while True:
+        response = table.scan(**scan_kwargs)
+        items.extend(response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return items
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def create_feed_index() -> None:
+    """
+    Create the sharded public feed GSI on the cars table if it does not exist yet. Only the attributes the feed
+    shows are projected, so likes don't write to the index.
+    """
+
+    cars_table = get_table(DYNAMODB_TABLE_NAME)
+
+    existing = {index['IndexName'] for index in cars_table.global_secondary_indexes or []}
+    if DYNAMODB_FEED_INDEX_NAME in existing:
+        print(f"Index {DYNAMODB_FEED_INDEX_NAME} already exists")
+        return
+
+    index: Dict[str, Any] = {
+        'IndexName': DYNAMODB_FEED_INDEX_NAME,
+        'KeySchema': [
+            {'AttributeName': 'feedShard', 'KeyType': 'HASH'},
+            {'AttributeName': 'savedAt', 'KeyType': 'RANGE'},
+        ],
+        'Projection': {'ProjectionType': 'INCLUDE', 'NonKeyAttributes': FEED_INDEX_ATTRIBUTES},
+    }
+
+    # Provisioned tables need throughput for the index too
+    if cars_table.billing_mode_summary is None or \
+            cars_table.billing_mode_summary.get('BillingMode') == 'PROVISIONED':
+        throughput = cars_table.provisioned_throughput
+        index['ProvisionedThroughput'] = {
+            'ReadCapacityUnits': throughput['ReadCapacityUnits'],
+            'WriteCapacityUnits': throughput['WriteCapacityUnits'],
+        }
+
+    cars_table.update(
+        AttributeDefinitions=[
+            {'AttributeName': 'feedShard', 'AttributeType': 'S'},
+            {'AttributeName': 'savedAt', 'AttributeType': 'S'},
+        ],
+        GlobalSecondaryIndexUpdates=[{'Create': index}]
+    )
+    print(f"Creating index {DYNAMODB_FEED_INDEX_NAME} (this runs in the background on DynamoDB)")
+
+
+def backfill_feed_shard() -> None:
+    """
+    Add feedShard to existing public posts so they appear in the feed index.
+    """
+
+    cars_table = get_table(DYNAMODB_TABLE_NAME)
+
+    items = scan_all(
+        cars_table,
+        ProjectionExpression="userId, savedAt, isPrivate, feedShard"
+    )
+
+    updated = 0
+    for item in items:
+        shard = feed_shard(item['userId'], item['savedAt'])
+        if item.get('isPrivate') or item.get('feedShard') == shard:
+            continue
+
+        cars_table.update_item(
+            Key={'userId': item['userId'], 'savedAt': item['savedAt']},
+            UpdateExpression='SET feedShard = :shard',
+            ExpressionAttributeValues={':shard': shard}
+        )
+        updated += 1
+
+    print(f"Added {updated} public posts to the feed index")
+
+
+def drop_legacy_feed_index() -> None:
+    """
+    Delete the unsharded feed GSI and the feedPartition attribute it was keyed on (run once the sharded index is
+    active and the API no longer queries the old one).
+    """
+
+    cars_table = get_table(DYNAMODB_TABLE_NAME)
+
+    existing = {index['IndexName'] for index in cars_table.global_secondary_indexes or []}
+    if LEGACY_FEED_INDEX_NAME in existing:
+        cars_table.update(GlobalSecondaryIndexUpdates=[{'Delete': {'IndexName': LEGACY_FEED_INDEX_NAME}}])
+        print(f"Deleting index {LEGACY_FEED_INDEX_NAME} (this runs in the background on DynamoDB)")
+
+    items = scan_all(
+        cars_table,
+        ProjectionExpression="userId, savedAt",
+        FilterExpression=Attr('feedPartition').exists()
+    )
+
+    for item in items:
+        cars_table.update_item(
+            Key={'userId': item['userId'], 'savedAt': item['savedAt']},
+            UpdateExpression='REMOVE feedPartition'
+        )
+
+    print(f"Removed feedPartition from {len(items)} posts")
+
+
+def convert_likes_to_sets() -> None:
+    """
+    Convert likedBy from a list to a string set on existing posts (empty lists are removed).
+    """
+
+    cars_table = get_table(DYNAMODB_TABLE_NAME)
+
+    items = scan_all(
+        cars_table,
+        ProjectionExpression="userId, savedAt, likedBy",
+        FilterExpression=Attr('likedBy').attribute_type('L')
+    )
+
+    converted = 0
+    for item in items:
+        liked_by = item['likedBy']
+        key = {'userId': item['userId'], 'savedAt': item['savedAt']}
+
+        # Only convert if the list has not changed since the scan
+        try:
+            if liked_by:
+                cars_table.update_item(
+                    Key=key,
+                    UpdateExpression='SET likedBy = :liked_by',
+                    ConditionExpression='likedBy = :old',
+                    ExpressionAttributeValues={':liked_by': set(liked_by), ':old': liked_by}
+                )
+            else:
+                cars_table.update_item(
+                    Key=key,
+                    UpdateExpression='REMOVE likedBy',
+                    ConditionExpression='likedBy = :old',
+                    ExpressionAttributeValues={':old': liked_by}
+                )
+            converted += 1
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                raise
+            print(f"Skipped {item['userId']}/{item['savedAt']} (changed during the migration)")
+
+    print(f"Converted likes on {converted} posts")
+
+
+def create_usernames_table() -> None:
+    """
+    Create the username reservations table if it does not exist yet.
+    """
+
+    client = get_dynamodb().meta.client
+    if DYNAMODB_USERNAMES_TABLE_NAME in client.list_tables()['TableNames']:
+        print(f"Table {DYNAMODB_USERNAMES_TABLE_NAME} already exists")
+        return
+
+    client.create_table(
+        TableName=DYNAMODB_USERNAMES_TABLE_NAME,
+        KeySchema=[{'AttributeName': 'username', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'username', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    client.get_waiter('table_exists').wait(TableName=DYNAMODB_USERNAMES_TABLE_NAME)
+    print(f"Created table {DYNAMODB_USERNAMES_TABLE_NAME}")
+
+
+def backfill_usernames() -> None:
+    """
+    Reserve the usernames of existing users. Usernames already shared by several users are reported and kept
+    by the first user reserved.
+    """
+
+    users_table = get_table(DYNAMODB_USERS_TABLE_NAME)
+    usernames_table = get_table(DYNAMODB_USERNAMES_TABLE_NAME)
+
+    users = scan_all(users_table, ProjectionExpression="userId, username")
+
+    reserved = 0
+    for user in users:
+        if not user.get('username'):
+            continue
+
+        try:
+            usernames_table.put_item(
+                Item={'username': user['username'], 'userId': user['userId']},
+                ConditionExpression='attribute_not_exists(username) OR userId = :user_id',
+                ExpressionAttributeValues={':user_id': user['userId']}
+            )
+            reserved += 1
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                raise
+            print(f"Username {user['username']} of {user['userId']} is already taken by another user")
+
+    print(f"Reserved {reserved} usernames")
+
+
+MIGRATIONS = {
+    'feed-index': [create_feed_index, backfill_feed_shard],
+    'feed-index-cleanup': [drop_legacy_feed_index],
+    'likes-set': [convert_likes_to_sets],
+    'usernames': [create_usernames_table, backfill_usernames],
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] not in MIGRATIONS:
+        print(f"Usage: python backfill.py <{'|'.join(MIGRATIONS)}>")
+        sys.exit(1)
+
+    for migration in MIGRATIONS[sys.argv[1]]:
+        migration()
@@ -0,0 +1,116 @@
+"""
+Benchmark feed response serialization: body bytes and CPU time per feed size, for the default FastAPI path
+(return-type validation, jsonable_encoder and stdlib json) and the fast path (orjson, then gzip or brotli).
+
+Usage (from the backend directory):
+    python benchmarks/bench_feed_response.py [--posts 100 1000 5000] [--runs 5]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from decimal import Decimal
+from typing import Any, Dict
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+from starlette.requests import Request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from main import json_response, brotli, orjson, image_srcset
+
+BUCKET_URL = "https://bucket.s3.us-east-1.amazonaws.com"
+MAKES = ["Toyota", "Honda", "Ford", "BMW", "Porsche", "Mazda", "Nissan", "Audi"]
+
+
+def make_feed(posts: int) -> Dict[str, Any]:
+    """Build a feed response like /get-all-cars, with the Decimal likes DynamoDB returns"""
+
+    rng = random.Random(posts)
+    cars = []
+    for index in range(posts):
+        user_id = f"{rng.getrandbits(128):032x}"
+        image_url = f"{BUCKET_URL}/{user_id}/{rng.getrandbits(128):032x}.jpg"
+        car = {
+            'userId': user_id,
+            'savedAt': f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T12:{index % 60:02d}:00.000Z",
+            'carInfo': {
+                'make': rng.choice(MAKES),
+                'model': f"Model {rng.randint(1, 99)}",
+                'year': str(rng.randint(1960, 2025)),
+                'link': None,
+            },
+            'imageUrl': image_url,
+            'imageSrcSet': image_srcset(image_url, {'small.webp': Decimal(320), 'medium.webp': Decimal(640), 'jpg': Decimal(800)}),
+            'likes': Decimal(rng.randint(0, 500)),
+            'likedByViewer': False,
+            'username': f"user{rng.randint(1, 10000)}",
+            'profilePicture': f"{BUCKET_URL}/{user_id}/profile_{rng.getrandbits(64):016x}.jpg"
+        }
+        if rng.random() < 0.5:
+            car['description'] = "Spotted downtown, " * rng.randint(1, 8)
+        cars.append(car)
+
+    return {"success": True, "cars": cars, "nextCursor": None}
+
+
+def make_request(accept_encoding: str) -> Request:
+    headers = [(b'accept-encoding', accept_encoding.encode())] if accept_encoding else []
+    return Request({'type': 'http', 'method': 'GET', 'path': '/get-all-cars', 'headers': headers})
+
+
+# The response field FastAPI builds from the previous return annotation, and a loop to run its serializer on
+RESPONSE_FIELD = create_model_field(name='Response_get_all_cars', type_=Dict[str, Any], mode='serialization')
+LOOP = asyncio.new_event_loop()
+
+
+def default_path(content: Dict[str, Any]) -> bytes:
+    """What FastAPI does with a dict returned from an endpoint annotated Dict[str, Any]"""
+    serialized = LOOP.run_until_complete(serialize_response(field=RESPONSE_FIELD, response_content=content))
+    return JSONResponse(serialized).body
+
+
+def fast_path(content: Dict[str, Any], accept_encoding: str) -> bytes:
+    """Encode and compress without the rendered body cache (as on every snapshot change)"""
+    return LOOP.run_until_complete(json_response(make_request(accept_encoding), content)).body
+
+
+def median_cpu_ms(func, runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        start = time.process_time()
+        func()
+        timings.append(time.process_time() - start)
+    timings.sort()
+    return timings[len(timings) // 2] * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--posts', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    encodings = ['', 'gzip'] + (['br'] if brotli is not None else [])
+    print(f"JSON encoder: {'orjson' if orjson is not None else 'stdlib json (orjson not installed)'}")
+    print(f"{'posts':>7}{'path':>10}{'encoding':>10}{'bytes':>12}{'CPU ms':>10}")
+    for posts in args.posts:
+        content = make_feed(posts)
+
+        body = default_path(content)
+        cpu_ms = median_cpu_ms(lambda: default_path(content), args.runs)
+        print(f"{posts:>7}{'default':>10}{'identity':>10}{len(body):>12}{cpu_ms:>10.2f}")
+
+        for encoding in encodings:
+            body = fast_path(content, encoding)
+            cpu_ms = median_cpu_ms(lambda: fast_path(content, encoding), args.runs)
+            print(f"{posts:>7}{'fast':>10}{encoding or 'identity':>10}{len(body):>12}{cpu_ms:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
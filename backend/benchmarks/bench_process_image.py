@@ -0,0 +1,139 @@
+"""
+Benchmark the image pipeline: latency and peak memory per input size, before and after the reduced decode path.
+
+Each measurement runs in a fresh process so peak RSS is not skewed by earlier runs.
+
+Usage (from the backend directory):
+    python benchmarks/bench_process_image.py [--sizes 12 48] [--formats jpeg heic] [--runs 3]
+"""
+
+import argparse
+import io
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from PIL import Image
+import pillow_heif
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# Megapixels to benchmark and their (width, height) at 4:3
+SIZES = {3: (2000, 1500), 12: (4000, 3000), 24: (5664, 4248), 48: (8000, 6000)}
+
+
+def legacy_process_image_bytes(image_data: bytes) -> tuple:
+    """The pipeline before the reduced decode path: full decode, convert, resize and a second encode for HEIC"""
+
+    image_bytes = io.BytesIO(image_data)
+    try:
+        pil_image = Image.open(image_bytes)
+    except Image.UnidentifiedImageError:
+        heif_image = pillow_heif.open_heif(image_bytes)
+        pil_image = Image.frombytes(heif_image.mode, heif_image.size, heif_image.data)
+        buffer = io.BytesIO()
+        pil_image.save(buffer, format="JPEG", quality=75)
+        image_data = buffer.getvalue()
+
+    pil_image = pil_image.convert('RGB')
+    max_size = 800
+    width, height = pil_image.size
+    if width > max_size or height > max_size:
+        if width > height:
+            new_size = (max_size, int(height * (max_size / width)))
+        else:
+            new_size = (int(width * (max_size / height)), max_size)
+        pil_image = pil_image.resize(new_size, Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    pil_image.save(buffer, format="JPEG", quality=75)
+    return pil_image, buffer.getvalue()
+
+
+def make_input(megapixels: int, image_format: str) -> bytes:
+    """Create a photo-like test image (gradient plus noise) of the given size and format"""
+
+    width, height = SIZES[megapixels]
+    noise = Image.effect_noise((width, height), 48)
+    gradient = Image.linear_gradient('L').resize((width, height))
+    pil_image = Image.merge('RGB', (noise, gradient, Image.blend(noise, gradient, 0.5)))
+
+    buffer = io.BytesIO()
+    if image_format == 'heic':
+        pillow_heif.from_pillow(pil_image).save(buffer, quality=80)
+    else:
+        pil_image.save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def reset_peak_rss() -> None:
+    """Reset this process's peak RSS (Linux only; ru_maxrss would include the parent's peak)"""
+    with open('/proc/self/clear_refs', 'w') as f:
+        f.write('5')
+
+
+def read_rss_mb(field: str) -> float:
+    """Read a memory field (VmRSS or VmHWM, the peak since the last reset) of this process in MB"""
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) / 1024
+    raise RuntimeError(f"{field} not found in /proc/self/status")
+
+
+def measure(path: str, pipeline: str, runs: int, results) -> None:
+    """Run one pipeline on one input in this (fresh) process and report the median latency and peak RSS growth"""
+
+    if pipeline == 'current':
+        from image_pipeline import process_image_bytes
+    else:
+        process_image_bytes = legacy_process_image_bytes
+
+    with open(path, 'rb') as f:
+        image_data = f.read()
+
+    reset_peak_rss()
+    baseline_mb = read_rss_mb('VmRSS')
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        process_image_bytes(image_data)
+        timings.append(time.perf_counter() - start)
+    peak_mb = read_rss_mb('VmHWM')
+
+    timings.sort()
+    results.put((timings[len(timings) // 2], peak_mb - baseline_mb))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES), choices=list(SIZES), help="megapixels")
+    parser.add_argument('--formats', nargs='+', default=['jpeg', 'heic'], choices=['jpeg', 'heic'])
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    print(f"{'input':<12}{'bytes':>12}{'pipeline':>10}{'latency ms':>12}{'peak RSS MB':>13}")
+    print("(peak RSS is the growth over the process's RSS before processing)")
+    for image_format in args.formats:
+        for megapixels in args.sizes:
+            image_data = make_input(megapixels, image_format)
+            with tempfile.NamedTemporaryFile(suffix=f'.{image_format}', delete=False) as f:
+                f.write(image_data)
+            try:
+                for pipeline in ('legacy', 'current'):
+                    results = context.Queue()
+                    process = context.Process(target=measure, args=(f.name, pipeline, args.runs, results))
+                    process.start()
+                    latency, peak_mb = results.get()
+                    process.join()
+                    label = f"{megapixels}MP {image_format}"
+                    print(f"{label:<12}{len(image_data):>12}{pipeline:>10}{latency * 1000:>12.1f}{peak_mb:>13.1f}")
+            finally:
+                os.unlink(f.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+The image pipeline run in the image worker pool.
+
+Worker processes are spawned and import this module, so it only depends on Pillow and must not have side effects
+(no clients, caches or threads are created at import).
+"""
+
+import io
+import os
+from typing import Dict
+
+from PIL import Image
+import pillow_heif
+
+# Longest side (in pixels) of processed images
+MAX_IMAGE_SIZE = 800
+
+# Smaller derivatives stored next to each processed image, by longest side, in WebP (and AVIF if enabled and
+# supported by Pillow). They are stored as {hash}_{name}.{format} next to the {hash}.jpg image.
+IMAGE_VARIANT_SIZES = {'small': 320, 'medium': 640}
+IMAGE_VARIANT_FORMATS = ['webp']
+if os.getenv('IMAGE_AVIF_ENABLED', 'false').lower() in ('1', 'true', 'yes') and 'AVIF' in Image.SAVE:
+    IMAGE_VARIANT_FORMATS.append('avif')
+IMAGE_VARIANT_OPTIONS = {
+    'webp': {'quality': 75, 'method': 4},
+    'avif': {'quality': 60, 'speed': 8}
+}
+
+
+def process_image_bytes(image_data: bytes, max_size: int = MAX_IMAGE_SIZE) -> tuple:
+    """
+    Decode, downscale and JPEG-encode an image with optimized memory usage.
+
+    JPEGs are decoded directly at a reduced scale (DCT scaling), so full-resolution pixels are never materialized.
+    HEIF images can only be decoded at full resolution, so they are shrunk with a fast integer reduce before resampling.
+    The result is encoded exactly once.
+
+    Args:
+        image_data: The data of an image in bytes.
+        max_size: The longest side of the processed image.
+
+    Returns:
+        A tuple containing the processed PIL image and its JPEG bytes.
+    """
+
+    try:
+        try:
+            pil_image = Image.open(io.BytesIO(image_data))
+        except Image.UnidentifiedImageError:
+            # Use pillow-heif to decode the image if it's HEIF (common file type for Apple images)
+            heif_file = pillow_heif.open_heif(io.BytesIO(image_data))
+            pil_image = heif_file.to_pillow()
+            # Release libheif's decoded buffer before resampling
+            del heif_file
+
+        # Palette and bilevel images can only be resized with nearest neighbour, so convert them first
+        if pil_image.mode not in ('RGB', 'RGBA', 'L', 'CMYK'):
+            pil_image = pil_image.convert('RGB')
+
+        # Downscale in place: JPEGs use draft mode (reduced decode), then an integer reduce and a LANCZOS resample
+        pil_image.thumbnail((max_size, max_size), Image.LANCZOS, reducing_gap=2.0)
+
+        # Ensure that image is RGB
+        if pil_image.mode != 'RGB':
+            pil_image = pil_image.convert('RGB')
+
+        # Encode once (also converts HEIC so it displays on non-Safari browsers)
+        buffer = io.BytesIO()
+        pil_image.save(buffer, format="JPEG", quality=75)
+        processed_data = buffer.getvalue()
+        buffer.close()
+        
+        return pil_image, processed_data
+    except Exception as e:
+        print(f"Error processing image: {str(e)}")
+        raise e
+
+
+def generate_perceptual_hash(pil_image: Image.Image) -> int:
+    """
+    Generate a perceptual hash (64-bit dHash) of an image.
+
+    Unlike generate_image_hash, re-encoded, resized or slightly cropped copies of an image get the same or a nearby hash.
+
+    Args:
+        pil_image: The decoded PIL image.
+
+    Returns:
+        The hash as a 64-bit integer.
+    """
+
+    # Compare the brightness of horizontally adjacent pixels on a 9x8 grayscale thumbnail
+    pixels = list(pil_image.convert('L').resize((9, 8), Image.LANCZOS).getdata())
+    phash = 0
+    for row in range(8):
+        for col in range(8):
+            phash = (phash << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return phash
+
+
+def prepare_prediction_image(image_data: bytes) -> tuple:
+    """
+    Process an image for prediction (runs in the image worker pool).
+
+    Args:
+        image_data: The data of an image in bytes.
+
+    Returns:
+        A tuple containing the processed PIL image, its JPEG bytes and its perceptual hash.
+    """
+
+    pil_image, processed_data = process_image_bytes(image_data)
+    return pil_image, processed_data, generate_perceptual_hash(pil_image)
+
+
+def encode_image_variants(pil_image: Image.Image) -> Dict[str, tuple]:
+    """
+    Encode the smaller derivatives of a processed image, each downscaled from the next larger one.
+
+    Args:
+        pil_image: The processed (RGB, at most MAX_IMAGE_SIZE) PIL image.
+
+    Returns:
+        A dict from variant name (e.g. "small.webp") to a tuple of the encoded bytes and the image width.
+    """
+
+    variants = {}
+    image = pil_image
+    for name, size in sorted(IMAGE_VARIANT_SIZES.items(), key=lambda variant: -variant[1]):
+        image = image.copy()
+        image.thumbnail((size, size), Image.LANCZOS, reducing_gap=2.0)
+        for image_format in IMAGE_VARIANT_FORMATS:
+            buffer = io.BytesIO()
+            image.save(buffer, format=image_format.upper(), **IMAGE_VARIANT_OPTIONS[image_format])
+            variants[f"{name}.{image_format}"] = (buffer.getvalue(), image.width)
+    return variants
+
+
+def prepare_saved_image(image_data: bytes) -> tuple:
+    """
+    Process an image for storage (runs in the image worker pool). The image is decoded once for the JPEG, the
+    derivatives and the perceptual hash.
+
+    Args:
+        image_data: The data of an image in bytes.
+
+    Returns:
+        A tuple containing the JPEG bytes, the derivatives (see encode_image_variants) with the JPEG added under
+        "jpg", and the perceptual hash.
+    """
+
+    pil_image, processed_data = process_image_bytes(image_data)
+    variants = encode_image_variants(pil_image)
+    variants['jpg'] = (processed_data, pil_image.width)
+    return processed_data, variants, generate_perceptual_hash(pil_image)
@@ -1,30 +1,63 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks
+from fastapi import FastAPI, File, Form, UploadFile, HTTPException, BackgroundTasks, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from PIL import Image
-import io
+from fastapi.responses import StreamingResponse, JSONResponse
 import google.generativeai as genai
-import pillow_heif
+from google.api_core import exceptions as google_exceptions
 import os
 from dotenv import load_dotenv
 import json
+import re
 import boto3
 import boto3.session
+from botocore.config import Config
+from botocore.exceptions import ClientError
 from boto3.dynamodb.conditions import Key, Attr
 import hashlib
 import base64
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
-import requests
+import httpx
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import asyncio
-from cachetools import TTLCache
-from functools import lru_cache
+import time
+import random
+import secrets
+import threading
+import gc
+import bisect
+import gzip
+from decimal import Decimal
+from collections import OrderedDict
+import multiprocessing
+from cachetools import TLRUCache, TTLCache
+from functools import lru_cache, partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Optional dependency for the shared cache backend
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Optional dependencies for fast JSON responses and brotli compression
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 # Load environment variables
 load_dotenv()
 
+# Image processing, run in the image worker pool (imported after load_dotenv since it reads its settings at import)
+from image_pipeline import IMAGE_VARIANT_SIZES, prepare_prediction_image, prepare_saved_image
+
 app = FastAPI()
 
 # Enable CORS
@@ -52,27 +85,568 @@ def get_boto3_session():
         aws_secret_access_key=aws_secret_key
     )
 
-# Get resource and client from the session pool
+# Tuned configuration for all AWS clients: connection pool sized for the I/O thread pool, keep-alive,
+# adaptive retries (client-side rate limiting when throttled) and timeouts
+AWS_CLIENT_CONFIG = Config(
+    max_pool_connections=int(os.getenv('AWS_MAX_POOL_CONNECTIONS', 50)),
+    tcp_keepalive=True,
+    retries={'mode': 'adaptive', 'max_attempts': int(os.getenv('AWS_MAX_ATTEMPTS', 5))},
+    connect_timeout=float(os.getenv('AWS_CONNECT_TIMEOUT', 3)),
+    read_timeout=float(os.getenv('AWS_READ_TIMEOUT', 10))
+)
+
+# Long-lived clients, resource and Table handles shared across requests. Sessions and resources are not
+# thread-safe to create, so creation is serialized; clients are thread-safe and Table handles are only used
+# for their (stateless) request actions.
+_aws_lock = threading.Lock()
+_aws_clients = {}
+_dynamodb_tables = {}
+
+def get_aws_client(service: str):
+    """Get the shared client for an AWS service, creating it once"""
+    client = _aws_clients.get(service)
+    if client is None:
+        with _aws_lock:
+            client = _aws_clients.get(service)
+            if client is None:
+                client = _aws_clients[service] = get_boto3_session().client(service, config=AWS_CLIENT_CONFIG)
+    return client
+
 def get_dynamodb():
-    """Get a DynamoDB resource from the connection pool"""
-    session = get_boto3_session()
-    return session.resource('dynamodb')
+    """Get the shared DynamoDB resource, creating it once"""
+    dynamodb = _aws_clients.get('dynamodb-resource')
+    if dynamodb is None:
+        with _aws_lock:
+            dynamodb = _aws_clients.get('dynamodb-resource')
+            if dynamodb is None:
+                dynamodb = _aws_clients['dynamodb-resource'] = get_boto3_session().resource(
+                    'dynamodb', config=AWS_CLIENT_CONFIG
+                )
+    return dynamodb
+
+def get_table(table_name: str):
+    """Get the shared Table handle for a DynamoDB table, creating it once"""
+    table = _dynamodb_tables.get(table_name)
+    if table is None:
+        dynamodb = get_dynamodb()
+        with _aws_lock:
+            table = _dynamodb_tables.get(table_name)
+            if table is None:
+                table = _dynamodb_tables[table_name] = dynamodb.Table(table_name)
+    return table
 
 def get_s3_client():
-    """Get an S3 client from the connection pool"""
-    session = get_boto3_session()
-    return session.client('s3')
+    """Get the shared S3 client"""
+    return get_aws_client('s3')
 
 def get_cognito_client():
-    """Get a Cognito client from the connection pool"""
-    session = get_boto3_session()
-    return session.client('cognito-idp')
+    """Get the shared Cognito client"""
+    return get_aws_client('cognito-idp')
+
+# Thread pool for blocking I/O (boto3 and the shared cache), so async endpoints never block the event loop
+aws_executor = ThreadPoolExecutor(max_workers=int(os.getenv('AWS_IO_WORKERS', 32)), thread_name_prefix='aws-io')
+
+async def run_io(func, *args, **kwargs):
+    """Run a blocking I/O call on the I/O thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(aws_executor, partial(func, *args, **kwargs))
+
+@app.on_event("startup")
+def create_aws_clients():
+    """Create the AWS clients and Table handles once at startup instead of on the first requests"""
+    get_s3_client()
+    for table_name in (DYNAMODB_TABLE_NAME, DYNAMODB_USERS_TABLE_NAME, DYNAMODB_USERNAMES_TABLE_NAME):
+        if table_name:
+            get_table(table_name)
+
+@app.on_event("shutdown")
+def shutdown_aws_executor():
+    """Wait for in-flight I/O calls"""
+    aws_executor.shutdown(wait=True)
+
+# Marker for a key that is not in a cache
+CACHE_MISS = object()
+
+class _CountingTLRUCache(TLRUCache):
+    """TLRUCache that counts capacity evictions and expirations"""
+
+    def __init__(self, maxsize, ttu):
+        super().__init__(maxsize=maxsize, ttu=ttu)
+        self.evictions = 0
+        self.expirations = 0
+
+    def popitem(self):
+        # Called when the cache is full and the least recently used entry is evicted
+        self.evictions += 1
+        return super().popitem()
+
+    def expire(self, time=None):
+        expired = super().expire(time)
+        self.expirations += len(expired)
+        return expired
+
+
+class CacheBackend:
+    """
+    Storage behind the caches. Values must be JSON serializable (None is a valid value).
+
+    get returns CACHE_MISS for keys that are not cached.
+    """
+
+    def get(self, key: str):
+        raise NotImplementedError
+
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """Get the cached values for the keys that are cached"""
+        values = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not CACHE_MISS:
+                values[key] = value
+        return values
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+    def start(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class InProcessCacheBackend(CacheBackend):
+    """Cache backend local to this worker process (LRU with a TTL per entry)"""
+
+    def __init__(self, maxsize: int):
+        # Entries are stored as (value, ttl) so each entry can have its own TTL
+        self._cache = _CountingTLRUCache(maxsize=maxsize, ttu=lambda key, entry, now: now + entry[1])
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._cache.get(key)
+            return entry[0] if entry is not None else CACHE_MISS
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        with self._lock:
+            self._cache[key] = (value, ttl)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._cache.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'size': len(self._cache),
+                'maxsize': self._cache.maxsize,
+                'evictions': self._cache.evictions,
+                'expirations': self._cache.expirations
+            }
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Cache backend shared by all workers, stored in a Redis-protocol server.
+
+    Errors talking to the server are logged and treated as cache misses so the API keeps working without it.
+    """
+
+    def __init__(self, client, prefix: str = 'wtc:'):
+        self.client = client
+        self.prefix = prefix
+        self.errors = 0
+
+    def get(self, key: str):
+        return self.get_many([key]).get(key, CACHE_MISS)
+
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        if not keys:
+            return {}
+        try:
+            raw_values = self.client.mget([self.prefix + key for key in keys])
+        except Exception as e:
+            self.errors += 1
+            print(f"Warning: Could not read from shared cache: {str(e)}")
+            return {}
+        return {key: json.loads(raw) for key, raw in zip(keys, raw_values) if raw is not None}
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        try:
+            self.client.set(self.prefix + key, json.dumps(value), px=max(1, int(ttl * 1000)))
+        except Exception as e:
+            self.errors += 1
+            print(f"Warning: Could not write to shared cache: {str(e)}")
+
+    def delete(self, key: str) -> None:
+        try:
+            self.client.delete(self.prefix + key)
+        except Exception as e:
+            self.errors += 1
+            print(f"Warning: Could not delete from shared cache: {str(e)}")
+
+    def pop(self, key: str):
+        """Get and delete a value atomically (only one caller gets it), or CACHE_MISS if not cached"""
+        try:
+            raw = self.client.getdel(self.prefix + key)
+        except Exception as e:
+            self.errors += 1
+            print(f"Warning: Could not read from shared cache: {str(e)}")
+            return CACHE_MISS
+        return json.loads(raw) if raw is not None else CACHE_MISS
+
+    def stats(self) -> Dict[str, Any]:
+        return {'errors': self.errors}
+
+
+class TieredCacheBackend(CacheBackend):
+    """
+    In-process cache in front of a shared cache.
+
+    Writes go to both tiers and are broadcast over pub/sub so the other workers drop their stale local copies.
+    Local entries are kept for at most local_ttl in case a broadcast is missed. The subscription is made by start()
+    in the background and retried until the server is reachable; the local tier is cleared whenever broadcasts may
+    have been missed (before subscribing and after a dropped connection).
+    """
+
+    def __init__(self, local: InProcessCacheBackend, shared: RedisCacheBackend, local_ttl: float,
+                 channel: str = 'wtc:cache-invalidate'):
+        self.local = local
+        self.shared = shared
+        self.local_ttl = local_ttl
+        self.channel = channel
+        # Identifies this worker so it can ignore its own broadcasts
+        self.origin = os.urandom(8).hex()
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self.invalidations_sent = 0
+        self.invalidations_received = 0
+        self.listener_errors = 0
+
+        # Creating the pub/sub object does not connect yet
+        self._pubsub = shared.client.pubsub(ignore_subscribe_messages=True)
+        self._subscriber = None
+        self._listener = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        """Listen for invalidations from other workers in a background thread"""
+        if self._subscriber is None:
+            self._subscriber = threading.Thread(target=self._subscribe, name='cache-invalidate', daemon=True)
+            self._subscriber.start()
+
+    def _subscribe(self) -> None:
+        delay = 1.0
+        while not self._stopped.is_set():
+            try:
+                self._pubsub.subscribe(**{self.channel: self._on_invalidate})
+                break
+            except Exception as e:
+                self.listener_errors += 1
+                print(f"Warning: Could not subscribe to cache invalidations (retrying in {delay:g}s): {str(e)}")
+                self._stopped.wait(delay)
+                delay = min(delay * 2, 30.0)
+        else:
+            return
+
+        # Broadcasts sent before the subscription were missed
+        self.local.clear()
+        self._listener = self._pubsub.run_in_thread(
+            sleep_time=1, daemon=True, exception_handler=self._on_listener_error
+        )
+
+    def _on_listener_error(self, error: BaseException, pubsub, thread) -> None:
+        # The next read reconnects and resubscribes; broadcasts sent while disconnected were missed
+        self.listener_errors += 1
+        print(f"Warning: Lost cache invalidation subscription: {str(error)}")
+        self.local.clear()
+        self._stopped.wait(1.0)
+
+    def _on_invalidate(self, message) -> None:
+        try:
+            payload = json.loads(message['data'])
+        except (ValueError, TypeError):
+            return
+        if payload.get('origin') != self.origin:
+            self.invalidations_received += 1
+            self.local.delete(payload.get('key'))
+
+    def _broadcast_invalidate(self, key: str) -> None:
+        try:
+            self.shared.client.publish(self.channel, json.dumps({'origin': self.origin, 'key': key}))
+            self.invalidations_sent += 1
+        except Exception as e:
+            print(f"Warning: Could not broadcast cache invalidation: {str(e)}")
+
+    def get(self, key: str):
+        return self.get_many([key]).get(key, CACHE_MISS)
+
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        values = self.local.get_many(keys)
+        missing = [key for key in keys if key not in values]
+
+        # Fill local misses from the shared tier
+        shared_values = self.shared.get_many(missing)
+        self.shared_hits += len(shared_values)
+        self.shared_misses += len(missing) - len(shared_values)
+        for key, value in shared_values.items():
+            self.local.set(key, value, self.local_ttl)
+
+        values.update(shared_values)
+        return values
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        self.local.set(key, value, min(ttl, self.local_ttl))
+        self.shared.set(key, value, ttl)
+        self._broadcast_invalidate(key)
+
+    def delete(self, key: str) -> None:
+        self.local.delete(key)
+        self.shared.delete(key)
+        self._broadcast_invalidate(key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'local': self.local.stats(),
+            'shared': self.shared.stats(),
+            'sharedHits': self.shared_hits,
+            'sharedMisses': self.shared_misses,
+            'invalidationsSent': self.invalidations_sent,
+            'invalidationsReceived': self.invalidations_received,
+            'listening': self._listener is not None,
+            'listenerErrors': self.listener_errors
+        }
+
+    def close(self) -> None:
+        self._stopped.set()
+        if self._listener is not None:
+            self._listener.stop()
+        try:
+            self._pubsub.close()
+        except Exception as e:
+            print(f"Warning: Could not close cache invalidation subscription: {str(e)}")
+
+
+def create_cache_backend(maxsize: int) -> CacheBackend:
+    """
+    Create the cache backend configured with CACHE_BACKEND ("memory" or "redis").
+
+    Args:
+        maxsize: The maximum number of entries kept in this worker.
+
+    Returns:
+        The cache backend.
+    """
+
+    backend = os.getenv('CACHE_BACKEND', 'memory')
+    if backend == 'memory':
+        return InProcessCacheBackend(maxsize=maxsize)
+    if backend == 'redis':
+        if redis is None:
+            raise RuntimeError("CACHE_BACKEND=redis requires the redis package")
+        client = redis.Redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+        return TieredCacheBackend(
+            local=InProcessCacheBackend(maxsize=maxsize),
+            shared=RedisCacheBackend(client),
+            local_ttl=float(os.getenv('CACHE_LOCAL_TTL', 60))
+        )
+    raise RuntimeError(f"Unknown CACHE_BACKEND: {backend}")
+
+
+class ProfileCache:
+    """
+    Cache of user profiles (username and profile photo URL stored together).
+
+    Users that do not exist are cached as None (negative caching) with a shorter TTL.
+    Endpoints that change a user's profile write the new profile through to the cache.
+    """
+
+    def __init__(self, backend: CacheBackend, ttl: float, negative_ttl: float, namespace: str = 'profile'):
+        self.backend = backend
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, user_id: str) -> str:
+        return f"{self.namespace}:{user_id}"
+
+    def get_many(self, user_ids: List[str]) -> Dict[str, Optional[Dict[str, str]]]:
+        """Get the cached profiles (None for cached missing users) for the user ids that are cached"""
+        values = self.backend.get_many([self._key(user_id) for user_id in user_ids])
+        profiles = {user_id: values[self._key(user_id)] for user_id in user_ids if self._key(user_id) in values}
+        with self._lock:
+            self.hits += len(profiles)
+            self.misses += len(user_ids) - len(profiles)
+        return profiles
+
+    def get(self, user_id: str):
+        """Get a cached profile, None for a cached missing user or CACHE_MISS if not cached"""
+        return self.get_many([user_id]).get(user_id, CACHE_MISS)
+
+    def set(self, user_id: str, profile: Optional[Dict[str, str]]) -> None:
+        """Cache a profile, or None if the user does not exist"""
+        self.backend.set(self._key(user_id), profile, self.ttl if profile is not None else self.negative_ttl)
+
+    def invalidate(self, user_id: str) -> None:
+        """Remove a user from the cache"""
+        self.backend.delete(self._key(user_id))
+
+    def stats(self) -> Dict[str, Any]:
+        """Get the cache usage counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            counters = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRate': self.hits / lookups if lookups else 0.0
+            }
+        return {**counters, **self.backend.stats()}
+
+
+def cache_profiles(profiles: Dict[str, Optional[Dict[str, str]]]) -> None:
+    """Cache several profiles (None for users that do not exist)"""
+    for user_id, profile in profiles.items():
+        profile_cache.set(user_id, profile)
+
+
+def profile_from_item(item: Dict[str, Any]) -> Dict[str, str]:
+    """Build a cached profile from a users table item"""
+    return {
+        'username': item.get('username', 'Anonymous'),
+        'profilePhoto': item.get('profilePhoto', '')
+    }
+
+
+# Cache for user profiles (defaults: 5 minute expiry, 1 minute for missing users, max 10000 users per worker)
+profile_cache = ProfileCache(
+    backend=create_cache_backend(maxsize=int(os.getenv('PROFILE_CACHE_MAXSIZE', 10000))),
+    ttl=float(os.getenv('PROFILE_CACHE_TTL', 300)),
+    negative_ttl=float(os.getenv('PROFILE_CACHE_NEGATIVE_TTL', 60))
+)
+
+
+class PredictionCache:
+    """
+    Cache of Gemini predictions keyed on the SHA-256 of the processed image bytes.
+
+    Predictions are kept in a cache backend and, if a DynamoDB table is configured, in a persistent tier that
+    survives restarts (items expire through the table's TTL attribute expiresAt).
+    """
+
+    def __init__(self, backend: CacheBackend, ttl: float, table_name: Optional[str] = None,
+                 persistent_ttl: float = 30 * 24 * 3600, namespace: str = 'prediction'):
+        self.backend = backend
+        self.ttl = ttl
+        self.table_name = table_name
+        self.persistent_ttl = persistent_ttl
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+
+    def _key(self, image_hash: str) -> str:
+        return f"{self.namespace}:{image_hash}"
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get(self, image_hash: str) -> tuple:
+        """
+        Get a cached prediction.
+
+        Returns:
+            A tuple containing the cached car (None if not cached) and the tier it came from ("memory" or "persistent").
+        """
+
+        car = self.backend.get(self._key(image_hash))
+        if car is not CACHE_MISS:
+            self._count('hits')
+            return car, 'memory'
+
+        if self.table_name:
+            try:
+                table = get_table(self.table_name)
+                response = table.get_item(Key={'imageHash': image_hash}, ProjectionExpression="car, expiresAt")
+                item = response.get('Item')
+                # DynamoDB deletes expired items lazily, so check the expiry here as well
+                if item and int(item.get('expiresAt', 0)) > time.time():
+                    car = item['car']
+                    self.backend.set(self._key(image_hash), car, self.ttl)
+                    self._count('persistent_hits')
+                    return car, 'persistent'
+            except Exception as e:
+                print(f"Warning: Could not read prediction cache table: {str(e)}")
+
+        self._count('misses')
+        return None, None
+
+    def set(self, image_hash: str, car: Dict[str, Any]) -> None:
+        """Cache a prediction in every tier"""
+
+        self.backend.set(self._key(image_hash), car, self.ttl)
+
+        if self.table_name:
+            try:
+                table = get_table(self.table_name)
+                table.put_item(Item={
+                    'imageHash': image_hash,
+                    'car': car,
+                    'expiresAt': int(time.time() + self.persistent_ttl)
+                })
+            except Exception as e:
+                print(f"Warning: Could not write prediction cache table: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Get the cache usage counters"""
+        with self._lock:
+            lookups = self.hits + self.persistent_hits + self.misses
+            counters = {
+                'hits': self.hits,
+                'persistentHits': self.persistent_hits,
+                'misses': self.misses,
+                'hitRate': (self.hits + self.persistent_hits) / lookups if lookups else 0.0,
+                'persistent': bool(self.table_name)
+            }
+        return {**counters, **self.backend.stats()}
 
-# Cache for frequently accessed data (5 minute expiry, max 100 items)
-username_cache = TTLCache(maxsize=100, ttl=300)
 
-# Cache for profile photos (10 minute expiry, max 50 items)
-profile_photo_cache = TTLCache(maxsize=50, ttl=600)
+# Cache for predictions (defaults: 1 day expiry, 30 days in the optional persistent table, max 1000 images per worker)
+prediction_cache = PredictionCache(
+    backend=create_cache_backend(maxsize=int(os.getenv('PREDICTION_CACHE_MAXSIZE', 1000))),
+    ttl=float(os.getenv('PREDICTION_CACHE_TTL', 24 * 3600)),
+    table_name=os.getenv('DYNAMODB_PREDICTIONS_TABLE_NAME'),
+    persistent_ttl=float(os.getenv('PREDICTION_CACHE_PERSISTENT_TTL', 30 * 24 * 3600))
+)
+
+
+@app.on_event("startup")
+def start_caches():
+    """Start listening for cache invalidations"""
+    profile_cache.backend.start()
+    prediction_cache.backend.start()
+
+
+@app.on_event("shutdown")
+def close_caches():
+    """Stop listening for cache invalidations"""
+    profile_cache.backend.close()
+    prediction_cache.backend.close()
 
 # Configure AWS services
 aws_region = os.getenv('AWS_REGION')
@@ -83,10 +657,232 @@ aws_secret_key = os.getenv('AWS_SECRET_ACCESS_KEY')
 genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
 model = genai.GenerativeModel('gemini-2.0-flash')
 
+
+class ModelCallScheduler:
+    """
+    Admission control for Gemini calls.
+
+    At most max_in_flight calls run at once (on a dedicated thread pool) and at most max_queue wait for a slot.
+    A call is rejected right away with a 503 when the queue is full or its expected wait (from the recent call
+    latency) is longer than max_queue_wait. Rate-limit errors are retried with jittered exponential backoff.
+    Each call has an overall deadline of timeout seconds, so the time spent queueing and backing off comes out
+    of the time left for the model call itself, which is passed on as the request timeout. A call that times out
+    keeps its slot until its thread actually returns, and its time counts towards the latency estimate.
+    """
+
+    # Errors that mean the API quota is exhausted or the service is briefly unavailable
+    RETRYABLE_ERRORS = (google_exceptions.TooManyRequests, google_exceptions.ServiceUnavailable)
+
+    def __init__(self, max_in_flight: int, max_queue: int, max_queue_wait: float, timeout: float, max_retries: int):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_queue_wait = max_queue_wait
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='model')
+        self._semaphore = None
+        # Only changed on the event loop thread, so no lock is needed
+        self.in_flight = 0
+        self.waiting = 0
+        self.calls = 0
+        self.rejected = 0
+        self.retries = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        # Moving average of the model call latency, used to estimate queue waits
+        self.avg_latency = 0.0
+
+    def _reject(self, detail: str):
+        self.rejected += 1
+        return HTTPException(status_code=503, detail=detail, headers={"Retry-After": str(max(1, round(self.avg_latency)))})
+
+    def _record_latency(self, latency: float) -> None:
+        self.avg_latency = latency if not self.avg_latency else 0.8 * self.avg_latency + 0.2 * latency
+
+    def _release(self) -> None:
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    def _release_threadsafe(self, loop: asyncio.AbstractEventLoop) -> None:
+        try:
+            loop.call_soon_threadsafe(self._release)
+        except RuntimeError:
+            # The loop is closed at shutdown
+            pass
+
+    def _expected_wait(self, admitted: int) -> float:
+        # Calls ahead in the queue, each taking the average latency on one of the slots
+        return (admitted - self.max_in_flight + 1) * self.avg_latency / self.max_in_flight
+
+    async def call(self, func, *args, **kwargs):
+        """
+        Run a blocking model call under the scheduler's limits.
+
+        Args:
+            func: The blocking function to call. It gets the time left as request_options={'timeout': seconds},
+                like GenerativeModel.generate_content.
+            args: The function's arguments.
+            kwargs: The function's keyword arguments.
+
+        Returns:
+            The function's result. Raises an HTTPException if the call is rejected and asyncio.TimeoutError if
+            the deadline passes.
+        """
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        # Fast rejection instead of queueing requests that would time out anyway
+        admitted = self.in_flight + self.waiting
+        if admitted >= self.max_in_flight:
+            if admitted >= self.max_in_flight + self.max_queue:
+                raise self._reject("Too many identifications are in progress. Please try again shortly.")
+            if self._expected_wait(admitted) > self.max_queue_wait:
+                raise self._reject("Identification is busy. Please try again shortly.")
+
+        start = time.monotonic()
+        deadline = start + self.timeout
+
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.max_queue_wait)
+        except asyncio.TimeoutError:
+            raise self._reject("Identification is busy. Please try again shortly.")
+        finally:
+            self.waiting -= 1
+
+        wait = time.monotonic() - start
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.calls += 1
+        self.in_flight += 1
+        loop = asyncio.get_running_loop()
+        future = None
+        try:
+            for attempt in range(self.max_retries + 1):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise asyncio.TimeoutError()
+
+                call_start = time.monotonic()
+                future = self._executor.submit(func, *args, **kwargs, request_options={'timeout': remaining})
+                try:
+                    # Shielded so a timeout leaves the thread's future alone until it finishes
+                    result = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout=remaining)
+                except asyncio.TimeoutError:
+                    self.timeouts += 1
+                    self._record_latency(time.monotonic() - call_start)
+                    raise
+                except self.RETRYABLE_ERRORS:
+                    # Back off with full jitter, unless the deadline would pass first
+                    delay = random.uniform(0, min(8.0, 0.5 * 2 ** attempt))
+                    if attempt == self.max_retries or time.monotonic() + delay >= deadline:
+                        raise
+                    self.retries += 1
+                    await asyncio.sleep(delay)
+                    continue
+
+                self._record_latency(time.monotonic() - call_start)
+                return result
+        finally:
+            if future is not None and not future.done():
+                # The thread is still running (timed out or cancelled), so its slot is freed when it returns
+                future.add_done_callback(lambda _: self._release_threadsafe(loop))
+            else:
+                self._release()
+
+    def stats(self) -> Dict[str, Any]:
+        """Get the scheduler's queue and call counters"""
+        return {
+            'maxInFlight': self.max_in_flight,
+            'inFlight': self.in_flight,
+            'queueDepth': self.waiting,
+            'maxQueue': self.max_queue,
+            'calls': self.calls,
+            'rejected': self.rejected,
+            'retries': self.retries,
+            'timeouts': self.timeouts,
+            'avgWaitMs': round(1000 * self.total_wait / self.calls, 1) if self.calls else 0.0,
+            'maxWaitMs': round(1000 * self.max_wait, 1),
+            'avgLatencyMs': round(1000 * self.avg_latency, 1)
+        }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Scheduler for Gemini calls (defaults: 8 calls at once, 32 waiting, 10 second max queue wait, 25 second deadline, 3 retries)
+model_scheduler = ModelCallScheduler(
+    max_in_flight=int(os.getenv('MODEL_MAX_IN_FLIGHT', 8)),
+    max_queue=int(os.getenv('MODEL_MAX_QUEUE', 32)),
+    max_queue_wait=float(os.getenv('MODEL_MAX_QUEUE_WAIT', 10)),
+    timeout=float(os.getenv('MODEL_TIMEOUT', 25)),
+    max_retries=int(os.getenv('MODEL_MAX_RETRIES', 3))
+)
+
+
+@app.on_event("shutdown")
+def shutdown_model_scheduler():
+    """Stop the model call threads"""
+    model_scheduler.shutdown()
+
 # DynamoDB setup with connection pooling
 S3_BUCKET_NAME = os.getenv('S3_BUCKET_NAME')
 DYNAMODB_TABLE_NAME = os.getenv('DYNAMODB_TABLE_NAME')
 DYNAMODB_USERS_TABLE_NAME = os.getenv('DYNAMODB_USERS_TABLE_NAME')
+# Username reservations (partition key username), one item per taken username
+DYNAMODB_USERNAMES_TABLE_NAME = os.getenv('DYNAMODB_USERNAMES_TABLE_NAME')
+
+# Public feed index (GSI on the cars table: partition key feedShard, sort key savedAt)
+DYNAMODB_FEED_INDEX_NAME = os.getenv('DYNAMODB_FEED_INDEX_NAME', 'feed-shard-index')
+# Only public posts carry feedShard, so the index is sparse and needs no filter. Posts are spread over FEED_SHARDS
+# index partitions so feed writes aren't limited to one partition, and feed queries merge the shards
+# (defaults: 4 shards; the count can be raised but not lowered without moving posts)
+FEED_SHARDS = int(os.getenv('FEED_SHARDS', 4))
+# Post attributes copied to the feed index. Likes and likers change on every like, so they are not copied (the
+# index would take a write per like) and are read from the table for each page instead.
+FEED_INDEX_ATTRIBUTES = ['make', 'model', 'year', 'link', 'imageUrl', 'imageVariants', 'description', 'username', 'profilePicture']
+MAX_FEED_PAGE_SIZE = 100
+
+# Change counters for conditional GETs: the feed's lives in a meta item of the users table, each user's in their item
+FEED_VERSION_KEY = '__feed__'
+# Feed caching by clients and CDNs (defaults: fresh for 5 seconds, then revalidated with the ETag)
+FEED_CACHE_MAX_AGE = int(os.getenv('FEED_CACHE_MAX_AGE', 5))
+
+# List response compression (defaults: bodies of 1 KB or more, gzip level 5, brotli quality 4)
+COMPRESSION_MIN_BYTES = int(os.getenv('COMPRESSION_MIN_BYTES', 1024))
+GZIP_LEVEL = int(os.getenv('GZIP_LEVEL', 5))
+BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', 4))
+# Bodies this large are compressed off the event loop, and snapshot pages are kept rendered by ETag and encoding
+# (defaults: 64 KB, 32 bodies for 60 seconds)
+COMPRESSION_OFFLOAD_BYTES = int(os.getenv('COMPRESSION_OFFLOAD_BYTES', 64 * 1024))
+RENDERED_BODY_CACHE_SIZE = int(os.getenv('RENDERED_BODY_CACHE_SIZE', 32))
+RENDERED_BODY_CACHE_TTL = float(os.getenv('RENDERED_BODY_CACHE_TTL', 60))
+
+# DynamoDB BatchGetItem accepts at most 100 keys per request
+BATCH_GET_MAX_KEYS = 100
+BATCH_GET_MAX_RETRIES = 5
+
+# DynamoDB BatchWriteItem accepts at most 25 requests per call
+BATCH_WRITE_MAX_ITEMS = 25
+# Most posts deleted in one bulk delete request
+MAX_BULK_DELETE = 100
+
+# Batch predictions (defaults: up to 20 images per request, 4 identified at a time)
+MAX_PREDICT_BATCH_SIZE = int(os.getenv('MAX_PREDICT_BATCH_SIZE', 20))
+PREDICT_BATCH_CONCURRENCY = int(os.getenv('PREDICT_BATCH_CONCURRENCY', 4))
+BATCH_POOL_RETRIES = 8
+
+# Direct-to-S3 uploads (defaults: presigned POSTs valid for 5 minutes, up to 15 MB)
+PRESIGNED_UPLOAD_TTL = int(os.getenv('PRESIGNED_UPLOAD_TTL', 300))
+MAX_DIRECT_UPLOAD_BYTES = int(os.getenv('MAX_DIRECT_UPLOAD_BYTES', 15 * 1024 * 1024))
+# Accepted content types of direct uploads and the extension of their keys
+DIRECT_UPLOAD_CONTENT_TYPES = {'image/jpeg': 'jpg', 'image/png': 'png', 'image/webp': 'webp'}
+# File name prefix of car images uploaded directly and not processed yet
+DIRECT_UPLOAD_PREFIX = 'upload_'
+IMAGE_HASH_PATTERN = re.compile(r'^[0-9a-f]{32,64}$')
 
 # Car info data
 class CarInfo(BaseModel):
@@ -95,16 +891,19 @@ class CarInfo(BaseModel):
     year: str
     link: Optional[str] = None
 
-# Car post data
-class CarData(BaseModel):
+# Car post data sent alongside an uploaded image
+class CarUploadData(BaseModel):
     userId: str
     savedAt: str
     carInfo: CarInfo
-    imageUrl: str
     username: str
     isPrivate: Optional[bool] = False
     description: Optional[str] = None
 
+# Car post data with the image as a url
+class CarData(CarUploadData):
+    imageUrl: str
+
 # User data for creating/updating user info with Cognito user id
 class UserInfo(BaseModel):
     user_id: str
@@ -115,81 +914,29 @@ class UpdateUsernameInfo(BaseModel):
     user_id: str
     new_username: str
 
+# Request for a presigned direct-to-S3 upload ("car" or "profile" image)
+class UploadUrlRequest(BaseModel):
+    user_id: str
+    kind: Optional[str] = "car"
+    content_type: Optional[str] = "image/jpeg"
+    image_hash: Optional[str] = None
+
+# Profile photo uploaded directly to S3
+class ProfilePhotoUpload(BaseModel):
+    photo_url: str
+
+# Car posts to delete in bulk
+class DeleteCarsRequest(BaseModel):
+    saved_at: List[str]
+
 # Contact form data
 class ContactForm(BaseModel):
     name: str
     email: Optional[str] = ""
     message: str
 
-def process_image(image: UploadFile) -> tuple:
-    """
-    Process an uploaded image with optimized memory usage.
-    
-    Args:
-        image (UploadFile): The image as a file.
-        
-    Returns:
-        A tuple containing the processed PIL image and the original image bytes.
-    """
-
-    try:
-        # Read image and retrieve bytes
-        image_data = image.file.read()
-        image_bytes = io.BytesIO(image_data)
-
-        try:
-            pil_image = Image.open(image_bytes)
-        except Image.UnidentifiedImageError:
-            # Use pillow-heif to convert image if it's HEIF (common file type for Apple images)
-            heif_image = pillow_heif.open_heif(image_bytes)
-            pil_image = Image.frombytes(heif_image.mode, heif_image.size, heif_image.data)
-
-            # Convert HEIC to JPEG for storage (allow displaying of HEIC images on non-Safari browsers)
-            buffer = io.BytesIO()
-            pil_image.save(buffer, format="JPEG", quality=75)
-            image_data = buffer.getvalue()
-            buffer.close()
-            del buffer
-
-        # Ensure that image is RGB
-        pil_image = pil_image.convert('RGB')
-        
-        # Compress large images to reduce memory usage
-        max_size = 800
-        
-        # Always resize to optimize memory usage
-        original_width, original_height = pil_image.size
-        if original_width > max_size or original_height > max_size:
-            # Calculate new dimensions while preserving aspect ratio
-            if original_width > original_height:
-                new_width = max_size
-                new_height = int(original_height * (max_size / original_width))
-            else:
-                new_height = max_size
-                new_width = int(original_width * (max_size / original_height))
-            
-            # Resize the image with higher quality downsampling
-            pil_image = pil_image.resize((new_width, new_height), Image.LANCZOS)
-        
-        # Always recompress the image to ensure consistent memory usage
-        buffer = io.BytesIO()
-        pil_image.save(buffer, format="JPEG", quality=75)
-        image_data = buffer.getvalue()
-        buffer.close()
-        del buffer
-        
-        # Log compression stats for debugging
-        # original_size = len(image_data)
-        # compressed_size = len(image_data)
-        # compression_ratio = original_size / compressed_size if compressed_size > 0 else 0
-        # print(f"Image compression: {original_width}x{original_height} ({original_size/1024:.1f}KB) → " +
-        #       f"{pil_image.width}x{pil_image.height} ({compressed_size/1024:.1f}KB), " +
-        #       f"Ratio: {compression_ratio:.1f}x")
-        
-        return pil_image, image_data
-    except Exception as e:
-        print(f"Error processing image: {str(e)}")
-        raise e
+# Content types of stored images and their derivatives by extension
+IMAGE_CONTENT_TYPES = {'jpg': 'image/jpeg', 'webp': 'image/webp', 'avif': 'image/avif'}
 
 
 def generate_image_hash(image_data) -> str:
@@ -206,123 +953,1385 @@ def generate_image_hash(image_data) -> str:
     return hashlib.md5(image_data).hexdigest()
 
 
-async def upload_to_s3(image_data, user_id, image_hash) -> str:
+def hamming_distance(hash_a: int, hash_b: int) -> int:
+    """Get the number of differing bits between two perceptual hashes"""
+    return bin(hash_a ^ hash_b).count('1')
+
+
+def is_distinctive_phash(phash: int) -> bool:
     """
-    Upload an image to S3.
-    
+    Check whether a perceptual hash says enough about an image to match near-duplicates on.
+
+    Flat or low-texture images (solid colours, plain sky, blank walls) have few brightness edges, so their hashes
+    are all or almost all zeros (or ones) and distinct images of that kind collide.
+
     Args:
-        image_data: The image data in bytes.
-        user_id: The Cognito user id of the uploader.
-        image_hash: The unique image hash for the file name.
+        phash: The perceptual hash.
 
     Returns:
-        The image's S3 url that is publicly accessible.
+        True if the hash has at least PHASH_MIN_EDGE_BITS set and at least as many unset bits.
     """
 
-    try:
-        # Get a connection from the pool
-        s3_client = get_s3_client()
-        
-        # Create a unique key for the S3 object
-        s3_key = f"{user_id}/{image_hash}.jpg"
-        
-        # Upload to S3 with public read access
-        s3_client.put_object(
-            Bucket=S3_BUCKET_NAME,
-            Key=s3_key,
-            Body=image_data,
-            ContentType='image/jpeg',
-            ACL='public-read'
-        )
-        
-        # Return url for the uploaded S3 object
-        s3_url = f"https://{S3_BUCKET_NAME}.s3.{aws_region}.amazonaws.com/{s3_key}"
-        return s3_url
-    except Exception as e:
-        print(f"Error uploading to S3: {str(e)}")
-        raise e
+    set_bits = bin(phash).count('1')
+    return PHASH_MIN_EDGE_BITS <= set_bits <= 64 - PHASH_MIN_EDGE_BITS
 
 
-@app.post("/predict/")
-async def predict(image: UploadFile) -> Dict[str, Any]:
+class PerceptualHashIndex:
     """
-    Identify the car in an image with Gemini, with optimized memory usage.
+    In-memory BK-tree of perceptual hashes for finding near-duplicate images by Hamming distance.
 
-    Args:
-        image (UploadFile): The image as a file.
- 
-    Returns:
-        The car information in JSON format containing keys for the car's make, model, year, rarity, and link to additional information with the key "car" if "success" is True.
+    When more than maxsize entries are indexed, the oldest quarter is dropped and the tree is rebuilt.
     """
 
-    # Set timeout duration in seconds
-    TIMEOUT_SECONDS = 25
-    pil_image = None
-    
-    try:
-        # Process the image with optimized memory usage
-        pil_image, _ = process_image(image)
-        
-        # Gemini prompt - optimized to be more concise
-        prompt = """
-            Analyze this car image and provide these details in JSON format:
-            - make: Manufacturer name
-            - model: Model name/number (exclude unnecessary details)
-            - year: Exact year or range if uncertain
-            - rarity: Unknown, Common, Rare, Very Rare, or Extremely Rare
-            - link: Wikipedia link to the car
-            
-            If there are multiple cars in the image, focus on the most prominent one.
-            If no car visible, use "n/a" for all fields. For any missing information, use "n/a" as well.
-            
-            Return a single JSON object, not an array.
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        # Nodes are [hash, values, {distance: child node}]
+        self._root = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.matches = 0
+
+    def _insert_node(self, phash: int, value) -> None:
+        if self._root is None:
+            self._root = [phash, [value], {}]
+            return
+
+        node = self._root
+        while True:
+            distance = hamming_distance(phash, node[0])
+            if distance == 0:
+                node[1].append(value)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [phash, [value], {}]
+                return
+            node = child
+
+    def insert(self, phash: int, value) -> None:
+        """Index a (hashable) value under a perceptual hash"""
+        with self._lock:
+            if (phash, value) in self._entries:
+                self._entries.move_to_end((phash, value))
+                return
+
+            self._entries[(phash, value)] = None
+            self._insert_node(phash, value)
+
+            if len(self._entries) > self.maxsize:
+                for _ in range(max(1, self.maxsize // 4)):
+                    self._entries.popitem(last=False)
+                self._root = None
+                for entry_hash, entry_value in self._entries:
+                    self._insert_node(entry_hash, entry_value)
+
+    def remove(self, phash: int, value) -> None:
+        """Remove a value from the index"""
+        with self._lock:
+            if self._entries.pop((phash, value), CACHE_MISS) is CACHE_MISS:
+                return
+
+            node = self._root
+            while node is not None:
+                distance = hamming_distance(phash, node[0])
+                if distance == 0:
+                    node[1].remove(value)
+                    return
+                node = node[2].get(distance)
+
+    def find_nearest(self, phash: int, max_distance: int, predicate=None) -> Optional[tuple]:
         """
+        Find the closest indexed value within max_distance.
 
-        # Run the prediction with Gemini
-        def run_prediction():
-            return model.generate_content([prompt, pil_image])
-        
-        # Run the prediction with a timeout
-        loop = asyncio.get_event_loop()
-        response = await asyncio.wait_for(
-            loop.run_in_executor(None, run_prediction),
-            timeout=TIMEOUT_SECONDS
-        )
-        
-        # Clean up memory
-        del pil_image
-        pil_image = None
-        import gc
-        gc.collect()
+        Args:
+            phash: The perceptual hash to look up.
+            max_distance: The maximum Hamming distance of a match.
+            predicate: An optional function that a value must pass to match.
 
-        # Parse the response text as JSON
-        response_text = response.text.strip()
-        # Remove any markdown code block markers if present
-        if response_text.startswith('```json'):
-            response_text = response_text[7:]
-        if response_text.endswith('```'):
-            response_text = response_text[:-3]
-        
-        parsed_response = json.loads(response_text)
-                
-        # Handle the case where the model returns an array instead of a single object
-        if isinstance(parsed_response, list) and len(parsed_response) > 0:
-            print("Warning: Gemini returned multiple cars. Using the first one.")
-            parsed_response = parsed_response[0]
+        Returns:
+            A tuple containing the distance, the value and the indexed hash of the closest match, or None if there is
+            no match.
+        """
+
+        with self._lock:
+            self.lookups += 1
+            best = None
+            stack = [self._root] if self._root is not None else []
+            while stack:
+                node = stack.pop()
+                distance = hamming_distance(phash, node[0])
+                if distance <= max_distance and (best is None or distance < best[0]):
+                    for value in node[1]:
+                        if predicate is None or predicate(value):
+                            best = (distance, value, node[0])
+                            break
+
+                # Only subtrees within max_distance of this node can contain matches (triangle inequality)
+                for child_distance, child in node[2].items():
+                    if distance - max_distance <= child_distance <= distance + max_distance:
+                        stack.append(child)
+
+            if best is not None:
+                self.matches += 1
+            return best
+
+    def stats(self) -> Dict[str, Any]:
+        """Get the index usage counters"""
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'lookups': self.lookups,
+                'matches': self.matches
+            }
+
+
+# Maximum Hamming distance (out of 64 bits) for two images to count as near-duplicates
+PHASH_MAX_DISTANCE = int(os.getenv('PHASH_MAX_DISTANCE', 6))
+# Hashes with fewer set (or unset) bits are too flat to match on
+PHASH_MIN_EDGE_BITS = int(os.getenv('PHASH_MIN_EDGE_BITS', 8))
+
+# Near-duplicate indexes: perceptual hash to prediction cache key, and to (user id, S3 url, derivatives) of stored images
+prediction_index = PerceptualHashIndex(maxsize=int(os.getenv('PHASH_INDEX_MAXSIZE', 10000)))
+image_index = PerceptualHashIndex(maxsize=int(os.getenv('PHASH_INDEX_MAXSIZE', 10000)))
+
+
+class ImageWorkerPool:
+    """
+    Runs the CPU-heavy image pipeline off the event loop, in a process pool (default) or a thread pool.
+
+    At most workers + max_queue jobs are admitted at once; further jobs are rejected right away with a 503
+    so a burst of large uploads cannot pile up behind each other. If a worker process dies (e.g. killed for running
+    out of memory), the broken process pool is replaced and the jobs it lost are retried once, one at a time, so
+    the job that killed the worker cannot take the others down with it again.
+    """
+
+    def __init__(self, mode: str, workers: int, max_queue: int):
+        if mode not in ('process', 'thread'):
+            raise RuntimeError(f"Unknown IMAGE_WORKER_MODE: {mode}")
+        self.mode = mode
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = None
+        # Only changed on the event loop thread, so no lock is needed
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.restarts = 0
+        self._retry_lock = None
+
+    def _get_executor(self):
+        # Created lazily so importing this module does not start processes
+        if self._executor is None:
+            if self.mode == 'process':
+                # Spawn (not fork) since this process already runs threads
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='image')
+        return self._executor
+
+    async def run(self, func, *args):
+        """
+        Run a picklable function on the pool.
+
+        Args:
+            func: A module-level function.
+            args: The function's (picklable) arguments.
+
+        Returns:
+            The function's result.
+        """
+
+        if self.pending >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Too many images are being processed. Please try again shortly.",
+                headers={"Retry-After": "1"}
+            )
+
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            executor = self._get_executor()
+            try:
+                return await loop.run_in_executor(executor, func, *args)
+            except BrokenProcessPool:
+                self._replace_broken(executor)
+
+            if self._retry_lock is None:
+                self._retry_lock = asyncio.Lock()
+            async with self._retry_lock:
+                executor = self._get_executor()
+                try:
+                    return await loop.run_in_executor(executor, func, *args)
+                except BrokenProcessPool:
+                    self._replace_broken(executor)
+                    # The job broke the pool on its own, so the input itself is the cause
+                    raise HTTPException(
+                        status_code=422,
+                        detail="The image could not be processed. Please try a smaller image."
+                    )
+        finally:
+            self.pending -= 1
+            self.completed += 1
+
+    def _replace_broken(self, executor) -> None:
+        # Jobs that failed together on the same pool only replace it once
+        if self._executor is executor:
+            self.restarts += 1
+            print("Warning: An image worker process died, restarting the image pool")
+            executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        """Get the pool usage counters"""
+        return {
+            'mode': self.mode,
+            'workers': self.workers,
+            'maxQueue': self.max_queue,
+            'pending': self.pending,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'restarts': self.restarts
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+# Pool for image processing (defaults: one process per CPU, up to 2 queued jobs per worker)
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', os.cpu_count() or 1))
+image_pool = ImageWorkerPool(
+    mode=os.getenv('IMAGE_WORKER_MODE', 'process'),
+    workers=IMAGE_WORKERS,
+    max_queue=int(os.getenv('IMAGE_QUEUE_DEPTH', 2 * IMAGE_WORKERS))
+)
+
+
+@app.on_event("shutdown")
+def shutdown_image_pool():
+    """Stop the image workers"""
+    image_pool.shutdown()
+
+
+class UploadTokenStore:
+    """
+    Images received by /predict, kept briefly under single-use tokens so the post can be saved without uploading
+    them again.
+
+    With a shared cache the images are stored there so any worker can redeem a token; otherwise they are kept in
+    this worker (up to max_bytes of image bytes in total).
+    """
+
+    def __init__(self, max_bytes: int, ttl: float, shared: Optional[RedisCacheBackend] = None,
+                 namespace: str = 'upload-token'):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.shared = shared
+        self.namespace = namespace
+        self._local = TTLCache(maxsize=max_bytes, ttl=ttl, getsizeof=len)
+        self._lock = threading.Lock()
+
+    def _key(self, token: str) -> str:
+        return f"{self.namespace}:{token}"
+
+    async def put(self, image_data: bytes) -> Optional[str]:
+        """
+        Keep an uploaded image for a later save.
+
+        Args:
+            image_data: The image data in bytes.
+
+        Returns:
+            The upload token, or None if the image is too large to keep.
+        """
+
+        if len(image_data) > self.max_bytes:
+            return None
+
+        token = secrets.token_urlsafe(24)
+        if self.shared is not None:
+            # Cache values are JSON
+            encoded = base64.b64encode(image_data).decode()
+            await run_io(self.shared.set, self._key(token), encoded, self.ttl)
+        else:
+            with self._lock:
+                self._local[token] = image_data
+        return token
+
+    async def pop(self, token: str) -> Optional[bytes]:
+        """
+        Redeem a token (tokens are single use).
+
+        Args:
+            token: A token returned by put.
+
+        Returns:
+            The image data in bytes, or None if the token is unknown or expired.
+        """
+
+        if self.shared is not None:
+            encoded = await run_io(self.shared.pop, self._key(token))
+            return base64.b64decode(encoded) if isinstance(encoded, str) else None
+        with self._lock:
+            return self._local.pop(token, None)
+
+
+# Upload tokens, shared by the workers with CACHE_BACKEND=redis (defaults: 10 minutes, 256 MB of image bytes
+# per worker otherwise)
+upload_tokens = UploadTokenStore(
+    max_bytes=int(os.getenv('UPLOAD_TOKEN_MAX_BYTES', 256 * 1024 * 1024)),
+    ttl=float(os.getenv('UPLOAD_TOKEN_TTL', 600)),
+    shared=profile_cache.backend.shared if isinstance(profile_cache.backend, TieredCacheBackend) else None
+)
+
+
+def s3_url_for_key(s3_key: str) -> str:
+    """
+    Get the public url of an S3 object in the images bucket.
+
+    Args:
+        s3_key: The S3 key of the object.
+
+    Returns:
+        The object's public S3 url.
+    """
+
+    return f"https://{S3_BUCKET_NAME}.s3.{aws_region}.amazonaws.com/{s3_key}"
+
+
+def s3_key_from_url(image_url: str) -> str:
+    """
+    Get the S3 key of an image url in the images bucket.
+
+    Args:
+        image_url: The image's S3 url.
+
+    Returns:
+        The S3 key of the image.
+    """
+
+    return image_url.split(f"{S3_BUCKET_NAME}.s3.{aws_region}.amazonaws.com/")[1]
+
+
+async def verify_direct_upload(image_url: str, prefix: str) -> str:
+    """
+    Check that an image uploaded directly to S3 exists under the expected key prefix.
+
+    Args:
+        image_url: The image's S3 url.
+        prefix: The key prefix the image must have (e.g. "{user_id}/").
+
+    Returns:
+        The S3 key of the image.
+    """
+
+    try:
+        s3_key = s3_key_from_url(image_url)
+    except IndexError:
+        raise HTTPException(status_code=400, detail="Invalid image url.")
+
+    if not s3_key.startswith(prefix) or '..' in s3_key:
+        raise HTTPException(status_code=403, detail="The image does not belong to this user.")
+
+    try:
+        await run_io(get_s3_client().head_object, Bucket=S3_BUCKET_NAME, Key=s3_key)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            raise HTTPException(status_code=400, detail="The image has not been uploaded.")
+        raise
+
+    return s3_key
+
+
+def image_variant_names() -> List[str]:
+    """Get the names of all derivatives an image can have (including the JPEG itself, "jpg")"""
+    return ['jpg'] + [
+        f"{name}.{image_format}"
+        for name in IMAGE_VARIANT_SIZES
+        for image_format in IMAGE_CONTENT_TYPES if image_format != 'jpg'
+    ]
+
+
+def image_variant_url(image_url: str, variant: str) -> str:
+    """
+    Get the S3 url of a derivative of an image.
+
+    Args:
+        image_url: The S3 url of the image's JPEG.
+        variant: The derivative name (e.g. "small.webp", or "jpg" for the JPEG itself).
+
+    Returns:
+        The derivative's S3 url.
+    """
+
+    if variant == 'jpg':
+        return image_url
+    return f"{image_url.rsplit('.', 1)[0]}_{variant}"
+
+
+def image_srcset(image_url: str, variants: Optional[Dict[str, Any]]) -> Dict[str, str]:
+    """
+    Build srcset strings for an image's derivatives, by content type.
+
+    Args:
+        image_url: The S3 url of the image's JPEG.
+        variants: The image's derivatives, from derivative name to width (None for images stored before derivatives).
+
+    Returns:
+        A dict from content type (e.g. "image/webp") to a srcset string, for use in <picture> sources.
+    """
+
+    if not variants:
+        return {'image/jpeg': image_url}
+
+    srcsets = {}
+    for variant, width in sorted(variants.items(), key=lambda variant: int(variant[1])):
+        content_type = IMAGE_CONTENT_TYPES[variant.rsplit('.', 1)[-1]]
+        entry = f"{image_variant_url(image_url, variant)} {int(width)}w"
+        srcsets[content_type] = f"{srcsets[content_type]}, {entry}" if content_type in srcsets else entry
+    return srcsets
+
+
+async def upload_image_variants(user_id: str, name: str, variants: Dict[str, tuple]) -> tuple:
+    """
+    Upload an image and its derivatives to S3 concurrently.
+
+    Args:
+        user_id: The Cognito user id of the uploader.
+        name: The file name of the image, without extension (e.g. its hash).
+        variants: The encoded derivatives from prepare_saved_image.
+
+    Returns:
+        A tuple containing the S3 url of the JPEG and the derivatives' widths by name.
+    """
+
+    # Get the shared S3 client
+    s3_client = get_s3_client()
+    image_url = s3_url_for_key(f"{user_id}/{name}.jpg")
+
+    await asyncio.gather(*(
+        run_io(
+            s3_client.put_object,
+            Bucket=S3_BUCKET_NAME,
+            Key=s3_key_from_url(image_variant_url(image_url, variant)),
+            Body=data,
+            ContentType=IMAGE_CONTENT_TYPES[variant.rsplit('.', 1)[-1]],
+            ACL='public-read'
+        )
+        for variant, (data, _) in variants.items()
+    ))
+
+    return image_url, {variant: width for variant, (_, width) in variants.items()}
+
+
+class S3CleanupQueue:
+    """
+    Deletes images from S3 in the background, so requests never wait on cleanup.
+
+    Keys are collected and deleted in DeleteObjects batches of up to 1000 keys, at most every interval seconds.
+    Keys that fail are retried with backoff up to max_retries times. The queue is drained on shutdown.
+    """
+
+    # DeleteObjects accepts at most 1000 keys per request
+    MAX_BATCH = 1000
+
+    def __init__(self, interval: float, max_retries: int):
+        self.interval = interval
+        self.max_retries = max_retries
+        # Key to (attempts so far, earliest retry time)
+        self._pending: Dict[str, tuple] = {}
+        self._wakeup = None
+        self._task = None
+        self.deleted = 0
+        self.retried = 0
+        self.failed = 0
+
+    def enqueue(self, image_url: str) -> None:
+        """
+        Queue an image and its derivatives for deletion.
+
+        Args:
+            image_url: The image's S3 url.
+        """
+
+        try:
+            # Missing derivative keys are ignored by S3
+            for variant in image_variant_names():
+                self._pending.setdefault(s3_key_from_url(image_variant_url(image_url, variant)), (0, 0.0))
+        except IndexError:
+            print(f"Warning: Not an S3 image url: {image_url}")
+            return
+
+        if self._wakeup is not None and len(self._pending) >= self.MAX_BATCH:
+            self._wakeup.set()
+
+    async def flush(self, force: bool = False) -> None:
+        """Delete the queued keys that are due (all of them if force is True)"""
+        now = time.monotonic()
+        due = [key for key, (_, retry_at) in self._pending.items() if force or retry_at <= now]
+
+        for start in range(0, len(due), self.MAX_BATCH):
+            batch = due[start:start + self.MAX_BATCH]
+            try:
+                response = await run_io(
+                    get_s3_client().delete_objects,
+                    Bucket=S3_BUCKET_NAME,
+                    Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+                )
+                failed = {error.get('Key'): error.get('Message') for error in response.get('Errors', [])}
+            except Exception as e:
+                failed = {key: str(e) for key in batch}
+
+            for key in batch:
+                attempts, _ = self._pending.pop(key, (0, 0.0))
+                if key not in failed:
+                    self.deleted += 1
+                elif attempts < self.max_retries:
+                    # Back off exponentially with jitter
+                    self.retried += 1
+                    self._pending[key] = (attempts + 1, time.monotonic() + random.uniform(0.5, 1.0) * 2 ** attempts)
+                else:
+                    self.failed += 1
+                    print(f"Warning: Could not delete S3 object {key}: {failed[key]}")
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        # Retry a few times so a transient error doesn't leave orphaned images
+        for _ in range(3):
+            if not self._pending:
+                return
+            await self.flush(force=True)
+        print(f"Warning: {len(self._pending)} S3 objects could not be deleted")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'pending': len(self._pending),
+            'deleted': self.deleted,
+            'retried': self.retried,
+            'failed': self.failed
+        }
+
+
+# Background S3 cleanup (defaults: delete every 2 seconds, 5 retries per key)
+s3_cleanup = S3CleanupQueue(
+    interval=float(os.getenv('S3_CLEANUP_INTERVAL', 2)),
+    max_retries=int(os.getenv('S3_CLEANUP_MAX_RETRIES', 5))
+)
+
+
+@app.on_event("startup")
+async def start_s3_cleanup():
+    """Start deleting queued S3 objects"""
+    s3_cleanup.start()
+
+
+async def drain_s3_cleanup():
+    """Delete the queued S3 objects before shutting down"""
+    await s3_cleanup.close()
+
+# Runs before the I/O pool shuts down, since the deletes need it
+app.router.on_shutdown.insert(0, drain_s3_cleanup)
+
+
+class RemoteImageFetcher:
+    """
+    Downloads images from external URLs with a pooled async HTTP client.
+
+    Bodies are streamed and rejected as soon as they exceed max_bytes or are not images, each download has an
+    overall deadline, and at most per_host downloads run at once per remote host so a slow host cannot tie up the API.
+    """
+
+    def __init__(self, max_bytes: int, timeout: float, per_host: int):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.per_host = per_host
+        self._client = None
+        # Host to [semaphore, number of requests using it], removed when unused
+        self._hosts = {}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, connect=min(self.timeout, 5.0)),
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+                follow_redirects=True
+            )
+        return self._client
+
+    async def _download(self, url: str) -> bytes:
+        async with self._get_client().stream('GET', url) as response:
+            if response.status_code != 200:
+                raise HTTPException(status_code=400, detail="Failed to fetch image from URL")
+
+            content_type = response.headers.get('content-type', '').split(';')[0].strip().lower()
+            if not content_type.startswith('image/'):
+                raise HTTPException(status_code=400, detail="URL does not point to an image")
+
+            content_length = response.headers.get('content-length')
+            if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+                raise HTTPException(status_code=413, detail="Image is too large")
+
+            image_data = bytearray()
+            async for chunk in response.aiter_bytes():
+                image_data.extend(chunk)
+                if len(image_data) > self.max_bytes:
+                    raise HTTPException(status_code=413, detail="Image is too large")
+            return bytes(image_data)
+
+    async def fetch(self, url: str) -> bytes:
+        """
+        Download an image.
+
+        Args:
+            url: The http(s) URL of the image.
+
+        Returns:
+            The image data in bytes.
+        """
+
+        try:
+            host = httpx.URL(url).host
+        except httpx.InvalidURL:
+            raise HTTPException(status_code=400, detail="Invalid image URL")
+
+        entry = self._hosts.setdefault(host, [asyncio.Semaphore(self.per_host), 0])
+        entry[1] += 1
+        try:
+            # The deadline covers waiting for a slot and the whole download
+            async def limited_download():
+                async with entry[0]:
+                    return await self._download(url)
+
+            return await asyncio.wait_for(limited_download(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=400, detail="Timed out fetching image")
+        except httpx.HTTPError as e:
+            raise HTTPException(status_code=400, detail=f"Error fetching image: {str(e)}")
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._hosts[host]
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+# Fetcher for external image URLs (defaults: 15 MB max, 10 second deadline, 4 downloads per host)
+remote_image_fetcher = RemoteImageFetcher(
+    max_bytes=int(os.getenv('REMOTE_IMAGE_MAX_BYTES', 15 * 1024 * 1024)),
+    timeout=float(os.getenv('REMOTE_IMAGE_TIMEOUT', 10)),
+    per_host=int(os.getenv('REMOTE_IMAGE_PER_HOST', 4))
+)
+
+
+@app.on_event("shutdown")
+async def close_remote_image_fetcher():
+    """Close the pooled HTTP connections"""
+    await remote_image_fetcher.close()
+
+
+def feed_shard(user_id: str, saved_at: str) -> str:
+    """
+    Pick the feed index partition of a public post (stable, so rewrites of a post stay in its shard).
+
+    Args:
+        user_id: The Cognito user id of the poster.
+        saved_at: The timestamp of the car post.
+
+    Returns:
+        The feedShard value.
+    """
+
+    digest = hashlib.sha256(f"{user_id}/{saved_at}".encode()).digest()
+    return f"public#{int.from_bytes(digest[:4], 'big') % FEED_SHARDS}"
+
+
+def encode_feed_cursor(last_evaluated_key: Dict[str, Any]) -> str:
+    """
+    Encode the key of the last post of a feed page as an opaque pagination cursor.
+
+    Args:
+        last_evaluated_key: The userId and savedAt of the last post returned.
+
+    Returns:
+        A URL-safe cursor string.
+    """
+
+    raw = json.dumps(last_evaluated_key, separators=(',', ':'), sort_keys=True)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_feed_cursor(cursor: str) -> Dict[str, Any]:
+    """
+    Decode a pagination cursor back into the key of the last post returned.
+
+    Args:
+        cursor: A cursor previously returned by encode_feed_cursor.
+
+    Returns:
+        The userId and savedAt to resume the feed after.
+    """
+
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        start_key = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    # Only accept a post key (cursors from before the feed was sharded also carry feedPartition, which is ignored)
+    if not isinstance(start_key, dict) or not {'userId', 'savedAt'} <= set(start_key) <= {'userId', 'savedAt', 'feedPartition'} \
+            or not all(isinstance(value, str) for value in start_key.values()):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    return {'userId': start_key['userId'], 'savedAt': start_key['savedAt']}
+
+
+class VersionBumper:
+    """
+    Advances the change counters behind the ETags of /get-all-cars and /get-user-cars in the background.
+
+    Writes only mark the feed and the posters whose posts changed; every interval the marks are coalesced into one
+    ADD per user and one for the feed, so a burst of likes costs a few counter writes per interval instead of
+    several per request, and the feed's meta item sees at most one write per interval per worker. Until the marks
+    are written, this worker's ETags carry a token instead. Failed bumps are retried on the next interval and the
+    marks are written on shutdown.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._users = set()
+        self._feed = False
+        self._flushing = 0
+        self._task = None
+        # Identifies this worker's unwritten marks in ETags
+        self._instance = secrets.token_hex(4)
+        self._revision = 0
+        self.marks = 0
+        self.writes = 0
+        self.failures = 0
+
+    def mark(self, user_ids: List[str] = (), feed: bool = True) -> None:
+        """
+        Record a write that changes what the feed or users' cars return.
+
+        Args:
+            user_ids: The Cognito user ids whose posts changed.
+            feed: Whether the public feed changed.
+        """
+
+        self._users.update(user_ids)
+        self._feed = self._feed or feed
+        self._revision += 1
+        self.marks += 1
+
+    def version_token(self) -> str:
+        """Describe the marks not yet written for ETags (empty once they are)"""
+        if not (self._users or self._feed or self._flushing):
+            return ''
+        return f"{self._instance}:{self._revision}"
+
+    async def _bump(self, user_id: str, attribute: str, condition: Optional[str]) -> bool:
+        # Returns False if the bump should be retried
+        update_kwargs = {'ConditionExpression': condition} if condition else {}
+        try:
+            await run_io(
+                get_table(DYNAMODB_USERS_TABLE_NAME).update_item,
+                Key={'userId': user_id},
+                UpdateExpression=f"ADD {attribute} :one",
+                ExpressionAttributeValues={':one': 1},
+                **update_kwargs
+            )
+            self.writes += 1
+            return True
+        except ClientError as e:
+            # Users without an item have no ETag, so there is nothing to bump
+            if e.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                return True
+            error = e
+        except Exception as e:
+            error = e
+        self.failures += 1
+        print(f"Warning: Could not bump {attribute} of {user_id}: {str(error)}")
+        return False
+
+    async def flush(self) -> None:
+        """Write the marked counters"""
+        users, feed = self._users, self._feed
+        self._users, self._feed = set(), False
+        if not users and not feed:
+            return
+
+        self._flushing += 1
+        try:
+            user_ids = list(users)
+            bumps = [self._bump(user_id, 'carsVersion', 'attribute_exists(userId)') for user_id in user_ids]
+            if feed:
+                bumps.append(self._bump(FEED_VERSION_KEY, 'feedVersion', None))
+            results = await asyncio.gather(*bumps)
+
+            # Mark the failed counters again for the next interval
+            self._users.update(user_id for user_id, ok in zip(user_ids, results) if not ok)
+            if feed and not results[-1]:
+                self._feed = True
+        finally:
+            self._flushing -= 1
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        # Retry a few times so a transient error doesn't leave stale ETags
+        for _ in range(3):
+            if not self._users and not self._feed:
+                return
+            await self.flush()
+        print(f"Warning: {len(self._users) + self._feed} change counters could not be bumped")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'pendingUsers': len(self._users),
+            'pendingFeed': self._feed,
+            'marks': self.marks,
+            'writes': self.writes,
+            'failures': self.failures
+        }
+
+
+# Background ETag counter bumps (defaults: written every second)
+version_bumper = VersionBumper(interval=float(os.getenv('VERSION_BUMP_INTERVAL', 1.0)))
+
+
+@app.on_event("startup")
+async def start_version_bumper():
+    """Start writing marked change counters"""
+    version_bumper.start()
+
+
+async def drain_version_bumper():
+    """Write the marked change counters before shutting down"""
+    await version_bumper.close()
+
+# Runs before the I/O pool shuts down (and after the like buffer's flush, which marks counters)
+app.router.on_shutdown.insert(0, drain_version_bumper)
+
+
+async def read_version(user_id: str, attribute: str) -> Optional[int]:
+    """
+    Read a change counter with a consistent read (a single small GetItem instead of a query).
+
+    Args:
+        user_id: The users table key holding the counter.
+        attribute: The counter attribute.
+
+    Returns:
+        The counter (0 if never bumped), or None if the item does not exist or could not be read.
+    """
+
+    try:
+        response = await run_io(
+            get_table(DYNAMODB_USERS_TABLE_NAME).get_item,
+            Key={'userId': user_id},
+            ProjectionExpression=attribute,
+            ConsistentRead=True
+        )
+    except Exception as e:
+        print(f"Warning: Could not read {attribute} of {user_id}: {str(e)}")
+        return None
+
+    if 'Item' not in response:
+        # The feed counter's item is only created by the first bump
+        return 0 if user_id == FEED_VERSION_KEY else None
+    return int(response['Item'].get(attribute, 0))
+
+
+def make_etag(*parts: Any) -> str:
+    """
+    Build a weak ETag from the version and parameters of a response (weak, since the JSON may be re-encoded).
+
+    Args:
+        parts: JSON-serializable values that determine the response.
+
+    Returns:
+        The quoted ETag.
+    """
+
+    digest = hashlib.sha256(json.dumps(parts, separators=(',', ':')).encode()).hexdigest()[:32]
+    return f'W/"{digest}"'
+
+
+def cache_headers(etag: Optional[str], cache_control: str) -> Dict[str, str]:
+    """
+    Build the caching headers of a response.
+
+    Args:
+        etag: The current ETag, or None if the version is unknown.
+        cache_control: The Cache-Control header value.
+
+    Returns:
+        A dict of header name to value.
+    """
+
+    # The body is compressed per client, so caches must key on Accept-Encoding
+    headers = {'Cache-Control': cache_control, 'Vary': 'Accept-Encoding'}
+    if etag is not None:
+        headers['ETag'] = etag
+    return headers
+
+
+def is_not_modified(request: Request, etag: Optional[str]) -> bool:
+    """
+    Check whether the client already has the current version of a response.
+
+    Args:
+        request: The incoming request.
+        etag: The current ETag, or None if the version is unknown.
+
+    Returns:
+        True if the request's If-None-Match matches the ETag (weak comparison), False otherwise.
+    """
+
+    if etag is None:
+        return False
+    if_none_match = request.headers.get('if-none-match', '')
+    candidates = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+    return '*' in candidates or etag.removeprefix('W/') in candidates
+
+
+def json_default(value: Any) -> Any:
+    """Encode the DynamoDB types the JSON encoders don't know (numbers come back as Decimal, string sets as set)"""
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON response rendered with orjson (stdlib json if it is not installed). Endpoints return it directly with
+    content they built themselves, which skips FastAPI's jsonable_encoder and return-type validation.
+    """
+
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content, default=json_default)
+        return json.dumps(content, default=json_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    Pick the response compression from an Accept-Encoding header.
+
+    Args:
+        accept_encoding: The Accept-Encoding header value.
+
+    Returns:
+        "br" (if brotli is installed) or "gzip", preferring brotli at equal quality, or None if neither is accepted.
+    """
+
+    qualities = {}
+    for part in accept_encoding.lower().split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            qualities[coding] = quality
+
+    supported = ['br', 'gzip'] if brotli is not None else ['gzip']
+    # A wildcard covers the codings that are not listed
+    accepted = [(qualities.get(coding, qualities.get('*', 0.0)), coding) for coding in supported]
+    quality, coding = max(accepted, key=lambda accepted_coding: accepted_coding[0])
+    return coding if quality > 0 else None
+
+
+# Rendered response bodies by (cache key, requested encoding), as (body, applied encoding)
+rendered_bodies = TTLCache(maxsize=RENDERED_BODY_CACHE_SIZE, ttl=RENDERED_BODY_CACHE_TTL)
+# Rendered feed snapshot pages by (snapshot revision, page parameters), as (JSON body, ETag)
+snapshot_pages = TTLCache(maxsize=RENDERED_BODY_CACHE_SIZE, ttl=RENDERED_BODY_CACHE_TTL)
+
+
+async def json_response(
+    request: Request,
+    content: Any,
+    headers: Optional[Dict[str, str]] = None,
+    cache_key: Optional[str] = None
+) -> Response:
+    """
+    Build a fast JSON response, compressed with the client's preferred encoding when the body is at least
+    COMPRESSION_MIN_BYTES. Bodies of COMPRESSION_OFFLOAD_BYTES or more are compressed on a worker thread (zlib and
+    brotli release the GIL), so large feeds don't stall the event loop.
+
+    Args:
+        request: The incoming request (for Accept-Encoding).
+        content: The response content, already in its final shape (or already rendered to JSON bytes).
+        headers: Extra response headers.
+        cache_key: A key that identifies the content (such as its ETag), to reuse the rendered body.
+
+    Returns:
+        The response.
+    """
+
+    accepted = negotiate_encoding(request.headers.get('accept-encoding', ''))
+    cached = rendered_bodies.get((cache_key, accepted)) if cache_key is not None else None
+
+    if cached is not None:
+        body, encoding = cached
+    else:
+        body = content if isinstance(content, bytes) else FastJSONResponse(content).body
+        encoding = accepted if len(body) >= COMPRESSION_MIN_BYTES else None
+        if encoding is not None:
+            if encoding == 'br':
+                compress = partial(brotli.compress, body, quality=BROTLI_QUALITY)
+            else:
+                compress = partial(gzip.compress, body, compresslevel=GZIP_LEVEL, mtime=0)
+            if len(body) >= COMPRESSION_OFFLOAD_BYTES:
+                body = await asyncio.get_running_loop().run_in_executor(None, compress)
+            else:
+                body = compress()
+        if cache_key is not None:
+            rendered_bodies[(cache_key, accepted)] = (body, encoding)
+
+    response_headers = {**(headers or {}), 'Vary': 'Accept-Encoding'}
+    if encoding is not None:
+        response_headers['Content-Encoding'] = encoding
+    return Response(body, media_type='application/json', headers=response_headers)
+
+
+async def batch_get_likes(keys: List[tuple], with_likers: bool) -> Dict[tuple, Dict[str, Any]]:
+    """
+    Fetch the likes of posts with chunked BatchGetItem calls (the chunks run concurrently), retrying unprocessed keys.
+
+    Args:
+        keys: Unique (userId, savedAt) keys of the posts.
+        with_likers: Whether to read likedBy too.
+
+    Returns:
+        A dict of (userId, savedAt) to item (likes, and likedBy if requested) for the posts that exist.
+    """
+
+    # Get the shared resource
+    dynamodb = get_dynamodb()
+
+    items = {}
+
+    async def fetch_chunk(chunk: List[tuple]) -> None:
+        request_items = {
+            DYNAMODB_TABLE_NAME: {
+                'Keys': [{'userId': user_id, 'savedAt': saved_at} for user_id, saved_at in chunk],
+                'ProjectionExpression': "userId, savedAt, likes" + (", likedBy" if with_likers else "")
+            }
+        }
+
+        for attempt in range(BATCH_GET_MAX_RETRIES + 1):
+            response = await run_io(dynamodb.batch_get_item, RequestItems=request_items)
+            for item in response.get('Responses', {}).get(DYNAMODB_TABLE_NAME, []):
+                items[(item['userId'], item['savedAt'])] = item
+
+            # Retry keys DynamoDB could not process (throttling or response size limit)
+            request_items = response.get('UnprocessedKeys')
+            if not request_items:
+                return
+            if attempt < BATCH_GET_MAX_RETRIES:
+                # Exponential backoff with full jitter
+                await asyncio.sleep(random.uniform(0, min(1.0, 0.05 * 2 ** attempt)))
+
+        raise Exception(f"Could not fetch the likes of {len(request_items[DYNAMODB_TABLE_NAME]['Keys'])} posts after {BATCH_GET_MAX_RETRIES} retries")
+
+    await asyncio.gather(*(
+        fetch_chunk(keys[start:start + BATCH_GET_MAX_KEYS])
+        for start in range(0, len(keys), BATCH_GET_MAX_KEYS)
+    ))
+    return items
+
+
+async def batch_get_users(user_ids: List[str]) -> tuple:
+    """
+    Fetch users from the users table with chunked BatchGetItem calls (the chunks run concurrently).
+
+    Args:
+        user_ids: A list of unique Cognito user ids.
+
+    Returns:
+        A tuple containing a dict of user id to user item (username and profilePhoto) for the users that exist, and the set of user ids that could not be fetched.
+    """
+
+    # Get the shared resource
+    dynamodb = get_dynamodb()
+
+    users = {}
+    unresolved = set()
+
+    async def fetch_chunk(chunk: List[str]) -> None:
+        request_items = {
+            DYNAMODB_USERS_TABLE_NAME: {
+                'Keys': [{'userId': user_id} for user_id in chunk],
+                'ProjectionExpression': "userId, username, profilePhoto"
+            }
+        }
+
+        try:
+            for attempt in range(BATCH_GET_MAX_RETRIES + 1):
+                response = await run_io(dynamodb.batch_get_item, RequestItems=request_items)
+                for item in response.get('Responses', {}).get(DYNAMODB_USERS_TABLE_NAME, []):
+                    users[item['userId']] = item
+
+                # Retry keys DynamoDB could not process (throttling or response size limit)
+                request_items = response.get('UnprocessedKeys')
+                if not request_items:
+                    break
+                if attempt < BATCH_GET_MAX_RETRIES:
+                    # Exponential backoff with full jitter
+                    await asyncio.sleep(random.uniform(0, min(1.0, 0.05 * 2 ** attempt)))
+            else:
+                unprocessed = request_items[DYNAMODB_USERS_TABLE_NAME]['Keys']
+                unresolved.update(key['userId'] for key in unprocessed)
+                print(f"Warning: Could not fetch {len(unprocessed)} users after {BATCH_GET_MAX_RETRIES} retries")
+        except Exception as e:
+            unresolved.update(chunk)
+            print(f"Warning: Could not batch get users: {str(e)}")
+
+    await asyncio.gather(*(
+        fetch_chunk(user_ids[start:start + BATCH_GET_MAX_KEYS])
+        for start in range(0, len(user_ids), BATCH_GET_MAX_KEYS)
+    ))
+
+    return users, unresolved
+
+
+async def resolve_user_profiles(user_ids: List[str]) -> Dict[str, Dict[str, str]]:
+    """
+    Resolve the current username and profile photo for a list of users, using the profile cache where possible.
+
+    Args:
+        user_ids: A list of Cognito user ids (duplicates allowed).
+
+    Returns:
+        A dict of user id to {"username", "profilePhoto"} for every requested user id ("Anonymous" and "" if not found).
+    """
+
+    unique_ids = list(dict.fromkeys(user_ids))
+    cached = await run_io(profile_cache.get_many, unique_ids)
+    profiles = {user_id: profile or profile_from_item({}) for user_id, profile in cached.items()}
+    misses = [user_id for user_id in unique_ids if user_id not in cached]
+
+    # Fetch the cache misses in batches
+    users, unresolved = await batch_get_users(misses) if misses else ({}, set())
+    fetched = {}
+    for user_id in misses:
+        if user_id in users:
+            profiles[user_id] = fetched[user_id] = profile_from_item(users[user_id])
+        else:
+            profiles[user_id] = profile_from_item({})
+            # Only remember users that are known not to exist (not failed lookups)
+            if user_id not in unresolved:
+                fetched[user_id] = None
+
+    if fetched:
+        await run_io(cache_profiles, fetched)
+
+    return profiles
+
+
+# Gemini prompt - optimized to be more concise
+PREDICTION_PROMPT = """
+    Analyze this car image and provide these details in JSON format:
+    - make: Manufacturer name
+    - model: Model name/number (exclude unnecessary details)
+    - year: Exact year or range if uncertain
+    - rarity: Unknown, Common, Rare, Very Rare, or Extremely Rare
+    - link: Wikipedia link to the car
+    
+    If there are multiple cars in the image, focus on the most prominent one.
+    If no car visible, use "n/a" for all fields. For any missing information, use "n/a" as well.
+    
+    Return a single JSON object, not an array.
+"""
+
+# Fields of a prediction, in the order the prompt asks for them
+PREDICTION_FIELDS = ("make", "model", "year", "rarity", "link")
+
+# A complete "field": "value" pair in partial model output
+PARTIAL_FIELD_PATTERN = re.compile(r'"(make|model|year|rarity|link)"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+
+async def find_cached_prediction(image_data: bytes, image_phash: int) -> tuple:
+    """
+    Look up the prediction of an image, or of a near-identical image, in the prediction cache.
+
+    Args:
+        image_data: The processed image data in bytes.
+        image_phash: The perceptual hash of the image.
+
+    Returns:
+        A tuple containing the image's cache key and the cached part of the /predict/ response (None on a miss).
+    """
+
+    # Reuse the earlier prediction if this exact image was identified before
+    image_hash = hashlib.sha256(image_data).hexdigest()
+    cached_car, cache_tier = await run_io(prediction_cache.get, image_hash)
+    if cached_car is not None:
+        return image_hash, {"car": cached_car, "cached": True, "cacheTier": cache_tier}
+
+    # Otherwise reuse the prediction of a near-identical image (re-encoded, resized or cropped)
+    match = prediction_index.find_nearest(image_phash, PHASH_MAX_DISTANCE) if is_distinctive_phash(image_phash) else None
+    if match is not None:
+        cached_car, cache_tier = await run_io(prediction_cache.get, match[1])
+        if cached_car is not None:
+            return image_hash, {"car": cached_car, "cached": True, "cacheTier": cache_tier, "nearDuplicate": True}
+
+    return image_hash, None
+
+
+def parse_prediction(response_text: str) -> Dict[str, Any]:
+    """
+    Parse the model's response text into the car information.
+
+    Args:
+        response_text: The full response text of the model.
+
+    Returns:
+        A dict with the car's make, model, year, rarity and link.
+    """
+
+    response_text = response_text.strip()
+    # Remove any markdown code block markers if present
+    if response_text.startswith('```json'):
+        response_text = response_text[7:]
+    if response_text.endswith('```'):
+        response_text = response_text[:-3]
+    
+    parsed_response = json.loads(response_text)
+            
+    # Handle the case where the model returns an array instead of a single object
+    if isinstance(parsed_response, list) and len(parsed_response) > 0:
+        print("Warning: Gemini returned multiple cars. Using the first one.")
+        parsed_response = parsed_response[0]
+    
+    return {field: parsed_response.get(field) for field in PREDICTION_FIELDS}
+
+
+def parse_partial_prediction(response_text: str) -> Dict[str, str]:
+    """
+    Get the fields whose values are complete in partial model output.
+
+    Args:
+        response_text: The response text received so far.
+
+    Returns:
+        A dict of the complete fields (the first car's, if the model returned several).
+    """
+
+    fields = {}
+    for match in PARTIAL_FIELD_PATTERN.finditer(response_text):
+        field = match.group(1)
+        if field not in fields:
+            try:
+                fields[field] = json.loads(f'"{match.group(2)}"')
+            except json.JSONDecodeError:
+                continue
+    return fields
+
+
+async def store_prediction(image_hash: str, image_phash: int, car: Dict[str, Any]) -> None:
+    """Cache a prediction for repeat identifications of the same or a near-identical image"""
+    await run_io(prediction_cache.set, image_hash, car)
+    if is_distinctive_phash(image_phash):
+        prediction_index.insert(image_phash, image_hash)
+
+
+async def identify_car(upload_data: bytes) -> Dict[str, Any]:
+    """
+    Identify the car in an uploaded image with Gemini, reusing cached predictions.
+
+    Args:
+        upload_data: The uploaded image data in bytes.
+
+    Returns:
+        The prediction response of /predict/.
+    """
+
+    pil_image = None
+    
+    try:
+        # Process the image with optimized memory usage
+        pil_image, image_data, image_phash = await image_pool.run(prepare_prediction_image, upload_data)
+
+        # Keep the upload so the post can be saved with the token instead of the image
+        upload_token = await upload_tokens.put(upload_data)
+        del upload_data
+
+        # Reuse a cached prediction of this or a near-identical image
+        image_hash, cached = await find_cached_prediction(image_data, image_phash)
+        if cached is not None:
+            return {"success": True, **cached, "uploadToken": upload_token}
+
+        # Run the prediction with Gemini through the model call scheduler
+        response = await model_scheduler.call(model.generate_content, [PREDICTION_PROMPT, pil_image])
         
-        # Return the parsed details
-        car = {
-            "make": parsed_response.get("make"),
-            "model": parsed_response.get("model"),
-            "year": parsed_response.get("year"),
-            "rarity": parsed_response.get("rarity"),
-            "link": parsed_response.get("link")
-        }
+        # Clean up memory
+        del pil_image
+        pil_image = None
+        gc.collect()
+
+        # Parse the response text as JSON
+        car = parse_prediction(response.text)
+
+        # Cache the prediction for repeat identifications of the same image
+        await store_prediction(image_hash, image_phash, car)
         
-        return {"success": True, "car": car}
+        return {"success": True, "car": car, "cached": False, "uploadToken": upload_token}
+    except HTTPException:
+        # Re-raise HTTP exceptions
+        raise
     except asyncio.TimeoutError:
-        print(f"Prediction timed out after {TIMEOUT_SECONDS} seconds")
-        return {"success": False, "error": f"Request timed out after {TIMEOUT_SECONDS} seconds. Please try again with a smaller image or try later."}
+        print(f"Prediction timed out after {model_scheduler.timeout:g} seconds")
+        return {"success": False, "error": f"Request timed out after {model_scheduler.timeout:g} seconds. Please try again with a smaller image or try later."}
+    except ModelCallScheduler.RETRYABLE_ERRORS as e:
+        print(f"Prediction rate limited: {str(e)}")
+        raise HTTPException(status_code=429, detail="Identification is over capacity. Please try again shortly.", headers={"Retry-After": "5"})
     except json.JSONDecodeError as e:
         print(f"JSON parse error: {str(e)}")
         return {"success": False, "error": "Failed to parse response as JSON", "response_text": response.text if 'response' in locals() else "No response"}
@@ -336,23 +2345,414 @@ async def predict(image: UploadFile) -> Dict[str, Any]:
             gc.collect()
 
 
+@app.post("/predict/")
+async def predict(image: UploadFile) -> Dict[str, Any]:
+    """
+    Identify the car in an image with Gemini, with optimized memory usage.
+
+    Args:
+        image (UploadFile): The image as a file.
+ 
+    Returns:
+        The car information in JSON format containing keys for the car's make, model, year, rarity, and link to additional information with the key "car" if "success" is True. The key "cached" indicates whether the prediction was reused from the prediction cache ("nearDuplicate" is True if it was reused from a near-identical image). The key "uploadToken" can be passed to /save-car-upload/ instead of the image.
+    """
+
+    return await identify_car(await image.read())
+
+
+@app.post("/predict-batch/")
+async def predict_batch(images: List[UploadFile] = File(...)) -> StreamingResponse:
+    """
+    Identify the cars in several images, at most PREDICT_BATCH_CONCURRENCY at a time.
+
+    Args:
+        images (list[UploadFile]): The images as files (at most MAX_PREDICT_BATCH_SIZE).
+
+    Returns:
+        A stream of newline-delimited JSON objects, one per image in the order they complete. Each has the image's
+        position in the request with the key "index", its file name with the key "filename", and the /predict/
+        response for it (with the key "error" if that image failed).
+    """
+
+    if not images:
+        raise HTTPException(status_code=400, detail="Please provide at least one image.")
+    if len(images) > MAX_PREDICT_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Too many images. Please send at most {MAX_PREDICT_BATCH_SIZE} per request.")
+
+    # Read the uploads now, since the request's files are closed once the endpoint returns
+    uploads = [(image.filename, await image.read()) for image in images]
+    semaphore = asyncio.Semaphore(PREDICT_BATCH_CONCURRENCY)
+
+    async def predict_one(index: int, filename: str, upload_data: bytes) -> Dict[str, Any]:
+        async with semaphore:
+            for attempt in range(BATCH_POOL_RETRIES + 1):
+                try:
+                    result = await identify_car(upload_data)
+                except HTTPException as e:
+                    # Wait for the image pool when it is busy instead of failing the image
+                    if e.status_code == 503 and attempt < BATCH_POOL_RETRIES:
+                        await asyncio.sleep(0.5 * (attempt + 1))
+                        continue
+                    result = {"success": False, "error": e.detail, "status": e.status_code}
+                except Exception as e:
+                    print(f"Batch prediction error: {str(e)}")
+                    result = {"success": False, "error": str(e)}
+                break
+        return {"index": index, "filename": filename, **result}
+
+    async def stream_results():
+        tasks = [asyncio.create_task(predict_one(index, *upload)) for index, upload in enumerate(uploads)]
+        uploads.clear()
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                yield json.dumps(await next_result) + "\n"
+        finally:
+            # Stop the remaining predictions if the client disconnects
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Format a server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/predict-stream/")
+async def predict_stream(image: UploadFile) -> StreamingResponse:
+    """
+    Identify the car in an image with Gemini, streaming progress over server-sent events.
+
+    Args:
+        image (UploadFile): The image as a file.
+
+    Returns:
+        A stream of server-sent events: "progress" events (with the key "stage": "processing", then "identifying"),
+        a "field" event for each field of the car as soon as the model has produced it (with the keys "field"
+        and "value"), and finally a "result" event with the /predict/ response, or an "error" event (with the
+        key "error", and "status" for rejected requests).
+    """
+
+    # Read the upload now, since the request's files are closed once the endpoint returns
+    upload_data = await image.read()
+
+    async def stream_events():
+        nonlocal upload_data
+        pil_image = None
+        call = None
+
+        try:
+            yield sse_event("progress", {"stage": "processing"})
+            pil_image, image_data, image_phash = await image_pool.run(prepare_prediction_image, upload_data)
+
+            # Keep the upload so the post can be saved with the token instead of the image
+            upload_token = await upload_tokens.put(upload_data)
+            upload_data = None
+
+            # Reuse a cached prediction of this or a near-identical image
+            image_hash, cached = await find_cached_prediction(image_data, image_phash)
+            if cached is not None:
+                yield sse_event("result", {"success": True, **cached, "uploadToken": upload_token})
+                return
+
+            yield sse_event("progress", {"stage": "identifying"})
+
+            # The model thread hands the text received so far to the event loop after each chunk. Sending the
+            # whole text (not the chunk) keeps the parsing right if the scheduler retries the call.
+            loop = asyncio.get_running_loop()
+            received = asyncio.Queue()
+
+            def run_streaming_prediction(parts, request_options=None):
+                text = ""
+                for chunk in model.generate_content(parts, stream=True, request_options=request_options):
+                    text += chunk.text
+                    loop.call_soon_threadsafe(received.put_nowait, text)
+                return text
+
+            call = asyncio.create_task(model_scheduler.call(run_streaming_prediction, [PREDICTION_PROMPT, pil_image]))
+
+            # Send each field once its value is complete
+            sent = {}
+            while True:
+                next_text = asyncio.create_task(received.get())
+                done, _ = await asyncio.wait({next_text, call}, return_when=asyncio.FIRST_COMPLETED)
+                if next_text not in done:
+                    next_text.cancel()
+                    break
+                for field, value in parse_partial_prediction(next_text.result()).items():
+                    if sent.get(field) != value:
+                        sent[field] = value
+                        yield sse_event("field", {"field": field, "value": value})
+
+            response_text = call.result()
+
+            # Clean up memory
+            del pil_image
+            pil_image = None
+            gc.collect()
+
+            car = parse_prediction(response_text)
+            await store_prediction(image_hash, image_phash, car)
+
+            yield sse_event("result", {"success": True, "car": car, "cached": False, "uploadToken": upload_token})
+        except HTTPException as e:
+            yield sse_event("error", {"success": False, "error": e.detail, "status": e.status_code})
+        except asyncio.TimeoutError:
+            print(f"Prediction timed out after {model_scheduler.timeout:g} seconds")
+            yield sse_event("error", {"success": False, "error": f"Request timed out after {model_scheduler.timeout:g} seconds. Please try again with a smaller image or try later."})
+        except ModelCallScheduler.RETRYABLE_ERRORS as e:
+            print(f"Prediction rate limited: {str(e)}")
+            yield sse_event("error", {"success": False, "error": "Identification is over capacity. Please try again shortly.", "status": 429})
+        except json.JSONDecodeError as e:
+            print(f"JSON parse error: {str(e)}")
+            yield sse_event("error", {"success": False, "error": "Failed to parse response as JSON"})
+        except Exception as e:
+            print(f"Prediction error: {str(e)}")
+            yield sse_event("error", {"success": False, "error": str(e)})
+        finally:
+            # Stop waiting for the model if the client disconnected
+            if call is not None and not call.done():
+                call.cancel()
+            if pil_image is not None:
+                del pil_image
+                gc.collect()
+
+    return StreamingResponse(
+        stream_events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def store_car_image(user_id: str, image_data: bytes) -> tuple:
+    """
+    Store the image of a car post in S3 under a name of its own, copying the user's stored copy of a near-identical
+    image within S3 instead of uploading it again. Posts never share S3 objects, so deleting one post's images can't
+    break another post.
+
+    Args:
+        user_id: The Cognito user id of the poster.
+        image_data: The image data in bytes.
+
+    Returns:
+        A tuple containing the image's S3 url, its hash, its perceptual hash and its derivatives' widths by name.
+    """
+
+    # Decode once for the JPEG, the derivatives and the perceptual hash
+    _, variants, image_phash = await image_pool.run(prepare_saved_image, image_data)
+
+    image_hash = generate_image_hash(image_data)
+    name = f"{image_hash}-{secrets.token_hex(4)}"
+
+    # Copy the user's stored copy of a near-identical image
+    distinctive = is_distinctive_phash(image_phash)
+    match = image_index.find_nearest(
+        image_phash, PHASH_MAX_DISTANCE, lambda value: value[0] == user_id
+    ) if distinctive else None
+
+    stored = None
+    if match is not None:
+        _, source_url, source_variants = match[1]
+        stored = await copy_image_variants(user_id, name, source_url, dict(source_variants))
+        if stored is None:
+            # The copy was deleted since it was indexed (here or by another worker)
+            image_index.remove(match[2], match[1])
+
+    if stored is None:
+        # Upload the image and its derivatives to S3
+        stored = await upload_image_variants(user_id, name, variants)
+
+    image_url, image_variants = stored
+    if distinctive:
+        image_index.insert(image_phash, image_index_value(user_id, image_url, image_variants))
+
+    return image_url, image_hash, image_phash, image_variants
+
+
+async def copy_image_variants(user_id: str, name: str, source_url: str, variants: Dict[str, Any]) -> Optional[tuple]:
+    """
+    Copy a stored image and its derivatives to a new name within S3, concurrently.
+
+    Args:
+        user_id: The Cognito user id of the uploader.
+        name: The new file name of the image, without extension.
+        source_url: The S3 url of the stored image's JPEG.
+        variants: The stored image's derivatives' widths by name.
+
+    Returns:
+        A tuple containing the S3 url of the copied JPEG and the derivatives' widths by name, or None if the stored
+        image is gone or could not be copied.
+    """
+
+    # Get the shared S3 client
+    s3_client = get_s3_client()
+    image_url = s3_url_for_key(f"{user_id}/{name}.jpg")
+
+    try:
+        await asyncio.gather(*(
+            run_io(
+                s3_client.copy_object,
+                Bucket=S3_BUCKET_NAME,
+                Key=s3_key_from_url(image_variant_url(image_url, variant)),
+                CopySource={'Bucket': S3_BUCKET_NAME, 'Key': s3_key_from_url(image_variant_url(source_url, variant))},
+                ACL='public-read'
+            )
+            for variant in variants
+        ))
+    except Exception as e:
+        if not (isinstance(e, ClientError) and e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')):
+            print(f"Warning: Could not copy stored image {source_url}: {str(e)}")
+        # Drop whatever was copied before the failure
+        s3_cleanup.enqueue(image_url)
+        return None
+
+    return image_url, dict(variants)
+
+
+def image_index_value(user_id: str, image_url: str, image_variants: Optional[Dict[str, Any]]) -> tuple:
+    """Build the near-duplicate image index value of a stored image (hashable, so it can be removed again)"""
+    return (user_id, image_url, tuple(sorted((variant, int(width)) for variant, width in (image_variants or {}).items())))
+
+
+async def put_car_item(
+    car_data: CarUploadData,
+    image_url: str,
+    image_hash: str,
+    image_phash: Optional[int],
+    image_variants: Optional[Dict[str, int]] = None
+) -> None:
+    """
+    Write a car post to the DynamoDB cars table.
+
+    Args:
+        car_data (CarUploadData): The car data to save.
+        image_url: The S3 url of the image.
+        image_hash: The unique image hash.
+        image_phash: The perceptual hash of the image, if known.
+        image_variants: The widths of the image's derivatives by name, if any.
+    """
+
+    # Get the shared table handle
+    cars_table = get_table(DYNAMODB_TABLE_NAME)
+
+    # Save to DynamoDB with savedAt as the sort key and imageHash for unique identification
+    item = {
+        'username': car_data.username,
+        'userId': car_data.userId,
+        'savedAt': car_data.savedAt,
+        'make': car_data.carInfo.make,
+        'model': car_data.carInfo.model,
+        'year': car_data.carInfo.year,
+        'link': car_data.carInfo.link,
+        'imageUrl': image_url,
+        'imageHash': image_hash,
+        'isPrivate': car_data.isPrivate
+    }
+    
+    # Add description if provided
+    if car_data.description:
+        item['description'] = car_data.description
+
+    # Store the perceptual hash (hex) for near-duplicate lookups
+    if image_phash is not None:
+        item['imagePHash'] = f"{image_phash:016x}"
+
+    # Store which derivatives exist (they are at predictable keys next to the image)
+    if image_variants:
+        item['imageVariants'] = image_variants
+
+    # Public posts are added to the feed index
+    if not car_data.isPrivate:
+        item['feedShard'] = feed_shard(car_data.userId, car_data.savedAt)
+
+    await run_io(cars_table.put_item, Item=item)
+
+    # Patch this worker's feed snapshot (private posts are removed from it)
+    if feed_snapshot.enabled:
+        profiles = await resolve_user_profiles([car_data.userId]) if not car_data.isPrivate else {}
+        feed_snapshot.put(item, profiles.get(car_data.userId, {}))
+
+    # A save may also replace a public post with a private one, so the feed is always marked
+    version_bumper.mark([car_data.userId])
+
+
+async def process_direct_upload(user_id: str, saved_at: str, upload_url: str) -> None:
+    """
+    Replace the image of a post uploaded directly to S3 with the resized JPEG, its derivatives and its perceptual
+    hash, as for server-side uploads, then delete the original upload. Runs after the post is saved, so the post
+    shows the original upload until then (and keeps it if processing fails).
+
+    Args:
+        user_id (str): The Cognito user id of the poster.
+        saved_at (str): The timestamp of the car post.
+        upload_url (str): The S3 url of the uploaded image.
+    """
+
+    try:
+        response = await run_io(get_s3_client().get_object, Bucket=S3_BUCKET_NAME, Key=s3_key_from_url(upload_url))
+        image_data = await run_io(response['Body'].read)
+        image_url, image_hash, image_phash, image_variants = await store_car_image(user_id, image_data)
+        del image_data
+    except Exception as e:
+        print(f"Warning: Could not process uploaded image {upload_url}: {str(e)}")
+        return
+
+    update_expression = "SET imageUrl = :image_url, imageHash = :image_hash, imageVariants = :image_variants"
+    update_values = {
+        ':image_url': image_url,
+        ':image_hash': image_hash,
+        ':image_variants': image_variants,
+        ':upload_url': upload_url
+    }
+    if image_phash is not None:
+        update_expression += ", imagePHash = :image_phash"
+        update_values[':image_phash'] = f"{image_phash:016x}"
+
+    try:
+        # Only if the post still shows the upload (it may have been deleted or replaced meanwhile)
+        response = await run_io(
+            get_table(DYNAMODB_TABLE_NAME).update_item,
+            Key={'userId': user_id, 'savedAt': saved_at},
+            UpdateExpression=update_expression,
+            ConditionExpression="imageUrl = :upload_url",
+            ExpressionAttributeValues=update_values,
+            ReturnValues="ALL_NEW"
+        )
+    except Exception as e:
+        if not (isinstance(e, ClientError) and e.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException'):
+            print(f"Warning: Could not record processed image of {user_id}/{saved_at}: {str(e)}")
+        # Nothing references the processed copy
+        if image_phash is not None:
+            image_index.remove(image_phash, image_index_value(user_id, image_url, image_variants))
+        s3_cleanup.enqueue(image_url)
+        return
+
+    s3_cleanup.enqueue(upload_url)
+
+    # Patch this worker's feed snapshot with the new image
+    item = response.get('Attributes', {})
+    if feed_snapshot.enabled and 'feedShard' in item:
+        profiles = await resolve_user_profiles([user_id])
+        feed_snapshot.put(item, profiles.get(user_id, {}))
+    version_bumper.mark([user_id], feed='feedShard' in item)
+
+
 @app.post("/save-car/")
-async def save_car(car_data: CarData) -> Dict[str, Any]:
+async def save_car(car_data: CarData, background_tasks: BackgroundTasks) -> Dict[str, Any]:
     """
-    Save a car's data to the DynamoDB cars table.
+    Save a car's data to the DynamoDB cars table. The image can be a data URL, an external URL, or the S3 url of
+    an image the user uploaded directly with /create-upload-url (processed after responding).
 
     Args:
         car_data (CarData): The car data to save.
+        background_tasks (BackgroundTasks): Runs the processing of directly uploaded images after responding.
     
     Returns:
         A JSON indicating whether the save was successful with the key "success".
     """
 
     try:
-        # Get connections from the pool
-        dynamodb = get_dynamodb()
-        cars_table = dynamodb.Table(DYNAMODB_TABLE_NAME)
-        
         # Check if S3 already contains the image
         is_s3_url = S3_BUCKET_NAME in car_data.imageUrl if car_data.imageUrl else False
         
@@ -368,43 +2768,28 @@ async def save_car(car_data: CarData) -> Dict[str, Any]:
                 raise HTTPException(status_code=400, detail="Blob URLs cannot be processed. The frontend should convert blob URLs to data URLs.")
             elif car_data.imageUrl.startswith(('http://', 'https://')):
                 # Fetch the image for external URLs
-                try:
-                    response = requests.get(car_data.imageUrl, timeout=10)
-                    if response.status_code != 200:
-                        raise HTTPException(status_code=400, detail="Failed to fetch image from URL")
-                    image_data = response.content
-                except requests.RequestException as e:
-                    raise HTTPException(status_code=400, detail=f"Error fetching image: {str(e)}")
+                image_data = await remote_image_fetcher.fetch(car_data.imageUrl)
             else:
                 # Invalid image source
                 raise HTTPException(status_code=400, detail="Invalid image source. Please provide a data URL or a valid image URL.")
-            
-            # Upload image to S3
-            image_hash = generate_image_hash(image_data)
-            car_data.imageUrl = await upload_to_s3(image_data, car_data.userId, image_hash)
+
+            image_url, image_hash, image_phash, image_variants = await store_car_image(car_data.userId, image_data)
         else:
+            # Make sure an image uploaded directly to S3 exists and belongs to the user
+            await verify_direct_upload(car_data.imageUrl, f"{car_data.userId}/")
+
             # Extract the hash from the URL for consistency if already in S3
-            image_hash = car_data.imageUrl.split('/')[-1].split('.')[0]
-        
-        # Save to DynamoDB with savedAt as the sort key and imageHash for unique identification
-        item = {
-            'username': car_data.username,
-            'userId': car_data.userId,
-            'savedAt': car_data.savedAt,
-            'make': car_data.carInfo.make,
-            'model': car_data.carInfo.model,
-            'year': car_data.carInfo.year,
-            'link': car_data.carInfo.link,
-            'imageUrl': car_data.imageUrl,
-            'imageHash': image_hash,
-            'isPrivate': car_data.isPrivate
-        }
-        
-        # Add description if provided
-        if car_data.description:
-            item['description'] = car_data.description
-        
-        cars_table.put_item(Item=item)
+            image_url = car_data.imageUrl
+            file_name = image_url.split('/')[-1]
+            image_hash = file_name.split('.')[0].removeprefix(DIRECT_UPLOAD_PREFIX)
+            image_phash = None
+            image_variants = None
+
+        await put_car_item(car_data, image_url, image_hash, image_phash, image_variants)
+
+        # Resize the direct upload and add its derivatives and perceptual hash after responding
+        if is_s3_url and file_name.startswith(DIRECT_UPLOAD_PREFIX):
+            background_tasks.add_task(process_direct_upload, car_data.userId, car_data.savedAt, image_url)
         
         return {"success": True, "message": "Car data saved successfully"}
     except HTTPException as e:
@@ -415,27 +2800,151 @@ async def save_car(car_data: CarData) -> Dict[str, Any]:
         return {"success": False, "error": str(e)}
 
 
+@app.post("/save-car-upload/")
+async def save_car_upload(
+    car_data: str = Form(...),
+    image: Optional[UploadFile] = File(None),
+    upload_token: Optional[str] = Form(None)
+) -> Dict[str, Any]:
+    """
+    Save a car's data to the DynamoDB cars table with the image sent as a multipart file, or
+    referenced by the upload token returned from /predict/.
+
+    Args:
+        car_data (str): The car data as JSON, without the image url.
+        image (UploadFile): The image as a file, if no upload token is given.
+        upload_token (str): The upload token of an image sent to /predict/.
+
+    Returns:
+        A JSON indicating whether the save was successful with the key "success". If the upload token
+        has expired (or, without a shared cache, was issued by another worker) the request fails with a 410 and
+        should be resent with the image.
+    """
+
+    try:
+        try:
+            car = CarUploadData.model_validate_json(car_data)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid car data: {str(e)}")
+
+        if upload_token:
+            # Tokens are single use
+            image_data = await upload_tokens.pop(upload_token)
+            if image_data is None:
+                raise HTTPException(status_code=410, detail="Upload token expired. Please send the image instead.")
+        elif image is not None:
+            image_data = await image.read()
+        else:
+            raise HTTPException(status_code=400, detail="Please provide an image or an upload token.")
+
+        if not image_data:
+            raise HTTPException(status_code=400, detail="Empty image.")
+
+        image_url, image_hash, image_phash, image_variants = await store_car_image(car.userId, image_data)
+        del image_data
+
+        await put_car_item(car, image_url, image_hash, image_phash, image_variants)
+
+        return {"success": True, "message": "Car data saved successfully"}
+    except HTTPException:
+        # Re-raise HTTP exceptions
+        raise
+    except Exception as e:
+        print(f"Error saving car: {str(e)}")
+        return {"success": False, "error": str(e)}
+
+
+async def is_image_referenced(cars_table, user_id: str, image_url: str) -> bool:
+    """
+    Check whether any of a user's car posts uses an image.
+
+    Args:
+        cars_table: The cars Table resource.
+        user_id: The Cognito user id of the poster.
+        image_url: The S3 url of the image.
+
+    Returns:
+        True if a post of the user references the image.
+    """
+
+    query_kwargs = {
+        'KeyConditionExpression': Key('userId').eq(user_id),
+        'FilterExpression': Attr('imageUrl').eq(image_url),
+        'ProjectionExpression': "savedAt"
+    }
+    while True:
+        response = await run_io(cars_table.query, **query_kwargs)
+        if response.get('Items'):
+            return True
+        if 'LastEvaluatedKey' not in response:
+            return False
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+async def cleanup_car_images(user_id: str, image_urls: List[str]) -> None:
+    """
+    Queue the images of deleted posts for deletion from S3, keeping those still used by another of the user's posts
+    (posts saved before each post got its own copy may share one S3 object).
+
+    Args:
+        user_id (str): The Cognito user id of the poster.
+        image_urls (List[str]): The image urls of the deleted posts.
+    """
+
+    # Get the shared table handle
+    cars_table = get_table(DYNAMODB_TABLE_NAME)
+
+    for image_url in dict.fromkeys(image_urls):
+        if not image_url or S3_BUCKET_NAME not in image_url:
+            continue
+        try:
+            if not await is_image_referenced(cars_table, user_id, image_url):
+                s3_cleanup.enqueue(image_url)
+        except Exception as e:
+            print(f"Warning: Could not check references to {image_url}: {str(e)}")
+
+
+def forget_deleted_car(user_id: str, deleted_item: Dict[str, Any]) -> None:
+    """
+    Drop the buffered likes and the perceptual hash entry of a deleted post.
+
+    Args:
+        user_id (str): The Cognito user id of the poster.
+        deleted_item (Dict[str, Any]): The deleted item.
+    """
+
+    like_buffer.discard(user_id, deleted_item['savedAt'])
+    feed_snapshot.remove(user_id, deleted_item['savedAt'])
+
+    image_url = deleted_item.get('imageUrl')
+    if image_url and deleted_item.get('imagePHash'):
+        image_index.remove(
+            int(deleted_item['imagePHash'], 16),
+            image_index_value(user_id, image_url, deleted_item.get('imageVariants'))
+        )
+
+
 @app.delete("/delete-car/{user_id}/{saved_at}")
-async def delete_car(user_id: str, saved_at: str) -> Dict[str, Any]:
+async def delete_car(user_id: str, saved_at: str, background_tasks: BackgroundTasks) -> Dict[str, Any]:
     """
-    Delete a car post from the database.
+    Delete a car post from the database. The image is removed from S3 in the background.
 
     Args:
         user_id (str): The Cognito user id of the poster.
         saved_at (str): The timestamp of the car post.
+        background_tasks (BackgroundTasks): Tasks run after the response is sent.
 
     Returns:
         A JSON object indicating whether the deletion was successful with the key "success".
     """
 
     try:
-        # Get connections from pool
-        dynamodb = get_dynamodb()
-        cars_table = dynamodb.Table(DYNAMODB_TABLE_NAME)
-        s3_client = get_s3_client()
+        # Get the shared table handle
+        cars_table = get_table(DYNAMODB_TABLE_NAME)
         
         # Delete the item from DynamoDB
-        response = cars_table.delete_item(
+        response = await run_io(
+            cars_table.delete_item,
             Key={
                 'userId': user_id,
                 'savedAt': saved_at
@@ -448,21 +2957,12 @@ async def delete_car(user_id: str, saved_at: str) -> Dict[str, Any]:
         if not deleted_item:
             return {"success": False, "error": "Car not found"}
         
-        # Get the image URL from the deleted item to delete from S3
-        image_url = deleted_item.get('imageUrl')
-        if image_url and S3_BUCKET_NAME in image_url:
-            try:
-                # Extract the S3 key from the URL
-                s3_key = image_url.split(f"{S3_BUCKET_NAME}.s3.{aws_region}.amazonaws.com/")[1]
-                
-                # Delete the image from S3
-                s3_client.delete_object(
-                    Bucket=S3_BUCKET_NAME,
-                    Key=s3_key
-                )
-            except Exception as s3_error:
-                print(f"Warning: Could not delete S3 image: {str(s3_error)}")
-                # Continue with the process even if S3 deletion fails
+        # Forget likes buffered for the post and its perceptual hash
+        forget_deleted_car(user_id, deleted_item)
+        version_bumper.mark([user_id], feed=not deleted_item.get('isPrivate', False))
+
+        # Delete the image from S3 after responding
+        background_tasks.add_task(cleanup_car_images, user_id, [deleted_item.get('imageUrl')])
         
         return {"success": True, "message": "Car deleted successfully"}
     except Exception as e:
@@ -470,28 +2970,175 @@ async def delete_car(user_id: str, saved_at: str) -> Dict[str, Any]:
         return {"success": False, "error": str(e)}
 
 
+async def batch_get_cars(user_id: str, saved_ats: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Fetch a user's posts with BatchGetItem (at most BATCH_GET_MAX_KEYS), retrying unprocessed keys.
+
+    Args:
+        user_id: The Cognito user id of the poster.
+        saved_ats: Unique timestamps of the posts.
+
+    Returns:
+        A dict of savedAt to item (savedAt, imageUrl, imagePHash and imageVariants) for the posts that exist.
+    """
+
+    # Get the shared resource
+    dynamodb = get_dynamodb()
+
+    request_items = {
+        DYNAMODB_TABLE_NAME: {
+            'Keys': [{'userId': user_id, 'savedAt': saved_at} for saved_at in saved_ats],
+            'ProjectionExpression': "savedAt, imageUrl, imagePHash, imageVariants"
+        }
+    }
+
+    items = {}
+    for attempt in range(BATCH_GET_MAX_RETRIES + 1):
+        response = await run_io(dynamodb.batch_get_item, RequestItems=request_items)
+        for item in response.get('Responses', {}).get(DYNAMODB_TABLE_NAME, []):
+            items[item['savedAt']] = item
+
+        # Retry keys DynamoDB could not process (throttling or response size limit)
+        request_items = response.get('UnprocessedKeys')
+        if not request_items:
+            return items
+        if attempt < BATCH_GET_MAX_RETRIES:
+            # Exponential backoff with full jitter
+            await asyncio.sleep(random.uniform(0, min(1.0, 0.05 * 2 ** attempt)))
+
+    raise Exception(f"Could not fetch {len(request_items[DYNAMODB_TABLE_NAME]['Keys'])} posts after {BATCH_GET_MAX_RETRIES} retries")
+
+
+async def batch_delete_cars(user_id: str, saved_ats: List[str]) -> set:
+    """
+    Delete a user's posts with chunked BatchWriteItem calls (the chunks run concurrently), retrying unprocessed
+    deletes.
+
+    Args:
+        user_id: The Cognito user id of the poster.
+        saved_ats: Unique timestamps of the posts.
+
+    Returns:
+        The set of timestamps that could not be deleted.
+    """
+
+    # Get the shared resource
+    dynamodb = get_dynamodb()
+
+    failed = set()
+
+    async def delete_chunk(chunk: List[str]) -> None:
+        request_items = {
+            DYNAMODB_TABLE_NAME: [
+                {'DeleteRequest': {'Key': {'userId': user_id, 'savedAt': saved_at}}}
+                for saved_at in chunk
+            ]
+        }
+
+        try:
+            for attempt in range(BATCH_GET_MAX_RETRIES + 1):
+                response = await run_io(dynamodb.batch_write_item, RequestItems=request_items)
+
+                # Retry deletes DynamoDB could not process (throttling)
+                request_items = response.get('UnprocessedItems')
+                if not request_items:
+                    break
+                if attempt < BATCH_GET_MAX_RETRIES:
+                    # Exponential backoff with full jitter
+                    await asyncio.sleep(random.uniform(0, min(1.0, 0.05 * 2 ** attempt)))
+            else:
+                unprocessed = request_items[DYNAMODB_TABLE_NAME]
+                failed.update(request['DeleteRequest']['Key']['savedAt'] for request in unprocessed)
+                print(f"Warning: Could not delete {len(unprocessed)} posts after {BATCH_GET_MAX_RETRIES} retries")
+        except Exception as e:
+            failed.update(chunk)
+            print(f"Warning: Could not batch delete posts: {str(e)}")
+
+    await asyncio.gather(*(
+        delete_chunk(saved_ats[start:start + BATCH_WRITE_MAX_ITEMS])
+        for start in range(0, len(saved_ats), BATCH_WRITE_MAX_ITEMS)
+    ))
+
+    return failed
+
+
+@app.post("/delete-cars/{user_id}")
+async def delete_cars(user_id: str, request: DeleteCarsRequest, background_tasks: BackgroundTasks) -> Dict[str, Any]:
+    """
+    Delete several of a user's car posts at once. The images are removed from S3 in the background.
+
+    Args:
+        user_id (str): The Cognito user id of the poster.
+        request (DeleteCarsRequest): The timestamps of the posts (at most MAX_BULK_DELETE).
+        background_tasks (BackgroundTasks): Tasks run after the response is sent.
+
+    Returns:
+        A JSON object with the timestamps of the deleted posts with the key "deleted", of the posts that do not exist with the key "notFound" and of the posts that could not be deleted with the key "failed" if "success" is True.
+    """
+
+    # Ignore repeated timestamps
+    saved_ats = list(dict.fromkeys(request.saved_at))
+    if not saved_ats:
+        raise HTTPException(status_code=400, detail="No posts to delete")
+    if len(saved_ats) > MAX_BULK_DELETE:
+        raise HTTPException(status_code=413, detail=f"Too many posts. Please delete at most {MAX_BULK_DELETE} per request.")
+
+    try:
+        # Read the posts first, since BatchWriteItem does not return deleted items
+        items = await batch_get_cars(user_id, saved_ats)
+        failed = await batch_delete_cars(user_id, list(items))
+
+        deleted = [saved_at for saved_at in items if saved_at not in failed]
+        for saved_at in deleted:
+            forget_deleted_car(user_id, items[saved_at])
+        if deleted:
+            version_bumper.mark([user_id])
+
+        # Delete the images from S3 after responding
+        background_tasks.add_task(cleanup_car_images, user_id, [items[saved_at].get('imageUrl') for saved_at in deleted])
+
+        return {
+            "success": True,
+            "deleted": deleted,
+            "notFound": [saved_at for saved_at in saved_ats if saved_at not in items],
+            "failed": sorted(failed)
+        }
+    except Exception as e:
+        print(f"Error deleting cars: {str(e)}")
+        return {"success": False, "error": str(e)}
+
+
 @app.get("/get-user-cars/{user_id}")
-async def get_user_cars(user_id: str) -> Dict[str, Any]:
+async def get_user_cars(user_id: str, request: Request) -> Any:
     """
-    Retrieve the cars saved by a specific user.
+    Retrieve the cars saved by a specific user. The response has an ETag from the user's change counter, and a
+    matching If-None-Match returns 304 Not Modified without querying the cars.
     
     Args:
         user_id (str): The Cognito user id of the requester.
+        request (Request): The incoming request.
         
     Returns:
-        A JSON object containing a list of CarData for all of the user's saved cars with the key "cars" if "success" is True.
+        A JSON object containing a list of CarData for all of the user's saved cars with the key "cars" if "success" is True. Each car has srcset strings of its image's derivatives by content type with the key "imageSrcSet".
     """
 
     try:
-        # Get a connection from the pool
-        dynamodb = get_dynamodb()
-        cars_table = dynamodb.Table(DYNAMODB_TABLE_NAME)
+        # Private posts are included, so only the client may cache the response
+        version = await read_version(user_id, 'carsVersion')
+        etag = make_etag('cars', user_id, version, like_buffer.version_token(), version_bumper.version_token()) if version is not None else None
+        headers = cache_headers(etag, "private, no-cache")
+        if is_not_modified(request, etag):
+            return Response(status_code=304, headers=headers)
+
+        # Get the shared table handle
+        cars_table = get_table(DYNAMODB_TABLE_NAME)
         
         # Query DynamoDB for user's saved cars (newest first) - use ProjectionExpression to only fetch the needed fields
-        response = cars_table.query(
+        query_response = await run_io(
+            cars_table.query,
             KeyConditionExpression=Key('userId').eq(user_id),
             ScanIndexForward=False,  # Sort in descending order (newest first)
-            ProjectionExpression="userId, savedAt, make, model, #yr, link, imageUrl, likes, isPrivate, description",
+            ProjectionExpression="userId, savedAt, make, model, #yr, link, imageUrl, imageVariants, likes, isPrivate, description",
             ExpressionAttributeNames={
                 "#yr": "year"
             }
@@ -499,7 +3146,10 @@ async def get_user_cars(user_id: str) -> Dict[str, Any]:
         
         # Format the response
         cars = []
-        for item in response.get('Items', []):
+        for item in query_response.get('Items', []):
+            # Include likes still waiting in the like buffer
+            like_buffer.apply_pending(item)
+
             car_data = {
                 'userId': item.get('userId'),
                 'savedAt': item.get('savedAt'),
@@ -510,6 +3160,7 @@ async def get_user_cars(user_id: str) -> Dict[str, Any]:
                     'link': item.get('link'),
                 },
                 'imageUrl': item.get('imageUrl'),
+                'imageSrcSet': image_srcset(item.get('imageUrl'), item.get('imageVariants')),
                 'likes': item.get('likes', 0),
                 'isPrivate': item.get('isPrivate', False)
             }
@@ -520,132 +3171,928 @@ async def get_user_cars(user_id: str) -> Dict[str, Any]:
                 
             cars.append(car_data)
         
-        return {"success": True, "cars": cars}
+        return await json_response(request, {"success": True, "cars": cars}, headers)
     except Exception as e:
         print(f"Error in get-user-cars: {str(e)}")
         return {"success": False, "error": str(e)}
 
 
-@app.get("/get-all-cars")
-async def get_all_cars() -> Dict[str, Any]:
-    """
-    Retrieve all public car posts along with user information.
-    
-    Args:
-        None.
-    
-    Returns:
-        A JSON object containing a list of CarData for all of the public car posts with the key "cars" if "success" is True.
-    """
+def format_feed_car(item: Dict[str, Any], profile: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Build a feed post from a car item (without "likedByViewer", which depends on the viewer).
+
+    Args:
+        item: The car item from the feed index.
+        profile: The poster's current username and profile photo.
+
+    Returns:
+        The post as returned by /get-all-cars.
+    """
+
+    car_data = {
+        'userId': item.get('userId'),
+        'savedAt': item.get('savedAt'),
+        'carInfo': {
+            'make': item.get('make'),
+            'model': item.get('model'),
+            'year': item.get('year'),
+            'link': item.get('link'),
+        },
+        'imageUrl': item.get('imageUrl'),
+        'imageSrcSet': image_srcset(item.get('imageUrl'), item.get('imageVariants')),
+        'likes': item.get('likes', 0),
+        'username': profile.get('username', item.get('username', 'Anonymous')),
+        'profilePicture': profile.get('profilePhoto', item.get('profilePicture', ''))
+    }
+
+    # Add description if it exists
+    if 'description' in item:
+        car_data['description'] = item.get('description')
+
+    return car_data
+
+
+async def query_feed(limit: Optional[int], start_key: Optional[Dict[str, Any]], with_likers: bool) -> tuple:
+    """
+    Query the feed index for public posts (newest first). Each shard is queried concurrently for up to a page of
+    posts after the cursor, the shards are merged by (savedAt, userId), and the likes (and likers) of the page are
+    read from the table with BatchGetItem, since the index doesn't carry them.
+
+    Args:
+        limit: The page size (None for the whole feed).
+        start_key: The userId and savedAt of the last post of the previous page, if any.
+        with_likers: Whether to read likedBy (to flag a viewer's likes).
+
+    Returns:
+        A tuple containing the list of car items (with this worker's unflushed likes applied) and the key to resume
+        from (None at the end of the feed).
+    """
+
+    # Get the shared table handle
+    cars_table = get_table(DYNAMODB_TABLE_NAME)
+    after = (start_key['savedAt'], start_key['userId']) if start_key else None
+
+    async def query_shard(shard: str) -> tuple:
+        # Returns the shard's posts after the cursor (at least a page of them unless the shard ends) and whether
+        # the shard has more
+        condition = Key('feedShard').eq(shard)
+        if after:
+            # Posts saved at the same time as the cursor's are filtered below
+            condition = condition & Key('savedAt').lte(after[0])
+        query_kwargs = {
+            'IndexName': DYNAMODB_FEED_INDEX_NAME,
+            'KeyConditionExpression': condition,
+            'ScanIndexForward': False,
+            'ProjectionExpression': "userId, savedAt, make, model, #yr, link, imageUrl, imageVariants, description, username, profilePicture",
+            'ExpressionAttributeNames': {
+                "#yr": "year"
+            }
+        }
+
+        items = []
+        while True:
+            if limit:
+                query_kwargs['Limit'] = limit - len(items)
+
+            response = await run_io(cars_table.query, **query_kwargs)
+            items.extend(
+                item for item in response.get('Items', [])
+                if after is None or (item['savedAt'], item['userId']) < after
+            )
+            query_kwargs['ExclusiveStartKey'] = response.get('LastEvaluatedKey')
+
+            if not query_kwargs['ExclusiveStartKey'] or (limit and len(items) >= limit):
+                return items, query_kwargs['ExclusiveStartKey'] is not None
+
+    shards = await asyncio.gather(*(query_shard(f"public#{shard}") for shard in range(FEED_SHARDS)))
+
+    merged = sorted(
+        (item for shard_items, _ in shards for item in shard_items),
+        key=lambda item: (item['savedAt'], item['userId']),
+        reverse=True
+    )
+    page = merged[:limit] if limit else merged
+    more = len(merged) > len(page) or any(shard_more for _, shard_more in shards)
+    start_key = {'userId': page[-1]['userId'], 'savedAt': page[-1]['savedAt']} if more and page else None
+
+    # Read the likes from the table (posts deleted since the index was read are dropped)
+    likes = await batch_get_likes([(item['userId'], item['savedAt']) for item in page], with_likers)
+    items = []
+    for item in page:
+        stored = likes.get((item['userId'], item['savedAt']))
+        if stored is None:
+            continue
+        item['likes'] = stored.get('likes', 0)
+        if with_likers:
+            # The likers are only read to flag the viewer's likes and are never returned
+            item['likedBy'] = stored.get('likedBy', set())
+        items.append(item)
+
+    # Include likes still waiting in the like buffer
+    for item in items:
+        like_buffer.apply_pending(item)
+
+    return items, start_key
+
+
+class FeedSnapshot:
+    """
+    In-memory copy of the newest max_posts public posts, so feed pages are sliced from memory instead of querying
+    DynamoDB and resolving users on every request.
+
+    The first request builds the snapshot; after ttl seconds it is still served while one background refresh
+    rebuilds it (stale-while-revalidate, single-flight). Saves, deletes, likes and profile changes on this worker
+    patch it in place, and patches made during a refresh are replayed on the rebuilt snapshot. Pages use the same
+    cursors as the DynamoDB query, and pages past the end of a truncated snapshot are queried from DynamoDB.
+    """
+
+    def __init__(self, ttl: float, max_posts: int):
+        self.enabled = ttl > 0
+        self.ttl = ttl
+        self.max_posts = max_posts
+        # (savedAt, userId) keys in ascending order, and the posts and their likers by key
+        self._keys: List[tuple] = []
+        self._cars: Dict[tuple, Dict[str, Any]] = {}
+        self._likers: Dict[tuple, set] = {}
+        # Whether older posts exist beyond the snapshot
+        self._truncated = False
+        self._built_at = None
+        self._refresh_task = None
+        self._replay = None
+        # Identifies the snapshot's contents, to key the pages rendered from it
+        self._instance = secrets.token_hex(4)
+        self._revision = 0
+        self.hits = 0
+        self.fallbacks = 0
+        self.refreshes = 0
+        self.failures = 0
+        self.patches = 0
+
+    @property
+    def revision(self) -> str:
+        return f"{self._instance}:{self._revision}"
+
+    async def _build(self) -> None:
+        items, start_key = await query_feed(self.max_posts, None, with_likers=True)
+        profiles = await resolve_user_profiles([item.get('userId') for item in items])
+
+        keys = sorted((item['savedAt'], item['userId']) for item in items)
+        cars = {}
+        likers = {}
+        for item in items:
+            key = (item['savedAt'], item['userId'])
+            cars[key] = format_feed_car(item, profiles.get(item['userId'], {}))
+            likers[key] = set(item.get('likedBy', ()))
+
+        replay = self._replay or []
+        self._keys, self._cars, self._likers = keys, cars, likers
+        self._truncated = start_key is not None
+        self._built_at = time.monotonic()
+        self._revision += 1
+        self.refreshes += 1
+
+        # Reapply the patches made while the feed was being read
+        for patch in replay:
+            patch()
+
+    async def _refresh(self) -> None:
+        self._replay = []
+        try:
+            await self._build()
+        except Exception as e:
+            self.failures += 1
+            print(f"Error refreshing feed snapshot: {str(e)}")
+        finally:
+            self._replay = None
+            self._refresh_task = None
+
+    def _start_refresh(self) -> asyncio.Task:
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh())
+        return self._refresh_task
+
+    async def ready(self) -> bool:
+        """Make sure a snapshot exists, starting a background refresh if it is stale. Returns False if there is none"""
+        if not self.enabled:
+            return False
+        if self._built_at is None:
+            # Concurrent first requests share one build
+            await asyncio.shield(self._start_refresh())
+        elif time.monotonic() - self._built_at > self.ttl:
+            self._start_refresh()
+        return self._built_at is not None
+
+    def page(self, limit: Optional[int], start_key: Optional[Dict[str, Any]], viewer_id: Optional[str]) -> Optional[tuple]:
+        """
+        Slice a page of posts (newest first) from the snapshot.
+
+        Args:
+            limit: The page size (None for the whole feed).
+            start_key: The decoded cursor, if any.
+            viewer_id: The Cognito user id of the viewer, to flag the posts they liked.
+
+        Returns:
+            A tuple containing the posts and the LastEvaluatedKey of the page (None on the last page), or None if the
+            page reaches past the end of a truncated snapshot.
+        """
+
+        end = len(self._keys)
+        if start_key:
+            end = bisect.bisect_left(self._keys, (start_key.get('savedAt'), start_key.get('userId')))
+
+        if limit is None or end < limit or (end == limit and self._truncated):
+            if self._truncated:
+                self.fallbacks += 1
+                return None
+            start = 0
+        else:
+            start = end - limit
+
+        page_keys = self._keys[start:end][::-1]
+        cars = [
+            {**self._cars[key], 'likedByViewer': bool(viewer_id) and viewer_id in self._likers[key]}
+            for key in page_keys
+        ]
+
+        last_key = None
+        if start > 0:
+            saved_at, user_id = page_keys[-1]
+            last_key = {'savedAt': saved_at, 'userId': user_id}
+
+        self.hits += 1
+        return cars, last_key
+
+    def _patch(self, patch) -> None:
+        # Patches are no-ops before the first build (it reads the feed after them)
+        if self._built_at is None:
+            return
+        patch()
+        self._revision += 1
+        self.patches += 1
+        if self._replay is not None:
+            self._replay.append(patch)
+
+    def put(self, item: Dict[str, Any], profile: Dict[str, str]) -> None:
+        """Add or replace a saved post (private posts are removed)"""
+        key = (item['savedAt'], item['userId'])
+        if 'feedShard' not in item:
+            self.remove(item['userId'], item['savedAt'])
+            return
+
+        def patch():
+            # Posts older than a truncated snapshot belong to the part that is queried from DynamoDB
+            if self._truncated and self._keys and key < self._keys[0]:
+                return
+            if key not in self._cars:
+                bisect.insort(self._keys, key)
+            self._cars[key] = format_feed_car(item, profile)
+            self._likers[key] = set(item.get('likedBy', ()))
+        self._patch(patch)
+
+    def remove(self, user_id: str, saved_at: str) -> None:
+        """Remove a deleted post"""
+        key = (saved_at, user_id)
+
+        def patch():
+            if self._cars.pop(key, None) is not None:
+                self._keys.pop(bisect.bisect_left(self._keys, key))
+                self._likers.pop(key, None)
+        self._patch(patch)
+
+    def like(self, poster_id: str, saved_at: str, liker_id: str, like: bool, likes: int) -> None:
+        """Apply a like or unlike with the post's updated count"""
+        key = (saved_at, poster_id)
+
+        def patch():
+            if key not in self._cars:
+                return
+            self._cars[key] = {**self._cars[key], 'likes': likes}
+            if like:
+                self._likers[key].add(liker_id)
+            else:
+                self._likers[key].discard(liker_id)
+        self._patch(patch)
+
+    def update_profile(self, user_id: str, profile: Dict[str, str]) -> None:
+        """Show a poster's new username or profile photo on their posts"""
+        def patch():
+            for key, car in self._cars.items():
+                if key[1] == user_id:
+                    self._cars[key] = {**car, 'username': profile['username'], 'profilePicture': profile['profilePhoto']}
+        self._patch(patch)
+
+    async def close(self) -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'posts': len(self._keys),
+            'truncated': self._truncated,
+            'ageSeconds': round(time.monotonic() - self._built_at, 1) if self._built_at is not None else None,
+            'hits': self.hits,
+            'fallbacks': self.fallbacks,
+            'refreshes': self.refreshes,
+            'failures': self.failures,
+            'patches': self.patches
+        }
+
+
+# In-memory feed snapshot (defaults: refreshed after 30 seconds, newest 1000 posts; a TTL of 0 turns it off)
+feed_snapshot = FeedSnapshot(
+    ttl=float(os.getenv('FEED_SNAPSHOT_TTL', 30)),
+    max_posts=int(os.getenv('FEED_SNAPSHOT_MAX_POSTS', 1000))
+)
+
+
+async def close_feed_snapshot():
+    """Stop a running snapshot refresh before shutting down"""
+    await feed_snapshot.close()
+
+# Runs before the I/O pool shuts down, since the refresh uses it
+app.router.on_shutdown.insert(0, close_feed_snapshot)
+
+
+@app.get("/get-all-cars")
+async def get_all_cars(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_FEED_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    viewer_id: Optional[str] = None
+) -> Any:
+    """
+    Retrieve public car posts (newest first) along with user information. Pages are served from the in-memory feed
+    snapshot when it covers them. The response has an ETag, and a matching If-None-Match returns 304 Not Modified
+    without querying the feed.
+    
+    Args:
+        request (Request): The incoming request.
+        limit (int, optional): The page size. If omitted, the whole feed is returned.
+        cursor (str, optional): The "nextCursor" from a previous page.
+        viewer_id (str, optional): The Cognito user id of the viewer, to flag the posts they liked.
+    
+    Returns:
+        A JSON object containing a list of CarData for the page of public car posts with the key "cars" and the cursor for the next page with the key "nextCursor" (None on the last page) if "success" is True. Each post has its like count with the key "likes", whether the viewer liked it with the key "likedByViewer" (the likers are listed by /get-likers) and srcset strings of its image's derivatives by content type with the key "imageSrcSet".
+    """
+
+    try:
+        start_key = decode_feed_cursor(cursor) if cursor else None
+        # Shared caches may keep the anonymous feed briefly; pages flagging a viewer's likes are private
+        cache_control = "private, no-cache" if viewer_id else f"public, max-age={FEED_CACHE_MAX_AGE}, must-revalidate"
+
+        # Serve the page from the snapshot if it covers it. Pages are rendered once per snapshot revision and their
+        # ETag is a digest of the body, so it matches across workers and survives refreshes that changed nothing.
+        rendered = None
+        if await feed_snapshot.ready():
+            page_key = (feed_snapshot.revision, limit, cursor, viewer_id)
+            rendered = snapshot_pages.get(page_key)
+            if rendered is None:
+                page = feed_snapshot.page(limit, start_key, viewer_id)
+                if page is not None:
+                    cars, last_key = page
+                    next_cursor = encode_feed_cursor(last_key) if last_key else None
+                    body = FastJSONResponse({"success": True, "cars": cars, "nextCursor": next_cursor}).body
+                    rendered = (body, make_etag('feed-page', hashlib.sha256(body).hexdigest()))
+                    snapshot_pages[page_key] = rendered
+        if rendered is not None:
+            body, etag = rendered
+            headers = cache_headers(etag, cache_control)
+            if is_not_modified(request, etag):
+                return Response(status_code=304, headers=headers)
+            return await json_response(request, body, headers, cache_key=etag)
+
+        version = await read_version(FEED_VERSION_KEY, 'feedVersion')
+        etag = make_etag('feed', version, limit, cursor, viewer_id, like_buffer.version_token(), version_bumper.version_token()) if version is not None else None
+        headers = cache_headers(etag, cache_control)
+        if is_not_modified(request, etag):
+            return Response(status_code=304, headers=headers)
+
+        # Query the feed index until the page is full (or the whole feed if no limit)
+        items, start_key = await query_feed(limit, start_key, with_likers=bool(viewer_id))
+        next_cursor = encode_feed_cursor(start_key) if start_key else None
+        
+        # Resolve current usernames and profile photos for all posters in batches
+        profiles = await resolve_user_profiles([item.get('userId') for item in items])
+        
+        # Format the response
+        cars = []
+        for item in items:
+            car_data = format_feed_car(item, profiles.get(item.get('userId'), {}))
+            car_data['likedByViewer'] = bool(viewer_id) and viewer_id in item.get('likedBy', ())
+            cars.append(car_data)
+        
+        return await json_response(request, {"success": True, "cars": cars, "nextCursor": next_cursor}, headers)
+    except HTTPException:
+        # Re-raise HTTP exceptions
+        raise
+    except Exception as e:
+        print(f"Error in get-all-cars: {str(e)}")
+        return {"success": False, "error": str(e)}
+
+
+@app.get("/get-likers/{poster_id}/{saved_at}")
+async def get_likers(
+    request: Request,
+    poster_id: str,
+    saved_at: str,
+    limit: int = Query(50, ge=1, le=MAX_FEED_PAGE_SIZE),
+    cursor: Optional[str] = None
+) -> Any:
+    """
+    List the users who liked a post, with their current usernames and profile photos.
+
+    Args:
+        request (Request): The incoming request.
+        poster_id (str): The Cognito user id of the poster.
+        saved_at (str): The timestamp of the car post.
+        limit (int, optional): The page size.
+        cursor (str, optional): The "nextCursor" from a previous page.
+
+    Returns:
+        A JSON object containing a page of likers (dicts with keys "userId", "username" and "profilePhoto") with the key "likers" and the cursor for the next page with the key "nextCursor" (None on the last page) if "success" is True.
+    """
+
+    try:
+        after = None
+        if cursor:
+            try:
+                padded = cursor + '=' * (-len(cursor) % 4)
+                after = json.loads(base64.urlsafe_b64decode(padded.encode())).get('likerId')
+            except (ValueError, TypeError, AttributeError):
+                after = None
+            if not isinstance(after, str):
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+
+        # Get the shared table handle
+        cars_table = get_table(DYNAMODB_TABLE_NAME)
+
+        response = await run_io(
+            cars_table.get_item,
+            Key={
+                'userId': poster_id,
+                'savedAt': saved_at
+            },
+            ProjectionExpression="userId, likedBy"
+        )
+
+        if 'Item' not in response:
+            return {"success": False, "error": "Car not found"}
+
+        # Include likes still waiting in the like buffer
+        item = like_buffer.apply_pending({'userId': poster_id, 'savedAt': saved_at, 'likedBy': response['Item'].get('likedBy', set())})
+
+        # Sets are unordered, so page through the likers in id order
+        liker_ids = sorted(item['likedBy'])
+        if after is not None:
+            liker_ids = [liker_id for liker_id in liker_ids if liker_id > after]
+        page = liker_ids[:limit]
+        next_cursor = encode_feed_cursor({'likerId': page[-1]}) if len(liker_ids) > limit else None
+
+        # Resolve current usernames and profile photos for the page in batches
+        profiles = await resolve_user_profiles(page)
+        likers = [{'userId': liker_id, **profiles.get(liker_id, {})} for liker_id in page]
+
+        return await json_response(request, {"success": True, "likers": likers, "nextCursor": next_cursor})
+    except HTTPException:
+        # Re-raise HTTP exceptions
+        raise
+    except Exception as e:
+        print(f"Error in get-likers: {str(e)}")
+        return {"success": False, "error": str(e)}
+
+
+async def convert_legacy_likes(cars_table, key: Dict[str, str]) -> None:
+    """
+    Convert a post's likedBy attribute from the old list format to a string set.
+
+    Args:
+        cars_table: The cars Table resource.
+        key: The key of the car post.
+    """
+
+    response = await run_io(cars_table.get_item, Key=key, ProjectionExpression="likedBy")
+    liked_by = response.get('Item', {}).get('likedBy')
+    if not isinstance(liked_by, list):
+        return
+
+    # Empty sets can't be stored, so remove the attribute instead. Only convert if the list is unchanged.
+    try:
+        if liked_by:
+            await run_io(
+                cars_table.update_item,
+                Key=key,
+                UpdateExpression="SET likedBy = :liked_by",
+                ConditionExpression="likedBy = :old",
+                ExpressionAttributeValues={':liked_by': set(liked_by), ':old': liked_by}
+            )
+        else:
+            await run_io(
+                cars_table.update_item,
+                Key=key,
+                UpdateExpression="REMOVE likedBy",
+                ConditionExpression="likedBy = :old",
+                ExpressionAttributeValues={':old': liked_by}
+            )
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+            raise
+
+
+async def update_likes(poster_id: str, saved_at: str, liker_id: str, like: bool) -> Dict[str, Any]:
+    """
+    Add or remove a like with one conditional update of the likedBy string set and the likes counter.
+
+    Args:
+        poster_id: The Cognito user id of the poster.
+        saved_at: The timestamp of the car post.
+        liker_id: The Cognito user id of the liker.
+        like: True to add the like, False to remove it.
+
+    Returns:
+        A JSON object indicating whether the update was successful with the key "success" and the updated likes count with the key "likes" if "success" is True.
+    """
+
+    # Get the shared table handle
+    cars_table = get_table(DYNAMODB_TABLE_NAME)
+    key = {'userId': poster_id, 'savedAt': saved_at}
+
+    if like:
+        update_kwargs = {
+            'UpdateExpression': "ADD likedBy :liker, likes :inc",
+            'ConditionExpression': "attribute_exists(userId) AND NOT contains(likedBy, :liker_id)",
+            'ExpressionAttributeValues': {':liker': {liker_id}, ':liker_id': liker_id, ':inc': 1}
+        }
+    else:
+        update_kwargs = {
+            'UpdateExpression': "DELETE likedBy :liker ADD likes :dec",
+            'ConditionExpression': "contains(likedBy, :liker_id)",
+            'ExpressionAttributeValues': {':liker': {liker_id}, ':liker_id': liker_id, ':dec': -1}
+        }
+
+    for attempt in range(2):
+        try:
+            response = await run_io(
+                cars_table.update_item,
+                Key=key,
+                ReturnValues="UPDATED_NEW",
+                ReturnValuesOnConditionCheckFailure="ALL_OLD",
+                **update_kwargs
+            )
+            break
+        except ClientError as e:
+            error = e.response.get('Error', {})
+            if error.get('Code') == 'ConditionalCheckFailedException':
+                # The old item is only returned if the post exists
+                if 'Item' not in e.response:
+                    return {"success": False, "error": "Car not found"}
+                if like:
+                    return {"success": False, "error": "User has already liked this post"}
+                return {"success": False, "error": "User has not liked this post"}
+
+            # Posts saved before likes were stored as a set still have a list, so convert it once and retry
+            if error.get('Code') == 'ValidationException' and attempt == 0:
+                await convert_legacy_likes(cars_table, key)
+                continue
+            raise
+
+    # The like count shows in the feed and the poster's cars
+    version_bumper.mark([poster_id])
+
+    # Get and return the updated likes count
+    return {"success": True, "likes": response.get('Attributes', {}).get('likes', 0)}
+
+
+class LikeBuffer:
+    """
+    Coalesces like/unlike intents per post and writes them in batches, so a trending post costs a few writes per
+    interval instead of one write per like.
+
+    Intents are kept only while they change what is stored: each post's likes and likers are read once per count_ttl,
+    an unlike of a buffered like cancels it, and an intent that looks redundant (a repeated like or an unlike of a
+    non-liker) is only rejected once a consistent read confirms it, since another worker may have written the like.
+    Buffered intents are flushed every interval, or as soon as a post has max_pending likers waiting. A flush adds
+    the new likers with one update and removes the unlikers with another, reading the old set back (UPDATED_OLD) to
+    count the likes that actually changed, then applies that delta to the counter. Failed flushes are retried on the
+    next interval and everything is flushed on shutdown (intents still buffered if the process dies are lost).
+    Pending intents are overlaid on reads from this worker, so likers see their own likes right away. Each flush
+    marks the change counters of the feed and the affected posters once.
+    """
+
+    def __init__(self, enabled: bool, interval: float, max_pending: int, count_ttl: float):
+        self.enabled = enabled
+        self.interval = interval
+        self.max_pending = max_pending
+        self._pending: Dict[tuple, Dict[str, bool]] = {}
+        self._inflight: Dict[tuple, Dict[str, bool]] = {}
+        # Counter changes already made to the likedBy set but not yet to likes
+        self._deltas: Dict[tuple, int] = {}
+        # Last known likes count and likers per post, for the checks and counts before a flush
+        self._counts = TTLCache(maxsize=10000, ttl=count_ttl)
+        self._task = None
+        self._flush_tasks = set()
+        # Identifies this worker's unflushed state in ETags
+        self._instance = secrets.token_hex(4)
+        self._revision = 0
+        self._versioning = 0
+        self.intents = 0
+        self.flushes = 0
+        self.writes = 0
+        self.failures = 0
+
+    def _intents(self, key: tuple) -> Dict[str, bool]:
+        # Newer pending intents override the batch being flushed
+        return {**self._inflight.get(key, {}), **self._pending.get(key, {})}
+
+    async def record(self, poster_id: str, saved_at: str, liker_id: str, like: bool) -> Dict[str, Any]:
+        key = (poster_id, saved_at)
+
+        # Look up the current count and likers once per post, which also checks that the post exists
+        known = self._counts.get(key)
+        if known is None:
+            known = await self._load(key, consistent=False)
+            if known is None:
+                return {"success": False, "error": "Car not found"}
+
+        # Cached likers may miss another worker's writes, so confirm a redundant intent against the table first
+        buffered = liker_id in self._pending.get(key, {}) or liker_id in self._inflight.get(key, {})
+        if not buffered and (liker_id in known['likedBy']) is like:
+            known = await self._load(key, consistent=True)
+            if known is None:
+                return {"success": False, "error": "Car not found"}
+
+        # Whether the liker likes the post once the batch being flushed is written, and with the pending intents
+        flushed = self._inflight.get(key, {}).get(liker_id, liker_id in known['likedBy'])
+        if self._pending.get(key, {}).get(liker_id, flushed) is like:
+            if like:
+                return {"success": False, "error": "User has already liked this post"}
+            return {"success": False, "error": "User has not liked this post"}
+
+        # Every buffered intent changes the count by one; undoing one drops it instead
+        pending = self._pending.setdefault(key, {})
+        if like is flushed:
+            del pending[liker_id]
+            if not pending:
+                del self._pending[key]
+        else:
+            pending[liker_id] = like
+        self._revision += 1
+        self.intents += 1
+        if len(pending) >= self.max_pending:
+            self._schedule_flush(key)
+
+        return {"success": True, "likes": max(known['likes'] + self._pending_delta(key), 0)}
+
+    async def _load(self, key: tuple, consistent: bool) -> Optional[Dict[str, Any]]:
+        # Read and cache a post's likes and likers (None if the post doesn't exist)
+        response = await run_io(
+            get_table(DYNAMODB_TABLE_NAME).get_item,
+            Key={'userId': key[0], 'savedAt': key[1]},
+            ProjectionExpression="likes, likedBy",
+            ConsistentRead=consistent
+        )
+        if 'Item' not in response:
+            self._counts.pop(key, None)
+            return None
+        known = {
+            'likes': response['Item'].get('likes', 0),
+            'likedBy': set(response['Item'].get('likedBy') or [])
+        }
+        self._counts[key] = known
+        return known
+
+    def _intents_delta(self, key: tuple) -> int:
+        # Inflight and pending intents each change the count, even for the same liker
+        intents = [*self._inflight.get(key, {}).values(), *self._pending.get(key, {}).values()]
+        return sum(1 if like else -1 for like in intents)
+
+    def _pending_delta(self, key: tuple) -> int:
+        return self._deltas.get(key, 0) + self._intents_delta(key)
+
+    def _update_likers(self, key: tuple, added: set = frozenset(), removed: set = frozenset()) -> None:
+        # Keep the known likers in step with a set update
+        known = self._counts.get(key)
+        if known is not None:
+            known['likedBy'] = (known['likedBy'] | added) - removed
+
+    def apply_pending(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        """Overlay this worker's unflushed likes on a car item read from DynamoDB"""
+        key = (item.get('userId'), item.get('savedAt'))
+        intents = self._intents(key)
+        delta = self._deltas.get(key, 0)
+        if not intents and not delta:
+            return item
+
+        if 'likedBy' in item:
+            # The stored likers are known, so the count can be adjusted exactly
+            liked_by = set(item['likedBy'])
+            for liker_id, like in intents.items():
+                if like and liker_id not in liked_by:
+                    liked_by.add(liker_id)
+                    delta += 1
+                elif not like and liker_id in liked_by:
+                    liked_by.discard(liker_id)
+                    delta -= 1
+            item['likedBy'] = liked_by
+        else:
+            delta += self._intents_delta(key)
+
+        item['likes'] = max(item.get('likes', 0) + delta, 0)
+        return item
+
+    def version_token(self) -> str:
+        """Describe the likes overlaid on this worker's reads for ETags (empty once they are flushed and versioned)"""
+        if not (self._pending or self._inflight or self._deltas or self._versioning):
+            return ''
+        return f"{self._instance}:{self._revision}"
+
+    def discard(self, poster_id: str, saved_at: str) -> None:
+        """Drop the buffered likes of a deleted post"""
+        key = (poster_id, saved_at)
+        self._pending.pop(key, None)
+        self._deltas.pop(key, None)
+        self._counts.pop(key, None)
+
+    def _schedule_flush(self, key: tuple) -> None:
+        if key in self._inflight:
+            # The periodic flush picks the post up once the current batch is written
+            return
+        task = asyncio.create_task(self._flush_keys([key]))
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
 
-    try:
-        # Get connections from the pool
-        dynamodb = get_dynamodb()
-        cars_table = dynamodb.Table(DYNAMODB_TABLE_NAME)
-        users_table = dynamodb.Table(DYNAMODB_USERS_TABLE_NAME)
-        
-        # Retrieve public cars
-        response = cars_table.scan(
-            FilterExpression=Attr('isPrivate').eq(False) | Attr('isPrivate').not_exists(),
-            ProjectionExpression="userId, savedAt, make, model, #yr, link, imageUrl, likes, likedBy, description, username, profilePicture",
-            ExpressionAttributeNames={
-                "#yr": "year"
-            }
-        )
-        
-        # Collect unique user IDs to batch query usernames and profile photos
-        user_ids = {item.get('userId') for item in response.get('Items', [])}
-        
-        # Fetch all usernames and profile photos with cache
-        usernames = {}
-        profile_photos = {}
-        
-        for user_id in user_ids:
-            # Check username cache first
-            if user_id in username_cache:
-                usernames[user_id] = username_cache[user_id]
-            else:
+    async def _update_set(self, cars_table, db_key: Dict[str, str], action: str, likers: set) -> set:
+        # Returns the likedBy set before the update; the condition stops updates from recreating deleted posts
+        for attempt in range(2):
+            try:
+                response = await run_io(
+                    cars_table.update_item,
+                    Key=db_key,
+                    UpdateExpression=f"{action} likedBy :likers",
+                    ConditionExpression="attribute_exists(userId)",
+                    ExpressionAttributeValues={':likers': likers},
+                    ReturnValues="UPDATED_OLD"
+                )
+                self.writes += 1
+                return set(response.get('Attributes', {}).get('likedBy', set()))
+            except ClientError as e:
+                # Posts saved before likes were stored as a set still have a list
+                if e.response.get('Error', {}).get('Code') == 'ValidationException' and attempt == 0:
+                    await convert_legacy_likes(cars_table, db_key)
+                    continue
+                raise
+
+    async def _flush_keys(self, keys: List[tuple]) -> None:
+        # Reads keep the worker's token in their ETags until the counters are marked
+        self._versioning += 1
+        try:
+            posters = await asyncio.gather(*(self._flush_key(key) for key in keys))
+            posters = [poster_id for poster_id in posters if poster_id]
+            if posters:
+                version_bumper.mark(posters)
+        finally:
+            self._versioning -= 1
+
+    async def _flush_key(self, key: tuple) -> Optional[str]:
+        # Returns the poster id if anything was written
+        intents = self._pending.pop(key, {})
+        if not intents and not self._deltas.get(key):
+            return None
+
+        self._inflight[key] = intents
+        writes = self.writes
+        cars_table = get_table(DYNAMODB_TABLE_NAME)
+        db_key = {'userId': key[0], 'savedAt': key[1]}
+
+        try:
+            adds = {liker_id for liker_id, like in intents.items() if like}
+            removes = set(intents) - adds
+
+            # Record each set update's effect right away, so a failure later in the flush can't apply it twice
+            if adds:
+                old = await self._update_set(cars_table, db_key, 'ADD', adds)
+                self._deltas[key] = self._deltas.get(key, 0) + len(adds - old)
+                self._update_likers(key, added=adds)
+                for liker_id in adds:
+                    del intents[liker_id]
+            if removes:
+                old = await self._update_set(cars_table, db_key, 'DELETE', removes)
+                self._deltas[key] = self._deltas.get(key, 0) - len(removes & old)
+                self._update_likers(key, removed=removes)
+                for liker_id in removes:
+                    del intents[liker_id]
+
+            delta = self._deltas.pop(key, 0)
+            if delta:
                 try:
-                    user_response = users_table.get_item(
-                        Key={'userId': user_id},
-                        ProjectionExpression="username, profilePhoto"
+                    response = await run_io(
+                        cars_table.update_item,
+                        Key=db_key,
+                        UpdateExpression="ADD likes :delta",
+                        ConditionExpression="attribute_exists(userId)",
+                        ExpressionAttributeValues={':delta': delta},
+                        ReturnValues="UPDATED_NEW"
                     )
-                    if 'Item' in user_response:
-                        # Get username
-                        username = user_response['Item'].get('username', 'Anonymous')
-                        usernames[user_id] = username
-                        username_cache[user_id] = username
-                        
-                        # Get profile photo
-                        photo_url = user_response['Item'].get('profilePhoto', '')
-                        profile_photos[user_id] = photo_url
-                        profile_photo_cache[user_id] = photo_url
-                    else:
-                        usernames[user_id] = 'Anonymous'
-                        profile_photos[user_id] = ''
                 except Exception:
-                    usernames[user_id] = 'Anonymous'
-                    profile_photos[user_id] = ''
-            
-            # Check profile photo cache if not already fetched
-            if user_id not in profile_photos:
-                if user_id in profile_photo_cache:
-                    profile_photos[user_id] = profile_photo_cache[user_id]
+                    self._deltas[key] = self._deltas.get(key, 0) + delta
+                    raise
+                self.writes += 1
+                if key in self._counts:
+                    self._counts[key]['likes'] = response.get('Attributes', {}).get('likes', 0)
+            self.flushes += 1
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                # The post was deleted
+                self.discard(*key)
+            else:
+                self._requeue(key, intents, e)
+        except Exception as e:
+            self._requeue(key, intents, e)
+        finally:
+            self._inflight.pop(key, None)
+
+        return key[0] if self.writes > writes else None
+
+    def _requeue(self, key: tuple, intents: Dict[str, bool], error: Exception) -> None:
+        # Put the unwritten intents back under any newer ones
+        self.failures += 1
+        print(f"Error flushing likes for {key[0]}/{key[1]}: {str(error)}")
+        if intents:
+            # A newer intent for the same liker undid the unwritten one, so both are dropped
+            pending = dict(intents)
+            for liker_id, like in self._pending.get(key, {}).items():
+                if liker_id in pending:
+                    del pending[liker_id]
                 else:
-                    # This would only happen if we had username in cache but not profile photo
-                    try:
-                        user_response = users_table.get_item(
-                            Key={'userId': user_id},
-                            ProjectionExpression="profilePhoto"
-                        )
-                        if 'Item' in user_response:
-                            photo_url = user_response['Item'].get('profilePhoto', '')
-                            profile_photos[user_id] = photo_url
-                            profile_photo_cache[user_id] = photo_url
-                        else:
-                            profile_photos[user_id] = ''
-                            profile_photo_cache[user_id] = ''
-                    except Exception:
-                        profile_photos[user_id] = ''
-        
-        # Format the response
-        cars = []
-        for item in response.get('Items', []):
-            user_id = item.get('userId')
-            
-            # Get username from our pre-fetched data
-            current_username = usernames.get(user_id, item.get('username', 'Anonymous'))
-            current_profile_photo = profile_photos.get(user_id, item.get('profilePicture', ''))
-                
-            car_data = {
-                'userId': user_id,
-                'savedAt': item.get('savedAt'),
-                'carInfo': {
-                    'make': item.get('make'),
-                    'model': item.get('model'),
-                    'year': item.get('year'),
-                    'link': item.get('link'),
-                },
-                'imageUrl': item.get('imageUrl'),
-                'likes': item.get('likes', 0),
-                'likedBy': item.get('likedBy', []),
-                'username': current_username,
-                'profilePicture': current_profile_photo
-            }
-            
-            # Add description if it exists
-            if 'description' in item:
-                car_data['description'] = item.get('description')
-                
-            cars.append(car_data)
-        
-        # Sort by savedAt in descending order (newest first)
-        cars.sort(key=lambda x: x['savedAt'], reverse=True)
-        
-        return {"success": True, "cars": cars}
-    except Exception as e:
-        print(f"Error in get-all-cars: {str(e)}")
-        return {"success": False, "error": str(e)}
+                    pending[liker_id] = like
+            if pending:
+                self._pending[key] = pending
+            else:
+                self._pending.pop(key, None)
+
+    async def flush(self) -> None:
+        """Write all buffered likes"""
+        keys = [key for key in set(self._pending) | set(self._deltas) if key not in self._inflight]
+        if keys:
+            await self._flush_keys(keys)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._flush_tasks:
+            await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+
+        # Retry a few times so a transient error doesn't lose the last likes
+        for _ in range(3):
+            if not self._pending and not self._deltas:
+                return
+            await self.flush()
+        print(f"Warning: {sum(len(intents) for intents in self._pending.values())} buffered likes could not be written")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'pendingPosts': len(self._pending),
+            'pendingIntents': sum(len(intents) for intents in self._pending.values()),
+            'intents': self.intents,
+            'flushes': self.flushes,
+            'writes': self.writes,
+            'failures': self.failures
+        }
+
+
+# Optional like write buffer (defaults: off, flush every second or at 200 likers per post)
+like_buffer = LikeBuffer(
+    enabled=os.getenv('LIKE_BUFFER_ENABLED', 'false').lower() in ('1', 'true', 'yes'),
+    interval=float(os.getenv('LIKE_BUFFER_INTERVAL', 1.0)),
+    max_pending=int(os.getenv('LIKE_BUFFER_MAX_PENDING', 200)),
+    count_ttl=float(os.getenv('LIKE_BUFFER_COUNT_TTL', 60))
+)
+
+
+@app.on_event("startup")
+async def start_like_buffer():
+    """Start flushing buffered likes"""
+    like_buffer.start()
+
+
+async def flush_like_buffer():
+    """Write the buffered likes before shutting down"""
+    await like_buffer.close()
+
+# Runs before the I/O pool shuts down, since the flush needs it
+app.router.on_shutdown.insert(0, flush_like_buffer)
 
 
 @app.post("/like-car/{poster_id}/{saved_at}/{liker_id}")
@@ -663,51 +4110,15 @@ async def like_car(poster_id: str, saved_at: str, liker_id: str) -> Dict[str, An
     """
 
     try:
-        # Get connection from pool
-        dynamodb = get_dynamodb()
-        cars_table = dynamodb.Table(DYNAMODB_TABLE_NAME)
-        
-        # First get the car details
-        car_response = cars_table.get_item(
-            Key={
-                'userId': poster_id,
-                'savedAt': saved_at
-            },
-            ProjectionExpression="likedBy, likes"
-        )
-        
-        # Car does not exist
-        if 'Item' not in car_response:
-            return {"success": False, "error": "Car not found"}
-            
-        # Get existing likes list or empty list if none
-        car = car_response['Item']
-        liked_by = car.get('likedBy', [])
-
-        # Check if user has already liked the post
-        if liker_id in liked_by:
-            return {"success": False, "error": "User has already liked this post"}
+        if like_buffer.enabled:
+            result = await like_buffer.record(poster_id, saved_at, liker_id, like=True)
+        else:
+            result = await update_likes(poster_id, saved_at, liker_id, like=True)
 
-        # Add user to likedBy list and increment likes count
-        liked_by.append(liker_id)
-        response = cars_table.update_item(
-            Key={
-                'userId': poster_id,
-                'savedAt': saved_at
-            },
-            UpdateExpression="SET likedBy = :liked_by, likes = if_not_exists(likes, :zero) + :inc",
-            ExpressionAttributeValues={
-                ':liked_by': liked_by,
-                ':zero': 0,
-                ':inc': 1
-            },
-            ReturnValues="UPDATED_NEW"
-        )
-        
-        # Get and return the updated likes count
-        updated_likes = response.get('Attributes', {}).get('likes', 0)
-        
-        return {"success": True, "likes": updated_likes}
+        # Patch this worker's feed snapshot
+        if result["success"]:
+            feed_snapshot.like(poster_id, saved_at, liker_id, True, result["likes"])
+        return result
     except Exception as e:
         print(f"Error liking car: {str(e)}")
         return {"success": False, "error": str(e)}
@@ -728,60 +4139,51 @@ async def unlike_car(poster_id: str, saved_at: str, liker_id: str) -> Dict[str,
     """
     
     try:
-        # Get connection from pool
-        dynamodb = get_dynamodb()
-        cars_table = dynamodb.Table(DYNAMODB_TABLE_NAME)
-        
-        # First get the car details
-        car_response = cars_table.get_item(
-            Key={
-                'userId': poster_id,
-                'savedAt': saved_at
-            },
-            ProjectionExpression="likedBy, likes"
-        )
-        
-        # Car does not exist
-        if 'Item' not in car_response:
-            return {"success": False, "error": "Car not found"}
-            
-        # Get existing likes list or empty list if none
-        car = car_response['Item']
-        liked_by = car.get('likedBy', [])
-
-        # Check if user has liked this post
-        if liker_id not in liked_by:
-            return {"success": False, "error": "User has not liked this post"}
+        if like_buffer.enabled:
+            result = await like_buffer.record(poster_id, saved_at, liker_id, like=False)
+        else:
+            result = await update_likes(poster_id, saved_at, liker_id, like=False)
 
-        # Remove user from likedBy list and decrement likes count
-        liked_by.remove(liker_id)
-        response = cars_table.update_item(
-            Key={
-                'userId': poster_id,
-                'savedAt': saved_at
-            },
-            UpdateExpression="SET likedBy = :liked_by, likes = if_not_exists(likes, :zero) - :dec",
-            ExpressionAttributeValues={
-                ':liked_by': liked_by,
-                ':zero': 0,
-                ':dec': 1
-            },
-            ReturnValues="UPDATED_NEW"
-        )
-        
-        # Get and return the updated likes count
-        updated_likes = response.get('Attributes', {}).get('likes', 0)
-        
-        return {"success": True, "likes": updated_likes}
+        # Patch this worker's feed snapshot
+        if result["success"]:
+            feed_snapshot.like(poster_id, saved_at, liker_id, False, result["likes"])
+        return result
     except Exception as e:
         print(f"Error unliking car: {str(e)}")
         return {"success": False, "error": str(e)}
 
 
+def reserve_username_action(username: str, user_id: str) -> Dict[str, Any]:
+    """
+    Build the transaction action that reserves a username for a user (it fails if another user holds it).
+
+    Args:
+        username: The username to reserve.
+        user_id: The Cognito user id of the user.
+
+    Returns:
+        A Put action for transact_write_items.
+    """
+
+    return {
+        'Put': {
+            'TableName': DYNAMODB_USERNAMES_TABLE_NAME,
+            'Item': {'username': username, 'userId': user_id},
+            'ConditionExpression': 'attribute_not_exists(username) OR userId = :user_id',
+            'ExpressionAttributeValues': {':user_id': user_id}
+        }
+    }
+
+
+def transaction_cancel_codes(error: ClientError) -> List[str]:
+    """Get the cancellation code of each action of a cancelled transaction"""
+    return [reason.get('Code', 'None') for reason in error.response.get('CancellationReasons', [])]
+
+
 @app.post("/create-user")
 async def create_user(user_data: UserInfo) -> Dict[str, Any]:
     """
-    Create a new user entry in the users table (Cognito user id and username).
+    Create a new user entry in the users table (Cognito user id and username) and reserve the username.
     
     Args:
         user_data (UserInfo): The user data to save.
@@ -791,20 +4193,36 @@ async def create_user(user_data: UserInfo) -> Dict[str, Any]:
     """
 
     try:
-        # Get connection from pool
-        dynamodb = get_dynamodb()
-        users_table = dynamodb.Table(DYNAMODB_USERS_TABLE_NAME)
-        
-        # Add the user to the users table
-        users_table.put_item(
-            Item={
-                'userId': user_data.user_id,
-                'username': user_data.username,
-            }
-        )
+        # Add the user to the users table and reserve the username in one transaction
+        try:
+            await run_io(
+                get_dynamodb().meta.client.transact_write_items,
+                TransactItems=[
+                    reserve_username_action(user_data.username, user_data.user_id),
+                    {
+                        'Put': {
+                            'TableName': DYNAMODB_USERS_TABLE_NAME,
+                            'Item': {
+                                'userId': user_data.user_id,
+                                'username': user_data.username,
+                            },
+                            # Never overwrite an existing user's profile (or leave their username reserved)
+                            'ConditionExpression': 'attribute_not_exists(userId)'
+                        }
+                    }
+                ]
+            )
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'TransactionCanceledException':
+                codes = transaction_cancel_codes(e)
+                if codes[1:2] == ['ConditionalCheckFailed']:
+                    return {"success": False, "error": "User already exists"}
+                if codes[:1] == ['ConditionalCheckFailed']:
+                    return {"success": False, "error": "Username already taken"}
+            raise
         
-        # Update username cache
-        username_cache[user_data.user_id] = user_data.username
+        # Write the new profile through to the cache
+        await run_io(profile_cache.set, user_data.user_id, {'username': user_data.username, 'profilePhoto': ''})
         
         return {"success": True}
     except Exception as e:
@@ -815,7 +4233,7 @@ async def create_user(user_data: UserInfo) -> Dict[str, Any]:
 @app.post("/update-username")
 async def update_username(new_user_data: UpdateUsernameInfo) -> Dict[str, Any]:
     """
-    Update a user's username in the users table.
+    Update a user's username in the users table, moving the username reservation in the same transaction.
     
     Args:
         new_user_data (UpdateUsernameInfo): The user data containing the updated username.
@@ -825,33 +4243,70 @@ async def update_username(new_user_data: UpdateUsernameInfo) -> Dict[str, Any]:
     """
 
     try:
-        # Get connection from pool
-        dynamodb = get_dynamodb()
-        users_table = dynamodb.Table(DYNAMODB_USERS_TABLE_NAME)
+        # Get the shared table handle
+        users_table = get_table(DYNAMODB_USERS_TABLE_NAME)
+        user_id = new_user_data.user_id
+        new_username = new_user_data.new_username
         
-        # Check if username already exists
-        response = users_table.scan(
-            FilterExpression=Attr("username").eq(new_user_data.new_username),
-            ProjectionExpression="userId"
+        # Get the current username to release its reservation
+        response = await run_io(
+            users_table.get_item,
+            Key={'userId': user_id},
+            ProjectionExpression="username, profilePhoto"
         )
-        
-        # If username exists and belongs to a different user, reject the update
-        if response.get('Items'):
-            for item in response.get('Items', []):
-                if item.get('userId') != new_user_data.user_id:
-                    return {"success": False, "error": "Username already taken"}
-        
-        # Update the user's username in the users table
-        users_table.update_item(
-            Key={'userId': new_user_data.user_id},
-            UpdateExpression='SET username = :username',
-            ExpressionAttributeValues={
-                ':username': new_user_data.new_username,
+        user = response.get('Item', {})
+        old_username = user.get('username')
+
+        # Reserve the new username, update the user (only if the username hasn't changed since it was read) and
+        # release the old username, all or nothing
+        if old_username is not None:
+            update_condition = 'username = :old_username'
+            update_values = {':username': new_username, ':old_username': old_username}
+        else:
+            update_condition = 'attribute_not_exists(username)'
+            update_values = {':username': new_username}
+
+        actions = [
+            reserve_username_action(new_username, user_id),
+            {
+                'Update': {
+                    'TableName': DYNAMODB_USERS_TABLE_NAME,
+                    'Key': {'userId': user_id},
+                    'UpdateExpression': 'SET username = :username',
+                    'ConditionExpression': update_condition,
+                    'ExpressionAttributeValues': update_values
+                }
             }
-        )
+        ]
+        if old_username is not None and old_username != new_username:
+            actions.append({
+                'Delete': {
+                    'TableName': DYNAMODB_USERNAMES_TABLE_NAME,
+                    'Key': {'username': old_username},
+                    'ConditionExpression': 'attribute_not_exists(username) OR userId = :user_id',
+                    'ExpressionAttributeValues': {':user_id': user_id}
+                }
+            })
+
+        try:
+            await run_io(get_dynamodb().meta.client.transact_write_items, TransactItems=actions)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'TransactionCanceledException':
+                raise
+            codes = transaction_cancel_codes(e)
+            if codes[:1] == ['ConditionalCheckFailed']:
+                return {"success": False, "error": "Username already taken"}
+            if codes[1:2] == ['ConditionalCheckFailed']:
+                return {"success": False, "error": "Username was changed by another request. Please try again."}
+            raise
         
-        # Update username in cache
-        username_cache[new_user_data.user_id] = new_user_data.new_username
+        # Write the updated profile through to the cache and the feed snapshot
+        profile = profile_from_item({**user, 'username': new_username})
+        await run_io(profile_cache.set, user_id, profile)
+        feed_snapshot.update_profile(user_id, profile)
+
+        # The feed shows current usernames
+        version_bumper.mark(feed=True)
         return {"success": True}
     except Exception as e:
         print(f"Error updating username: {str(e)}")
@@ -871,32 +4326,9 @@ async def get_current_usernames(user_ids: list[str]) -> Dict[str, Any]:
     """
 
     try:
-        # Get connection from pool
-        dynamodb = get_dynamodb()
-        users_table = dynamodb.Table(DYNAMODB_USERS_TABLE_NAME)
-        
         # Get current username for each Cognito user id from users table
-        usernames = {}
-        for user_id in user_ids:
-            # Check cache first
-            if user_id in username_cache:
-                usernames[user_id] = username_cache[user_id]
-            else:
-                try:
-                    response = users_table.get_item(
-                        Key={'userId': user_id},
-                        ProjectionExpression="username"
-                    )
-                    
-                    if 'Item' in response:
-                        username = response['Item'].get('username', 'Anonymous')
-                        usernames[user_id] = username
-                        # Cache for future requests
-                        username_cache[user_id] = username
-                    else:
-                        usernames[user_id] = 'Anonymous'
-                except Exception:
-                    usernames[user_id] = 'Anonymous'
+        profiles = await resolve_user_profiles(user_ids)
+        usernames = {user_id: profile['username'] for user_id, profile in profiles.items()}
         
         return {"success": True, "usernames": usernames}
     except Exception as e:
@@ -904,6 +4336,93 @@ async def get_current_usernames(user_ids: list[str]) -> Dict[str, Any]:
         return {"success": False, "error": str(e)}
     
 
+async def set_profile_photo(users_table, user_id: str, s3_url: str, old_url: str) -> None:
+    """
+    Point a user's profile at a new photo and queue the old photo for deletion from S3.
+
+    Args:
+        users_table: The users Table resource.
+        user_id: The Cognito user id of the user.
+        s3_url: The S3 url of the new photo.
+        old_url: The S3 url of the previous photo (empty if none).
+    """
+
+    # Update the user's profile photo URL in the users table
+    response = await run_io(
+        users_table.update_item,
+        Key={'userId': user_id},
+        UpdateExpression='SET profilePhoto = :photo_url',
+        ExpressionAttributeValues={
+            ':photo_url': s3_url
+        },
+        ReturnValues="ALL_NEW"
+    )
+
+    # Delete the old photo from S3 in the background
+    if old_url and old_url != s3_url and S3_BUCKET_NAME in old_url:
+        s3_cleanup.enqueue(old_url)
+    
+    # Write the updated profile through to the cache and the feed snapshot
+    profile = profile_from_item(response.get('Attributes', {}))
+    await run_io(profile_cache.set, user_id, profile)
+    feed_snapshot.update_profile(user_id, profile)
+
+    # The feed shows current profile photos
+    version_bumper.mark(feed=True)
+
+
+@app.post("/create-upload-url")
+async def create_upload_url(upload: UploadUrlRequest) -> Dict[str, Any]:
+    """
+    Create a presigned POST so the client can upload an image straight to S3. The upload is limited to the
+    returned key, the requested content type and MAX_DIRECT_UPLOAD_BYTES. The image is recorded afterwards by
+    passing the returned "imageUrl" to /save-car/ or /finalize-profile-photo/{user_id}. Saved car images are then
+    processed in the background like server-side uploads.
+
+    Args:
+        upload (UploadUrlRequest): The uploader, the kind of image ("car" or "profile"), its content type, and
+            optionally its hex hash (a random name is used otherwise).
+
+    Returns:
+        A JSON object with the presigned POST url and form fields with the key "upload" and the image's eventual S3 url with the key "imageUrl" if "success" is True.
+    """
+
+    if upload.kind not in ('car', 'profile'):
+        raise HTTPException(status_code=400, detail="Invalid upload kind. Please use \"car\" or \"profile\".")
+    if upload.content_type not in DIRECT_UPLOAD_CONTENT_TYPES:
+        raise HTTPException(status_code=400, detail="Unsupported image type. Please upload a JPEG, PNG or WebP image.")
+    if not upload.user_id or '/' in upload.user_id:
+        raise HTTPException(status_code=400, detail="Invalid user id.")
+
+    image_hash = (upload.image_hash or secrets.token_hex(16)).lower()
+    if not IMAGE_HASH_PATTERN.match(image_hash):
+        raise HTTPException(status_code=400, detail="Invalid image hash.")
+
+    try:
+        # Scope the upload to the user's prefix, keyed by its content type. Car uploads are marked as unprocessed
+        # (the post is switched to the processed image once saved)
+        name = f"profile_{image_hash}" if upload.kind == 'profile' else f"{DIRECT_UPLOAD_PREFIX}{image_hash}"
+        s3_key = f"{upload.user_id}/{name}.{DIRECT_UPLOAD_CONTENT_TYPES[upload.content_type]}"
+
+        # Presigning is local (no request to S3)
+        presigned = get_s3_client().generate_presigned_post(
+            Bucket=S3_BUCKET_NAME,
+            Key=s3_key,
+            Fields={'acl': 'public-read', 'Content-Type': upload.content_type},
+            Conditions=[
+                {'acl': 'public-read'},
+                {'Content-Type': upload.content_type},
+                ['content-length-range', 1, MAX_DIRECT_UPLOAD_BYTES]
+            ],
+            ExpiresIn=PRESIGNED_UPLOAD_TTL
+        )
+
+        return {"success": True, "upload": presigned, "imageUrl": s3_url_for_key(s3_key), "expiresIn": PRESIGNED_UPLOAD_TTL}
+    except Exception as e:
+        print(f"Error creating upload url: {str(e)}")
+        return {"success": False, "error": str(e)}
+
+
 @app.post("/upload-profile-photo/{user_id}")
 async def upload_profile_photo(user_id: str, file: UploadFile = File(...)) -> Dict[str, Any]:
     """
@@ -914,61 +4433,86 @@ async def upload_profile_photo(user_id: str, file: UploadFile = File(...)) -> Di
         file (UploadFile): The image file to upload.
 
     Returns:
-        A JSON object indicating whether the upload was successful with the key "success" and the new photo URL with the key "photo_url" if "success" is True.
+        A JSON object indicating whether the upload was successful with the key "success", and the new photo URL with the key "photo_url" and the srcset strings of its derivatives by content type with the key "photo_srcset" if "success" is True.
     """
 
     try:
-        # Get connections from pool
-        dynamodb = get_dynamodb()
-        users_table = dynamodb.Table(DYNAMODB_USERS_TABLE_NAME)
-        s3_client = get_s3_client()
+        # Get the shared table handle
+        users_table = get_table(DYNAMODB_USERS_TABLE_NAME)
         
-        # Retrieve the user's data from the users table
-        user_response = users_table.get_item(
-            Key={'userId': user_id},
-            ProjectionExpression="profilePhoto"
+        # Retrieve the user's data from the users table while the new image and its derivatives are processed
+        user_response, (image_data, variants, _) = await asyncio.gather(
+            run_io(
+                users_table.get_item,
+                Key={'userId': user_id},
+                ProjectionExpression="profilePhoto"
+            ),
+            image_pool.run(prepare_saved_image, await file.read())
         )
 
         # Check if user exists
         if 'Item' in user_response:
-            # Delete the old profile photo from S3 if it exists
-            old_url = user_response['Item'].get('profilePhoto', '')
-            if old_url and S3_BUCKET_NAME in old_url:
-                try:
-                    old_key = old_url.split(f"{S3_BUCKET_NAME}.s3.{aws_region}.amazonaws.com/")[1]
-                    s3_client.delete_object(
-                        Bucket=S3_BUCKET_NAME,
-                        Key=old_key
-                    )
-                except Exception as s3_error:
-                    print(f"Warning: Could not delete old S3 profile photo: {str(s3_error)}")
-                    # Continue with the upload process even if deletion fails
-
-            # Process and upload the new image to S3
-            _, image_data = process_image(file)
+            # Upload the new image and its derivatives to S3
             image_hash = generate_image_hash(image_data)
-            s3_url = await upload_to_s3(image_data, user_id, f"profile_{image_hash}")
+            s3_url, photo_variants = await upload_image_variants(user_id, f"profile_{image_hash}", variants)
 
-            # Update the user's profile photo URL in the users table
-            users_table.update_item(
-                Key={'userId': user_id},
-                UpdateExpression='SET profilePhoto = :photo_url',
-                ExpressionAttributeValues={
-                    ':photo_url': s3_url
-                }
-            )
-            
-            # Update cache
-            profile_photo_cache[user_id] = s3_url
+            await set_profile_photo(users_table, user_id, s3_url, user_response['Item'].get('profilePhoto', ''))
 
-            return {"success": True, "photo_url": s3_url}
+            return {"success": True, "photo_url": s3_url, "photo_srcset": image_srcset(s3_url, photo_variants)}
         else:
             return {"success": False, "error": "User not found"}
+    except HTTPException:
+        # Re-raise HTTP exceptions
+        raise
     except Exception as e:
         print(f"Error uploading profile photo: {str(e)}")
         return {"success": False, "error": str(e)}
 
 
+@app.post("/finalize-profile-photo/{user_id}")
+async def finalize_profile_photo(user_id: str, upload: ProfilePhotoUpload) -> Dict[str, Any]:
+    """
+    Record a profile photo uploaded directly to S3 with a url from /create-upload-url.
+
+    Args:
+        user_id (str): The Cognito user id of the uploader.
+        upload (ProfilePhotoUpload): The S3 url of the uploaded photo.
+
+    Returns:
+        A JSON object indicating whether the update was successful with the key "success" and the new photo URL with the key "photo_url" if "success" is True.
+    """
+
+    try:
+        # Get the shared table handle
+        users_table = get_table(DYNAMODB_USERS_TABLE_NAME)
+
+        # Check the uploaded photo while retrieving the user's data
+        user_response, _ = await asyncio.gather(
+            run_io(
+                users_table.get_item,
+                Key={'userId': user_id},
+                ProjectionExpression="profilePhoto"
+            ),
+            verify_direct_upload(upload.photo_url, f"{user_id}/profile_")
+        )
+
+        # Check if user exists
+        if 'Item' in user_response:
+            await set_profile_photo(users_table, user_id, upload.photo_url, user_response['Item'].get('profilePhoto', ''))
+
+            return {"success": True, "photo_url": upload.photo_url}
+        else:
+            # Nothing references the upload, so remove it
+            s3_cleanup.enqueue(upload.photo_url)
+            return {"success": False, "error": "User not found"}
+    except HTTPException:
+        # Re-raise HTTP exceptions
+        raise
+    except Exception as e:
+        print(f"Error finalizing profile photo: {str(e)}")
+        return {"success": False, "error": str(e)}
+
+
 @app.post("/get-profile-photos")
 async def get_profile_photos(user_ids: List[str]) -> Dict[str, Any]:
     """
@@ -982,36 +4526,9 @@ async def get_profile_photos(user_ids: List[str]) -> Dict[str, Any]:
     """
 
     try:
-        # Get connection from pool
-        dynamodb = get_dynamodb()
-        users_table = dynamodb.Table(DYNAMODB_USERS_TABLE_NAME)
-        
         # Get current profile photo for each Cognito user id from users table
-        photos = {}
-        
-        for user_id in user_ids:
-            # Check cache first
-            if user_id in profile_photo_cache:
-                photos[user_id] = profile_photo_cache[user_id]
-            else:
-                try:
-                    response = users_table.get_item(
-                        Key={'userId': user_id},
-                        ProjectionExpression="profilePhoto"
-                    )
-                    
-                    # Get the profile photo from the user item
-                    if 'Item' in response:
-                        photo_url = response['Item'].get('profilePhoto', '')
-                        photos[user_id] = photo_url
-                        # Cache for future requests
-                        profile_photo_cache[user_id] = photo_url
-                    else:
-                        photos[user_id] = ''
-                        profile_photo_cache[user_id] = ''
-                except Exception as e:
-                    print(f"Warning: Could not get profile photo for user {user_id}: {str(e)}")
-                    photos[user_id] = ''
+        profiles = await resolve_user_profiles(user_ids)
+        photos = {user_id: profile['profilePhoto'] for user_id, profile in profiles.items()}
             
         return {"success": True, "photos": photos}
     except Exception as e:
@@ -1032,13 +4549,12 @@ async def remove_profile_photo(user_id: str) -> Dict[str, Any]:
     """
 
     try:
-        # Get connections from pool
-        dynamodb = get_dynamodb()
-        users_table = dynamodb.Table(DYNAMODB_USERS_TABLE_NAME)
-        s3_client = get_s3_client()
+        # Get the shared table handle
+        users_table = get_table(DYNAMODB_USERS_TABLE_NAME)
         
         # Retrieve the user's data from the users table
-        user_response = users_table.get_item(
+        user_response = await run_io(
+            users_table.get_item,
             Key={'userId': user_id},
             ProjectionExpression="profilePhoto"
         )
@@ -1048,29 +4564,27 @@ async def remove_profile_photo(user_id: str) -> Dict[str, Any]:
             # Delete the profile photo from S3 if it exists
             old_url = user_response['Item'].get('profilePhoto', '')
             if old_url and S3_BUCKET_NAME in old_url:
-                try:
-                    old_key = old_url.split(f"{S3_BUCKET_NAME}.s3.{aws_region}.amazonaws.com/")[1]
-
-                    # Remove from S3
-                    s3_client.delete_object(
-                        Bucket=S3_BUCKET_NAME,
-                        Key=old_key
-                    )
-                except Exception as s3_error:
-                    print(f"Warning: Could not delete S3 profile photo: {str(s3_error)}")
-                    # Continue with the process even if S3 deletion fails
-
                 # Update the user's profile photo URL in the users table to empty string
-                users_table.update_item(
+                response = await run_io(
+                    users_table.update_item,
                     Key={'userId': user_id},
                     UpdateExpression='SET profilePhoto = :photo_url',
                     ExpressionAttributeValues={
                         ':photo_url': ''
-                    }
+                    },
+                    ReturnValues="ALL_NEW"
                 )
+
+                # Remove the photo from S3 in the background
+                s3_cleanup.enqueue(old_url)
                 
-                # Update cache
-                profile_photo_cache[user_id] = ''
+                # Write the updated profile through to the cache and the feed snapshot
+                profile = profile_from_item(response.get('Attributes', {}))
+                await run_io(profile_cache.set, user_id, profile)
+                feed_snapshot.update_profile(user_id, profile)
+
+                # The feed shows current profile photos
+                version_bumper.mark(feed=True)
 
             return {"success": True}
         else:
@@ -1080,6 +4594,35 @@ async def remove_profile_photo(user_id: str) -> Dict[str, Any]:
         return {"success": False, "error": str(e)}
 
 
+@app.get("/metrics")
+async def get_metrics() -> Dict[str, Any]:
+    """
+    Get the in-process cache counters for this worker.
+
+    Args:
+        None.
+
+    Returns:
+        A JSON object containing the counters of the profile cache with the key "profileCache", the prediction cache with the key "predictionCache", the near-duplicate indexes with the key "nearDuplicateIndex", the image worker pool with the key "imagePool", the like buffer with the key "likeBuffer", the model call scheduler with the key "modelScheduler", the S3 cleanup queue with the key "s3Cleanup", the feed snapshot with the key "feedSnapshot" and the ETag counter bumps with the key "versionBumper".
+    """
+
+    return {
+        "success": True,
+        "profileCache": profile_cache.stats(),
+        "predictionCache": prediction_cache.stats(),
+        "nearDuplicateIndex": {
+            "predictions": prediction_index.stats(),
+            "images": image_index.stats()
+        },
+        "imagePool": image_pool.stats(),
+        "likeBuffer": like_buffer.stats(),
+        "modelScheduler": model_scheduler.stats(),
+        "s3Cleanup": s3_cleanup.stats(),
+        "feedSnapshot": feed_snapshot.stats(),
+        "versionBumper": version_bumper.stats()
+    }
+
+
 @app.post("/send-contact-email/")
 async def send_contact_email(contact_data: ContactForm) -> Dict[str, Any]:
     """
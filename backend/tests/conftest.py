@@ -0,0 +1,75 @@
+"""
+Test setup: main is imported against moto's in-memory AWS, with fresh DynamoDB tables for every test.
+
+Usage (from the backend directory):
+    pip install -r requirements-dev.txt
+    python -m pytest -q
+"""
+
+import os
+import sys
+
+# main reads its configuration at import time
+os.environ.update({
+    'AWS_REGION': 'us-east-1',
+    'AWS_ACCESS_KEY_ID': 'testing',
+    'AWS_SECRET_ACCESS_KEY': 'testing',
+    'S3_BUCKET_NAME': 'test-bucket',
+    'DYNAMODB_TABLE_NAME': 'cars',
+    'DYNAMODB_USERS_TABLE_NAME': 'users',
+    'DYNAMODB_USERNAMES_TABLE_NAME': 'usernames',
+    'GOOGLE_API_KEY': 'testing',
+    'CACHE_BACKEND': 'memory',
+    'IMAGE_WORKER_MODE': 'thread'
+})
+
+from moto import mock_aws
+import pytest
+
+# Started before main is imported, so its AWS clients talk to moto
+_mock_aws = mock_aws()
+_mock_aws.start()
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import main
+
+
+@pytest.fixture
+def tables():
+    """Create the cars table (with the feed index) and the users table, and delete them after the test"""
+
+    dynamodb = main.get_dynamodb()
+    cars = dynamodb.create_table(
+        TableName=main.DYNAMODB_TABLE_NAME,
+        KeySchema=[
+            {'AttributeName': 'userId', 'KeyType': 'HASH'},
+            {'AttributeName': 'savedAt', 'KeyType': 'RANGE'}
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'userId', 'AttributeType': 'S'},
+            {'AttributeName': 'savedAt', 'AttributeType': 'S'},
+            {'AttributeName': 'feedShard', 'AttributeType': 'S'}
+        ],
+        GlobalSecondaryIndexes=[{
+            'IndexName': main.DYNAMODB_FEED_INDEX_NAME,
+            'KeySchema': [
+                {'AttributeName': 'feedShard', 'KeyType': 'HASH'},
+                {'AttributeName': 'savedAt', 'KeyType': 'RANGE'}
+            ],
+            'Projection': {'ProjectionType': 'INCLUDE', 'NonKeyAttributes': main.FEED_INDEX_ATTRIBUTES}
+        }],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    users = dynamodb.create_table(
+        TableName=main.DYNAMODB_USERS_TABLE_NAME,
+        KeySchema=[{'AttributeName': 'userId', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'userId', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+
+    yield {'cars': cars, 'users': users}
+
+    cars.delete()
+    users.delete()
+    main.profile_cache.backend.clear()
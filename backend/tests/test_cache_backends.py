@@ -0,0 +1,105 @@
+import asyncio
+import time
+
+import fakeredis
+import pytest
+
+import main
+
+
+def wait_for(condition, timeout=5.0):
+    """Poll until condition() is true (the invalidation listener runs in a background thread)"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def tiered_backend(server):
+    return main.TieredCacheBackend(
+        local=main.InProcessCacheBackend(maxsize=100),
+        shared=main.RedisCacheBackend(fakeredis.FakeRedis(server=server)),
+        local_ttl=60
+    )
+
+
+@pytest.fixture
+def workers():
+    """Two workers' tiered caches sharing one Redis server, listening for invalidations"""
+    server = fakeredis.FakeServer()
+    backends = [tiered_backend(server), tiered_backend(server)]
+    for backend in backends:
+        backend.start()
+    assert wait_for(lambda: all(backend.stats()['listening'] for backend in backends))
+
+    yield backends
+
+    for backend in backends:
+        backend.close()
+
+
+def test_set_invalidates_other_workers_local_copies(workers):
+    first, second = workers
+
+    first.set('profile:u1', {'username': 'old'}, 300)
+    assert wait_for(lambda: second.stats()['invalidationsReceived'] == 1)
+    assert second.get('profile:u1') == {'username': 'old'}
+    # The second worker now serves its local copy
+    assert second.local.get('profile:u1') == {'username': 'old'}
+
+    first.set('profile:u1', {'username': 'new'}, 300)
+    assert wait_for(lambda: second.local.get('profile:u1') is main.CACHE_MISS)
+    assert second.get('profile:u1') == {'username': 'new'}
+    assert second.stats()['invalidationsReceived'] == 2
+    # Workers ignore their own broadcasts
+    assert first.stats()['invalidationsReceived'] == 0
+
+
+def test_delete_invalidates_other_workers_local_copies(workers):
+    first, second = workers
+
+    first.set('profile:u1', None, 60)
+    assert second.get('profile:u1') is None
+
+    first.delete('profile:u1')
+    assert wait_for(lambda: second.local.get('profile:u1') is main.CACHE_MISS)
+    assert second.get('profile:u1') is main.CACHE_MISS
+
+
+def test_lost_subscription_clears_local_tier(workers):
+    _, second = workers
+    second.local.set('profile:u1', {'username': 'stale'}, 60)
+
+    second._on_listener_error(ConnectionError('connection lost'), None, None)
+
+    assert second.local.get('profile:u1') is main.CACHE_MISS
+    assert second.stats()['listenerErrors'] == 1
+
+
+def test_unreachable_shared_cache_is_a_miss():
+    server = fakeredis.FakeServer()
+    backend = main.RedisCacheBackend(fakeredis.FakeRedis(server=server))
+    backend.set('profile:u1', {'username': 'name'}, 60)
+
+    server.connected = False
+    assert backend.get('profile:u1') is main.CACHE_MISS
+    backend.set('profile:u1', {'username': 'other'}, 60)
+    assert backend.stats()['errors'] == 2
+
+
+def test_upload_tokens_are_shared_and_single_use():
+    server = fakeredis.FakeServer()
+    issuer, redeemer = (
+        main.UploadTokenStore(max_bytes=1024, ttl=60, shared=main.RedisCacheBackend(fakeredis.FakeRedis(server=server)))
+        for _ in range(2)
+    )
+
+    async def scenario():
+        token = await issuer.put(b'\xff\xd8image')
+        assert await redeemer.pop(token) == b'\xff\xd8image'
+        assert await issuer.pop(token) is None
+        assert await issuer.put(b'x' * 1025) is None
+
+    asyncio.run(scenario())
@@ -0,0 +1,138 @@
+import asyncio
+
+import pytest
+
+import main
+
+
+def car_item(user_id, saved_at, public=True, **attributes):
+    item = {'userId': user_id, 'savedAt': saved_at, 'make': 'Mazda', 'model': 'MX-5', 'year': '1990',
+            'imageUrl': f"https://test-bucket.s3.amazonaws.com/{user_id}/{saved_at}.jpg", 'likes': 0, **attributes}
+    if public:
+        item['feedShard'] = main.feed_shard(user_id, saved_at)
+    return item
+
+
+@pytest.fixture
+def feed(tables):
+    """Nine public posts (two saved at the same time) and a private one, keyed newest first"""
+    items = [car_item(f"user{index % 3}", f"2025-01-0{index}T00:00:00.000Z") for index in range(1, 8)]
+    items.append(car_item('user9', '2025-01-07T00:00:00.000Z', likes=1, likedBy={'viewer'}))
+    items.append(car_item('user8', '2025-01-08T00:00:00.000Z'))
+    items.append(car_item('user0', '2025-01-09T00:00:00.000Z', public=False))
+    for item in items:
+        tables['cars'].put_item(Item=item)
+    return sorted(((item['savedAt'], item['userId']) for item in items if 'feedShard' in item), reverse=True)
+
+
+def page_keys(cars):
+    return [(car['savedAt'], car['userId']) for car in cars]
+
+
+def read_all_pages(snapshot, limit, viewer_id=None):
+    keys, cursor = [], None
+    while True:
+        cars, cursor = snapshot.page(limit, cursor, viewer_id)
+        keys.extend(page_keys(cars))
+        if cursor is None:
+            return keys
+
+
+def test_pages_follow_feed_order(feed):
+    snapshot = main.FeedSnapshot(ttl=60, max_posts=100)
+
+    async def scenario():
+        assert await snapshot.ready()
+        for limit in (1, 2, 4, 100):
+            assert read_all_pages(snapshot, limit) == feed
+
+        # Cursors are interchangeable with the DynamoDB query's
+        _, cursor = snapshot.page(4, None, None)
+        items, query_cursor = await main.query_feed(4, None, with_likers=False)
+        assert cursor == query_cursor
+        cars, _ = snapshot.page(4, cursor, None)
+        items, _ = await main.query_feed(4, cursor, with_likers=False)
+        assert page_keys(cars) == [(item['savedAt'], item['userId']) for item in items]
+
+    asyncio.run(scenario())
+
+
+def test_pages_flag_viewer_likes(feed):
+    snapshot = main.FeedSnapshot(ttl=60, max_posts=100)
+
+    async def scenario():
+        await snapshot.ready()
+        cars, _ = snapshot.page(None, None, 'viewer')
+        return {(car['savedAt'], car['userId']): car for car in cars}
+
+    cars = asyncio.run(scenario())
+    liked = cars[('2025-01-07T00:00:00.000Z', 'user9')]
+    assert liked['likes'] == 1 and liked['likedByViewer']
+    assert not any(car['likedByViewer'] for key, car in cars.items() if key[1] != 'user9')
+    assert 'likedBy' not in liked
+
+
+def test_truncated_snapshot_falls_back_past_its_end(feed):
+    snapshot = main.FeedSnapshot(ttl=60, max_posts=4)
+
+    async def scenario():
+        await snapshot.ready()
+
+        cars, cursor = snapshot.page(3, None, None)
+        assert page_keys(cars) == feed[:3]
+        # Older posts are only in DynamoDB
+        assert snapshot.page(3, cursor, None) is None
+        assert snapshot.page(4, None, None) is None
+        assert snapshot.page(None, None, None) is None
+        assert snapshot.stats()['fallbacks'] == 3
+
+    asyncio.run(scenario())
+
+
+def test_patches_update_pages(feed):
+    snapshot = main.FeedSnapshot(ttl=60, max_posts=100)
+
+    async def scenario():
+        await snapshot.ready()
+        revision = snapshot.revision
+
+        newest = car_item('user5', '2025-02-01T00:00:00.000Z')
+        snapshot.put(newest, {'username': 'five', 'profilePhoto': ''})
+        assert snapshot.revision != revision
+        cars, _ = snapshot.page(1, None, 'viewer')
+        assert page_keys(cars) == [('2025-02-01T00:00:00.000Z', 'user5')]
+        assert cars[0]['username'] == 'five'
+
+        snapshot.like('user5', '2025-02-01T00:00:00.000Z', 'viewer', True, 1)
+        cars, _ = snapshot.page(1, None, 'viewer')
+        assert cars[0]['likes'] == 1 and cars[0]['likedByViewer']
+
+        snapshot.update_profile('user5', {'username': 'renamed', 'profilePhoto': 'photo.jpg'})
+        cars, _ = snapshot.page(1, None, None)
+        assert (cars[0]['username'], cars[0]['profilePicture']) == ('renamed', 'photo.jpg')
+
+        # Making a post private removes it, as does deleting it
+        snapshot.put(car_item('user5', '2025-02-01T00:00:00.000Z', public=False), {})
+        snapshot.remove(*reversed(feed[0]))
+        assert read_all_pages(snapshot, 3) == feed[1:]
+
+    asyncio.run(scenario())
+
+
+def test_patches_during_refresh_are_replayed(feed):
+    snapshot = main.FeedSnapshot(ttl=60, max_posts=100)
+
+    async def scenario():
+        await snapshot.ready()
+
+        refresh = snapshot._start_refresh()
+        # Let the refresh start reading the feed, then patch the snapshot being replaced
+        await asyncio.sleep(0)
+        snapshot.put(car_item('user5', '2025-02-01T00:00:00.000Z'), {})
+        snapshot.remove(*reversed(feed[0]))
+        await refresh
+
+        assert snapshot.stats()['refreshes'] == 2
+        assert read_all_pages(snapshot, 4) == [('2025-02-01T00:00:00.000Z', 'user5'), *feed[1:]]
+
+    asyncio.run(scenario())
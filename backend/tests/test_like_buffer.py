@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+
+import main
+
+
+def like_buffer():
+    # Flushed explicitly by the tests
+    return main.LikeBuffer(enabled=False, interval=60, max_pending=100, count_ttl=60)
+
+
+def stored_likes(tables, poster_id='poster', saved_at='2025-01-01T00:00:00.000Z'):
+    item = tables['cars'].get_item(Key={'userId': poster_id, 'savedAt': saved_at}, ConsistentRead=True)['Item']
+    return int(item.get('likes', 0)), set(item.get('likedBy') or ())
+
+
+@pytest.fixture
+def post(tables):
+    tables['cars'].put_item(Item={'userId': 'poster', 'savedAt': '2025-01-01T00:00:00.000Z', 'make': 'Mazda', 'likes': 0})
+    return ('poster', '2025-01-01T00:00:00.000Z')
+
+
+def test_flush_writes_buffered_likes(tables, post):
+    buffer = like_buffer()
+
+    async def scenario():
+        counts = [(await buffer.record(*post, liker_id, like))['likes']
+                  for liker_id, like in [('a', True), ('b', True), ('c', True), ('b', False)]]
+        assert counts == [1, 2, 3, 2]
+        # The unlike cancelled the buffered like instead of adding an intent
+        assert buffer.stats()['pendingIntents'] == 2
+        assert stored_likes(tables) == (0, set())
+
+        await buffer.flush()
+
+    asyncio.run(scenario())
+
+    assert stored_likes(tables) == (2, {'a', 'c'})
+    assert buffer.stats()['pendingIntents'] == 0
+
+
+def test_repeated_like_is_rejected(tables, post):
+    buffer = like_buffer()
+
+    async def scenario():
+        assert (await buffer.record(*post, 'a', True))['success']
+        assert await buffer.record(*post, 'a', True) == {"success": False, "error": "User has already liked this post"}
+        await buffer.flush()
+        assert await buffer.record(*post, 'a', True) == {"success": False, "error": "User has already liked this post"}
+        assert await buffer.record(*post, 'b', False) == {"success": False, "error": "User has not liked this post"}
+
+    asyncio.run(scenario())
+
+    assert stored_likes(tables) == (1, {'a'})
+
+
+def test_counts_stay_exact_across_workers(tables, post):
+    first, second = like_buffer(), like_buffer()
+
+    async def scenario():
+        # Both workers read the post before either writes
+        assert (await first.record(*post, 'a', True))['success']
+        assert (await second.record(*post, 'b', True))['success']
+
+        # The same like on both workers is only counted once
+        assert (await first.record(*post, 'c', True))['success']
+        assert (await second.record(*post, 'c', True))['success']
+        await first.flush()
+        await second.flush()
+        assert stored_likes(tables) == (3, {'a', 'b', 'c'})
+
+        # The second worker's cached likers miss "a", so the unlike is confirmed against the table
+        assert (await second.record(*post, 'a', False))['success']
+        await second.flush()
+
+    asyncio.run(scenario())
+
+    assert stored_likes(tables) == (2, {'b', 'c'})
+
+
+def test_failed_flush_is_retried(tables, post, monkeypatch):
+    buffer = like_buffer()
+    update_set = buffer._update_set
+    failures = []
+
+    async def failing_update_set(*args, **kwargs):
+        if not failures:
+            failures.append(True)
+            raise RuntimeError('throttled')
+        return await update_set(*args, **kwargs)
+
+    monkeypatch.setattr(buffer, '_update_set', failing_update_set)
+
+    async def scenario():
+        await buffer.record(*post, 'a', True)
+        await buffer.flush()
+        assert buffer.stats()['failures'] == 1
+        assert stored_likes(tables) == (0, set())
+
+        await buffer.record(*post, 'b', True)
+        await buffer.flush()
+
+    asyncio.run(scenario())
+
+    assert stored_likes(tables) == (2, {'a', 'b'})
+
+
+def test_buffered_likes_of_deleted_post_are_dropped(tables, post):
+    buffer = like_buffer()
+
+    async def scenario():
+        await buffer.record(*post, 'a', True)
+        tables['cars'].delete_item(Key={'userId': post[0], 'savedAt': post[1]})
+        await buffer.flush()
+
+    asyncio.run(scenario())
+
+    # The flush must not recreate the deleted post
+    assert 'Item' not in tables['cars'].get_item(Key={'userId': post[0], 'savedAt': post[1]})
+    assert buffer.stats()['pendingPosts'] == 0
@@ -0,0 +1,107 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from fastapi import HTTPException
+from google.api_core import exceptions as google_exceptions
+
+import main
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = main.ModelCallScheduler(max_in_flight=1, max_queue=1, max_queue_wait=5, timeout=0.3, max_retries=2)
+    yield scheduler
+    scheduler.shutdown()
+
+
+class BlockingCall:
+    """A model call that blocks until released, recording the timeouts it was given"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.timeouts = []
+
+    def __call__(self, prompt, request_options):
+        self.timeouts.append(request_options['timeout'])
+        self.release.wait(5)
+        return f"answer to {prompt}"
+
+
+def test_call_gets_time_left_as_timeout(scheduler):
+    call = BlockingCall()
+    call.release.set()
+
+    assert asyncio.run(scheduler.call(call, 'prompt')) == 'answer to prompt'
+    assert 0 < call.timeouts[0] <= 0.3
+    assert scheduler.stats()['inFlight'] == 0
+
+
+def test_timed_out_call_keeps_slot_until_thread_returns(scheduler):
+    call = BlockingCall()
+
+    async def scenario():
+        start = time.monotonic()
+        with pytest.raises(asyncio.TimeoutError):
+            await scheduler.call(call, 'slow')
+        assert time.monotonic() - start < 1
+
+        # The thread is still running, so the slot stays taken
+        assert scheduler.stats()['inFlight'] == 1
+        assert scheduler.stats()['timeouts'] == 1
+        assert scheduler.avg_latency > 0
+
+        call.release.set()
+        for _ in range(100):
+            if scheduler.stats()['inFlight'] == 0:
+                break
+            await asyncio.sleep(0.01)
+        assert scheduler.stats()['inFlight'] == 0
+
+        # The freed slot takes the next call
+        assert await scheduler.call(call, 'next') == 'answer to next'
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_is_rejected(scheduler):
+    call = BlockingCall()
+
+    async def scenario():
+        running = asyncio.create_task(scheduler.call(call, 'first'))
+        queued = asyncio.create_task(scheduler.call(call, 'second'))
+        await asyncio.sleep(0.05)
+
+        with pytest.raises(HTTPException) as rejected:
+            await scheduler.call(call, 'third')
+        assert rejected.value.status_code == 503
+        assert 'Retry-After' in rejected.value.headers
+
+        call.release.set()
+        assert await running == 'answer to first'
+        assert await queued == 'answer to second'
+
+    asyncio.run(scenario())
+
+    assert scheduler.stats()['rejected'] == 1
+    assert scheduler.stats()['inFlight'] == 0
+
+
+def test_rate_limited_call_is_retried(scheduler, monkeypatch):
+    # No backoff delay
+    monkeypatch.setattr(main.random, 'uniform', lambda low, high: 0)
+    attempts = []
+
+    def call(prompt, request_options):
+        attempts.append(request_options['timeout'])
+        if len(attempts) == 1:
+            raise google_exceptions.TooManyRequests('quota exhausted')
+        return 'answer'
+
+    assert asyncio.run(scheduler.call(call, 'prompt')) == 'answer'
+    assert len(attempts) == 2
+    # The retry gets what is left of the same deadline
+    assert attempts[1] <= attempts[0]
+    assert scheduler.stats()['retries'] == 1
+    assert scheduler.stats()['inFlight'] == 0
@@ -24,6 +24,7 @@ const HomeContent = () => {
   const [displayImage, setDisplayImage] = useState<boolean>(false);
   const [fadeKey, setFadeKey] = useState<number>(0);
   const [car, setCar] = useState<Car>({make: "n/a", model: "n/a", year: "n/a", rarity: "n/a", link: "n/a"});
+  const [uploadToken, setUploadToken] = useState<string>("");
   const [loading, setLoading] = useState<boolean>(false);
   const [imageTransitioning, setImageTransitioning] = useState<boolean>(false);
   const [isSaving, setIsSaving] = useState<boolean>(false);
@@ -162,6 +163,7 @@ const HomeContent = () => {
 
     try {
       setIsSaved(false);
+      setUploadToken("");
       setImage(objectUrl);
       setDisplayImage(true);
       setFadeKey(fadeKey + 1);
@@ -169,16 +171,46 @@ const HomeContent = () => {
       // Scroll to the image with header adjustment (center image in non-header space)
       scrollToElementWithHeaderAdjustment(imageRef, 100);
 
-      const backendUrl = `${process.env.NEXT_PUBLIC_API_URL}/predict/`;
-      const response = await axios.post(backendUrl, formData, {
-        headers: { "Content-Type": "multipart/form-data" },
-      });
+      const backendUrl = `${process.env.NEXT_PUBLIC_API_URL}/predict-stream/`;
+      const response = await fetch(backendUrl, { method: "POST", body: formData });
+      if (!response.ok || !response.body) {
+        throw new Error(`Prediction failed with status ${response.status}`);
+      }
 
-      if (response.data.success) {
+      // Read the server-sent events, showing each field of the car as soon as it arrives
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      let result: { success: boolean; car?: Car; uploadToken?: string; error?: string } | null = null;
+      while (!result) {
+        const { done, value } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split("\n\n");
+        buffer = events.pop() || "";
+        for (const rawEvent of events) {
+          const lines = rawEvent.split("\n");
+          const event = lines.find(line => line.startsWith("event: "))?.slice(7);
+          const data = JSON.parse(lines.find(line => line.startsWith("data: "))?.slice(6) || "{}");
+          if (event === "progress" && data.stage === "identifying") {
+            // Clear the previous car before the new fields arrive
+            setCar({make: "n/a", model: "n/a", year: "n/a", rarity: "n/a", link: "n/a"});
+          } else if (event === "field") {
+            setCar(prevCar => ({...prevCar, [data.field]: data.value}));
+          } else if (event === "result" || event === "error") {
+            result = data;
+          }
+        }
+      }
+
+      if (result?.success && result.car) {
         // Update car info
-        const { make, model, year, rarity, link } = response.data.car;
+        const { make, model, year, rarity, link } = result.car;
         setCar({make: make, model: model, year: year, rarity: rarity, link: link});
+        setUploadToken(result.uploadToken || "");
       } else {
+        console.error("Prediction failed:", result?.error);
         return;
       }
       
@@ -322,7 +354,6 @@ const HomeContent = () => {
       }
       
       const userId = user.userId;
-      let imageUrl = image;
       
       // Get the user's username
       let username = '';
@@ -334,25 +365,6 @@ const HomeContent = () => {
         username = user.username || 'Anonymous';
       }
       
-      // If we have a blob URL from an uploaded image, we need to convert it to a data URL
-      if (image.startsWith('blob:')) {
-        try {
-          const response = await fetch(image);
-          const blob = await response.blob();
-          
-          const reader = new FileReader();
-          imageUrl = await new Promise<string>((resolve) => {
-            reader.onloadend = () => resolve(reader.result as string);
-            reader.readAsDataURL(blob);
-          });
-        } catch (err) {
-          console.error("Failed to convert blob URL to data URL:", err);
-          alert("Failed to process the image. Please try again.");
-          setIsSaving(false);
-          return;
-        }
-      }
-      
       // Prepare data to save - include privacy setting and description
       const carData = {
         userId,
@@ -363,17 +375,47 @@ const HomeContent = () => {
           year: car.year,
           link: car.link,
         },
-        imageUrl: imageUrl,
         savedAt: new Date().toISOString(),
         isPrivate: carPrivacy,
         description: carDescription.trim() || undefined
       };
       
-      // Call backend API to save to DynamoDB and S3
-      const backendUrl = `${process.env.NEXT_PUBLIC_API_URL}/save-car/`;
-      const response = await axios.post(backendUrl, carData, {
-        headers: { 'Content-Type': 'application/json' },
-      });
+      let response;
+      if (image.startsWith('blob:')) {
+        // Send the image as a file (or the upload token from the prediction) instead of a data URL
+        const backendUrl = `${process.env.NEXT_PUBLIC_API_URL}/save-car-upload/`;
+        const sendUpload = async (token: string) => {
+          const formData = new FormData();
+          formData.append("car_data", JSON.stringify(carData));
+          if (token) {
+            formData.append("upload_token", token);
+          } else {
+            const blob = await (await fetch(image)).blob();
+            formData.append("image", blob, "image.jpg");
+          }
+          return axios.post(backendUrl, formData, {
+            headers: { "Content-Type": "multipart/form-data" },
+          });
+        };
+        
+        try {
+          response = await sendUpload(uploadToken);
+        } catch (err) {
+          // The token expired, so send the image itself
+          if (uploadToken && axios.isAxiosError(err) && err.response?.status === 410) {
+            response = await sendUpload("");
+          } else {
+            throw err;
+          }
+        }
+        setUploadToken("");
+      } else {
+        // Call backend API to save to DynamoDB and S3
+        const backendUrl = `${process.env.NEXT_PUBLIC_API_URL}/save-car/`;
+        response = await axios.post(backendUrl, { ...carData, imageUrl: image }, {
+          headers: { 'Content-Type': 'application/json' },
+        });
+      }
       
       if (response.data.success) {
         setIsSaved(true);
@@ -389,7 +431,7 @@ const HomeContent = () => {
       alert("An error occurred while saving the car. Please try again.");
       setIsSaving(false);
     }
-  }, [user, car, image, carPrivacy, carDescription]);
+  }, [user, car, image, uploadToken, carPrivacy, carDescription]);
 
   // Reset saved state when a new image is uploaded
   useEffect(() => {
@@ -9,6 +9,9 @@ import AuthModals from '@/app/components/AuthModals';
 // Sort options
 type SortOption = 'newest' | 'oldest' | 'mostLiked';
 
+// Posts fetched per page of the feed (more are fetched as the list is scrolled)
+const FEED_PAGE_SIZE = 24;
+
 // Car info
 type Car = {
   userId: string;
@@ -21,7 +24,7 @@ type Car = {
   };
   imageUrl: string;
   likes: number;
-  likedBy: string[];
+  likedByViewer?: boolean;
   username: string;
   profilePicture: string;
   description?: string;
@@ -204,6 +207,8 @@ const CarCard = ({ car, onLike, onUnlike, hasLiked = false, currentUsernames, pr
 const ExploreContent = () => {
   const [cars, setCars] = useState<Car[]>([]);
   const [loading, setLoading] = useState<boolean>(false);
+  const [loadingMore, setLoadingMore] = useState<boolean>(false);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const [isLoginOpen, setIsLoginOpen] = useState<boolean>(false);
   const [isSignupOpen, setIsSignupOpen] = useState<boolean>(false);
   const [sortOption, setSortOption] = useState<SortOption>('newest');
@@ -211,6 +216,7 @@ const ExploreContent = () => {
   const [currentUsernames, setCurrentUsernames] = useState<Record<string, string>>({});
   const [profilePhotos, setProfilePhotos] = useState<Record<string, string>>({});
   const dropdownRef = useRef<HTMLDivElement>(null);
+  const loadMoreRef = useRef<HTMLDivElement>(null);
   const { user, refreshAuthState } = useAuth();
 
   // Handle click outside to close dropdown
@@ -234,7 +240,7 @@ const ExploreContent = () => {
       const response = await axios.post(backendUrl, userIds);
       
       if (response.data.success) {
-        setCurrentUsernames(response.data.usernames);
+        setCurrentUsernames(prevUsernames => ({ ...prevUsernames, ...response.data.usernames }));
       } else {
         console.error("Failed to fetch current usernames:", response.data.error);
       }
@@ -250,7 +256,7 @@ const ExploreContent = () => {
       const response = await axios.post(backendUrl, userIds);
       
       if (response.data.success) {
-        setProfilePhotos(response.data.photos);
+        setProfilePhotos(prevPhotos => ({ ...prevPhotos, ...response.data.photos }));
       } else {
         console.error("Failed to fetch profile photos:", response.data.error);
       }
@@ -259,17 +265,27 @@ const ExploreContent = () => {
     }
   }, []);
 
-  // Fetch all car posts
-  const fetchAllCars = useCallback(async (): Promise<void> => {
-    setLoading(true);
+  // Fetch a page of car posts (with whether the viewer liked each one), the first page if cursor is null
+  const viewerId = user?.userId;
+  const fetchCars = useCallback(async (cursor: string | null): Promise<void> => {
+    if (cursor) {
+      setLoadingMore(true);
+    } else {
+      setLoading(true);
+    }
     try {
       const backendUrl = `${process.env.NEXT_PUBLIC_API_URL}/get-all-cars`;
-      const response = await axios.get(backendUrl);
+      const params: Record<string, string | number> = { limit: FEED_PAGE_SIZE };
+      if (cursor) params.cursor = cursor;
+      if (viewerId) params.viewer_id = viewerId;
+      const response = await axios.get(backendUrl, { params });
       
       if (response.data.success) {
-        setCars(response.data.cars);
-        // Fetch current usernames and profile photos for all cars
-        const userIds = response.data.cars.map((car: Car) => car.userId);
+        const pageCars: Car[] = response.data.cars;
+        setCars(prevCars => cursor ? [...prevCars, ...pageCars] : pageCars);
+        setNextCursor(response.data.nextCursor ?? null);
+        // Fetch current usernames and profile photos for the page's cars
+        const userIds = pageCars.map((car: Car) => car.userId);
         await Promise.all([
           fetchCurrentUsernames(userIds),
           fetchProfilePhotos(userIds)
@@ -280,9 +296,13 @@ const ExploreContent = () => {
     } catch (error) {
       console.error("Error fetching cars:", error);
     } finally {
-      setLoading(false);
+      if (cursor) {
+        setLoadingMore(false);
+      } else {
+        setLoading(false);
+      }
     }
-  }, [fetchCurrentUsernames, fetchProfilePhotos]);
+  }, [viewerId, fetchCurrentUsernames, fetchProfilePhotos]);
 
   // Like a car post
   const likeCar = async (userId: string, savedAt: string): Promise<void> => {
@@ -296,14 +316,14 @@ const ExploreContent = () => {
       const response = await axios.post(backendUrl);
       
       if (response.data.success) {
-        // Update the cars state with the new like count and likedBy list
+        // Update the cars state with the new like count and the viewer's like
         setCars(prevCars => 
           prevCars.map(car => 
             car.userId === userId && car.savedAt === savedAt 
               ? { 
                   ...car, 
                   likes: response.data.likes,
-                  likedBy: [...(car.likedBy || []), user.userId]
+                  likedByViewer: true
                 } 
               : car
           )
@@ -328,14 +348,14 @@ const ExploreContent = () => {
       const response = await axios.post(backendUrl);
       
       if (response.data.success) {
-        // Update the cars state with the new like count and likedBy list
+        // Update the cars state with the new like count and the viewer's like
         setCars(prevCars => 
           prevCars.map(car => 
             car.userId === userId && car.savedAt === savedAt 
               ? { 
                   ...car, 
                   likes: response.data.likes,
-                  likedBy: (car.likedBy || []).filter(id => id !== user.userId)
+                  likedByViewer: false
                 } 
               : car
           )
@@ -348,8 +368,20 @@ const ExploreContent = () => {
     }
   };
 
-  // Fetch cars on component mount
-  useEffect((): void => { fetchAllCars(); }, [fetchAllCars]);
+  // Fetch the first page on component mount
+  useEffect((): void => { fetchCars(null); }, [fetchCars]);
+
+  // Fetch the next page when the end of the list scrolls into view
+  useEffect(() => {
+    const sentinel = loadMoreRef.current;
+    if (!sentinel || !nextCursor || loadingMore) return;
+
+    const observer = new IntersectionObserver((entries) => {
+      if (entries[0].isIntersecting) fetchCars(nextCursor);
+    }, { rootMargin: '400px' });
+    observer.observe(sentinel);
+    return () => observer.disconnect();
+  }, [nextCursor, loadingMore, fetchCars]);
 
   // Auth modal handlers
   const handleCloseModals = (): void => { refreshAuthState(); setIsLoginOpen(false); setIsSignupOpen(false); };
@@ -364,7 +396,7 @@ const ExploreContent = () => {
     setDropdownOpen(false);
   };
 
-  // Sort types
+  // Sort types (over the pages loaded so far)
   const sortedCars = [...cars].sort((a, b) => {
     switch (sortOption) {
       case 'newest':
@@ -452,7 +484,7 @@ const ExploreContent = () => {
                 car={car} 
                 onLike={likeCar}
                 onUnlike={unlikeCar}
-                hasLiked={user ? (car.likedBy || []).includes(user.userId) : false}
+                hasLiked={user ? !!car.likedByViewer : false}
                 currentUsernames={currentUsernames}
                 profilePhotos={profilePhotos}
               />
@@ -471,6 +503,13 @@ const ExploreContent = () => {
         </div>
       )}
 
+      {/* Loads the next page when scrolled into view */}
+      {!loading && nextCursor && (
+        <div ref={loadMoreRef} className="flex justify-center items-center py-8">
+          {loadingMore && <div className="animate-spin rounded-full h-8 w-8 border-t-2 border-b-2 border-custom-blue"></div>}
+        </div>
+      )}
+
       <AuthModals 
         isLoginOpen={isLoginOpen}
         isSignupOpen={isSignupOpen}